@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_bbox.py
+#*******************************************************************************
+
+#Purpose:
+#Compute Terrestrial Water Storage Anomalies from GRACE for longitude/latitude
+#boxes. Given the summed-area tables prepared by shbaam_sats.py and one or
+#several boxes, this script finds the ranges of grid cells whose centers are
+#within each box and produces a CSV time series of the anomaly (in cm) that is
+#spatially averaged over each box. The sums over a box are given by four values
+#of each table per time step, whatever the size of the box, and the tables are
+#memory-mapped so that only these values are read. As in shbaam_twsa.py, grid
+#cells that have NoData in the GRACE scale factors are ignored in the averaging.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import numpy
+import datetime
+import csv
+import shbaam_mmap
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_sat_ncf
+# 2 - shb_wsa_csv
+# 3 - shb_box (given as lon_min,lat_min,lon_max,lat_max with longitudes in
+#              [-180;180], a box that crosses the antimeridian has lon_min
+#              greater than lon_max)
+#(4)- other boxes given as shb_box, shb_wsa_csv has one column per box
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 4:
+     print('ERROR - A minimum of 3 arguments must be used')
+     raise SystemExit(22)
+
+shb_sat_ncf=sys.argv[1]
+shb_wsa_csv=sys.argv[2]
+YV_box=sys.argv[3:]
+
+IS_box_tot=len(YV_box)
+ZM_box=numpy.zeros((IS_box_tot,4))
+for JS_box in range(IS_box_tot):
+     try:
+          ZM_box[JS_box,:]=[float(YS_val) for YS_val in                        \
+                            YV_box[JS_box].split(',')]
+     except ValueError:
+          print('ERROR - Boxes must be given as lon_min,lat_min,lon_max,'      \
+                +'lat_max: '+YV_box[JS_box])
+          raise SystemExit(22)
+     if ZM_box[JS_box,1] >= ZM_box[JS_box,3]:
+          print('ERROR - The minimum latitude must be less than the maximum '  \
+                +'latitude: '+YV_box[JS_box])
+          raise SystemExit(22)
+
+
+#*******************************************************************************
+#Print input information
+#*******************************************************************************
+print('Command line inputs')
+print(' - '+shb_sat_ncf)
+print(' - '+shb_wsa_csv)
+for YS_box in YV_box:
+     print(' - '+YS_box)
+
+
+#*******************************************************************************
+#Check if files exist
+#*******************************************************************************
+try:
+     with open(shb_sat_ncf) as file:
+          pass
+except IOError as e:
+     print('ERROR - Unable to open '+shb_sat_ncf)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read summed-area tables netCDF file
+#*******************************************************************************
+print('Read summed-area tables netCDF file')
+
+h = shbaam_mmap.shb_ncf_opn(shb_sat_ncf,True)
+
+IS_grc_lon=len(h.dimensions['lon'])
+print(' - The number of longitudes is: '+str(IS_grc_lon))
+
+IS_grc_lat=len(h.dimensions['lat'])
+print(' - The number of latitudes is: '+str(IS_grc_lat))
+
+IS_grc_time=len(h.dimensions['time'])
+print(' - The number of time steps is: '+str(IS_grc_time))
+
+ZV_grc_lon=h.variables['lon']
+ZV_grc_lat=h.variables['lat']
+ZV_grc_time=h.variables['time']
+
+print(' - The baseline period is: '+h.getncattr('baseline_start')+' to '       \
+      +h.getncattr('baseline_end'))
+
+
+#*******************************************************************************
+#Determine time strings
+#*******************************************************************************
+print('Determine time strings')
+shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                  \
+                                         '%Y-%m-%dT%H:%M:%S')
+
+YV_grc_time=[]
+for JS_grc_time in range(IS_grc_time):
+     shb_dat_dlt=datetime.timedelta(days=float(ZV_grc_time[JS_grc_time]))
+     YS_grc_time=(shb_dat_str+shb_dat_dlt).strftime('%m/%d/%Y')
+     YV_grc_time.append(YS_grc_time)
+
+
+#*******************************************************************************
+#Shift GRACE longitude range from [0;360] to [-180;180]
+#*******************************************************************************
+print('Shift GRACE longitude range from [0;360] to [-180;180]')
+
+ZV_grc_lon_180=numpy.array(ZV_grc_lon[:])
+ZV_grc_lon_180[ZV_grc_lon_180 > 180]=ZV_grc_lon_180[ZV_grc_lon_180 > 180]-360
+ZV_grc_lon_180=ZV_grc_lon_180.astype(numpy.float64)
+ZV_grc_lat_180=numpy.array(ZV_grc_lat[:]).astype(numpy.float64)
+#The shift is made in the precision of the file, as in shbaam_twsa.py
+
+
+#*******************************************************************************
+#Define the sum over ranges of grid cells
+#*******************************************************************************
+def shb_sat_sum(ZV_sat,IV_rng_lat,IV_rng_lon):
+     ZS_sum=0
+     for JS_lat_beg,JS_lat_end in IV_rng_lat:
+          for JS_lon_beg,JS_lon_end in IV_rng_lon:
+               ZS_sum=ZS_sum+ZV_sat[...,JS_lat_end,JS_lon_end]                 \
+                            -ZV_sat[...,JS_lat_beg,JS_lon_end]                 \
+                            -ZV_sat[...,JS_lat_end,JS_lon_beg]                 \
+                            +ZV_sat[...,JS_lat_beg,JS_lon_beg]
+     return ZS_sum
+#Sum of a summed-area table (time x lat_sat x lon_sat, or lat_sat x lon_sat)
+#over the rectangles given by ranges of latitudes and longitudes
+
+def shb_rng_get(BV_in):
+     IV_in=numpy.flatnonzero(BV_in)
+     if len(IV_in)==0:
+          return []
+     IV_cut=numpy.flatnonzero(numpy.diff(IV_in) > 1)+1
+     return [(int(IV_run[0]),int(IV_run[-1])+1)                                \
+             for IV_run in numpy.split(IV_in,IV_cut)]
+#Ranges [beg;end) of consecutive indices where BV_in is True
+
+
+#*******************************************************************************
+#Compute terrestrial water storage anomalies for each box
+#*******************************************************************************
+print('Compute terrestrial water storage anomalies for each box')
+
+ZM_wsa=numpy.zeros((IS_grc_time,IS_box_tot))
+
+for JS_box in range(IS_box_tot):
+     ZS_box_lon_min,ZS_box_lat_min,ZS_box_lon_max,ZS_box_lat_max=              \
+                                                                ZM_box[JS_box,:]
+
+     IV_rng_lat=shb_rng_get((ZV_grc_lat_180 > ZS_box_lat_min)                  \
+                           &(ZV_grc_lat_180 < ZS_box_lat_max))
+     if ZS_box_lon_min < ZS_box_lon_max:
+          IV_rng_lon=shb_rng_get((ZV_grc_lon_180 > ZS_box_lon_min)             \
+                                &(ZV_grc_lon_180 < ZS_box_lon_max))
+     else:
+          IV_rng_lon=shb_rng_get((ZV_grc_lon_180 > ZS_box_lon_min)             \
+                                |(ZV_grc_lon_180 < ZS_box_lon_max))
+     #Grid cells whose centers are strictly within the box, as a polygon
+     #contains the centers in shbaam_twsa.py
+
+     IS_box_cel=sum([JS_end-JS_beg for JS_beg,JS_end in IV_rng_lat])           \
+               *sum([JS_end-JS_beg for JS_beg,JS_end in IV_rng_lon])
+     print(' - '+YV_box[JS_box])
+     print('   - The number of grid cells found is: '+str(IS_box_cel))
+     if IS_box_cel==0:
+          print('ERROR - No GRACE grid cells found within the box')
+          raise SystemExit(22)
+
+     ZS_box_sqm=float(shb_sat_sum(h.variables['area_sum'],                     \
+                                  IV_rng_lat,IV_rng_lon))
+     print('   - The area (m2) for the box is: '+str(ZS_box_sqm))
+     if ZS_box_sqm <= 0:
+          print('   - WARNING: the box has no valid grid cell, its '           \
+                +'timeseries is not a number')
+          ZM_wsa[:,JS_box]=numpy.nan
+          continue
+
+     ZV_wsa_sum=shb_sat_sum(h.variables['lwe_thickness_sum'],                  \
+                            IV_rng_lat,IV_rng_lon)
+     IV_nan_cnt=shb_sat_sum(h.variables['nodata_count'],                       \
+                            IV_rng_lat,IV_rng_lon)
+     #Four values per time step are read for each rectangle
+
+     ZM_wsa[:,JS_box]=numpy.where(IV_nan_cnt > 0,numpy.nan,                    \
+                                  numpy.ma.getdata(ZV_wsa_sum)/ZS_box_sqm)
+
+
+#*******************************************************************************
+#Write shb_wsa_csv
+#*******************************************************************************
+print('Write shb_wsa_csv')
+
+with open(shb_wsa_csv, 'w') as csvfile:
+     csvwriter = csv.writer(csvfile, dialect='excel')
+     csvwriter.writerow(['date']+YV_box)
+     for JS_grc_time in range(IS_grc_time):
+          IV_line=[YV_grc_time[JS_grc_time]]+ZM_wsa[JS_grc_time,:].tolist()
+          csvwriter.writerow(IV_line)
+
+
+#*******************************************************************************
+#Close netCDF files
+#*******************************************************************************
+print('Close netCDF files')
+
+h.close()
+
+
+#*******************************************************************************
+#Check some computations
+#*******************************************************************************
+print('Check some computations')
+print('- Average of time series: '+str(numpy.nanmean(ZM_wsa)))
+print('- Maximum of time series: '+str(numpy.nanmax(ZM_wsa)))
+print('- Minimum of time series: '+str(numpy.nanmin(ZM_wsa)))
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
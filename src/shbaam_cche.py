@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_cche.py
+#*******************************************************************************
+
+#Purpose:
+#Content-addressed cache for the domain information that SHBAAM scripts derive
+#from a polygon shapefile and a grid (selected grid cells, their areas and the
+#associated masks). Entries are keyed by a hash of the polygon geometries, of
+#the grid coordinates, and of the content of any ancillary file (e.g. the GRACE
+#scale factors), so that repeat runs with a new release of data on the same
+#grid can skip the geometry work. Entries are stored as NumPy '.npz' files in a
+#cache folder and are evicted by age and by total size of the folder.
+#The functions of this script are used by shbaam_twsa.py and shbaam_lsma.py.
+#When used from the command line, this script evicts stale cache entries.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os
+import glob
+import time
+import hashlib
+import numpy
+import shapely.geometry
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_cch_dir
+# 2 - ZS_cch_mb
+# 3 - ZS_cch_day
+
+
+#*******************************************************************************
+#Compute the key of a cache entry
+#*******************************************************************************
+def shb_cch_key(YS_cch_knd,shb_pol_lay,YS_reg_key,ZV_lon,ZV_lat,YV_fil):
+     '''
+     Hash the polygon geometries (and the attribute used to group them into
+     regions, if any), the grid coordinates and the content of ancillary files.
+     YS_cch_knd distinguishes the scripts that store different information.
+     '''
+     shb_hsh=hashlib.sha256()
+     shb_hsh.update(YS_cch_knd.encode('utf-8'))
+
+     for shb_pol_fea in shb_pol_lay:
+          shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
+          shb_hsh.update(shb_pol_shy.wkb)
+          if YS_reg_key!='NONE':
+               shb_hsh.update(                                                 \
+                    str(shb_pol_fea['properties'][YS_reg_key]).encode('utf-8'))
+          shb_hsh.update(b';')
+
+     shb_hsh.update(numpy.ascontiguousarray(ZV_lon,dtype=numpy.float64))
+     shb_hsh.update(numpy.ascontiguousarray(ZV_lat,dtype=numpy.float64))
+
+     for YS_fil in YV_fil:
+          with open(YS_fil,'rb') as shb_fil:
+               for YS_blk in iter(lambda: shb_fil.read(1048576), b''):
+                    shb_hsh.update(YS_blk)
+
+     return shb_hsh.hexdigest()
+
+
+#*******************************************************************************
+#Get a cache entry
+#*******************************************************************************
+def shb_cch_get(shb_cch_dir,YS_cch_key):
+     '''
+     Return a dictionary of arrays if the entry exists, None otherwise. The
+     modification time of an entry that is used is updated for eviction by age.
+     '''
+     shb_cch_npz=os.path.join(shb_cch_dir,YS_cch_key+'.npz')
+     if not os.path.isfile(shb_cch_npz):
+          return None
+     try:
+          with numpy.load(shb_cch_npz,allow_pickle=False) as shb_cch_dat:
+               shb_cch_dic={YS_var: shb_cch_dat[YS_var]                        \
+                            for YS_var in shb_cch_dat.files}
+     except (IOError,OSError,ValueError):
+          return None
+     os.utime(shb_cch_npz,None)
+     return shb_cch_dic
+
+
+#*******************************************************************************
+#Put a cache entry
+#*******************************************************************************
+def shb_cch_put(shb_cch_dir,YS_cch_key,shb_cch_dic):
+     '''
+     Store a dictionary of arrays, the file is first written under a temporary
+     name and then renamed so that concurrent runs never read partial entries.
+     '''
+     if not os.path.isdir(shb_cch_dir):
+          os.makedirs(shb_cch_dir)
+     shb_cch_npz=os.path.join(shb_cch_dir,YS_cch_key+'.npz')
+     shb_cch_tmp=os.path.join(shb_cch_dir,                                     \
+                              YS_cch_key+'.'+str(os.getpid())+'.tmp.npz')
+     numpy.savez(shb_cch_tmp,**shb_cch_dic)
+     os.replace(shb_cch_tmp,shb_cch_npz)
+
+
+#*******************************************************************************
+#Evict cache entries by age and by size
+#*******************************************************************************
+def shb_cch_evc(shb_cch_dir,ZS_cch_mb,ZS_cch_day):
+     '''
+     Remove the entries that were not used for more than ZS_cch_day days, then
+     the least recently used entries until the cache is smaller than ZS_cch_mb
+     megabytes. Returns the number of entries removed.
+     '''
+     IS_evc=0
+     ZS_now=time.time()
+     shb_ent_lst=[]
+     for shb_cch_npz in glob.glob(os.path.join(shb_cch_dir,'*.npz')):
+          if shb_cch_npz.endswith('.tmp.npz'):
+               continue
+          try:
+               shb_cch_sta=os.stat(shb_cch_npz)
+          except OSError:
+               continue
+          shb_ent_lst.append((shb_cch_sta.st_mtime,shb_cch_sta.st_size,        \
+                              shb_cch_npz))
+     shb_ent_lst.sort()
+     #From least to most recently used
+
+     ZS_cch_byt=sum([shb_ent[1] for shb_ent in shb_ent_lst])
+     for ZS_ent_tim,IS_ent_byt,shb_cch_npz in shb_ent_lst:
+          if (ZS_now-ZS_ent_tim > ZS_cch_day*86400)                            \
+          or (ZS_cch_byt > ZS_cch_mb*1048576):
+               try:
+                    os.remove(shb_cch_npz)
+               except OSError:
+                    continue
+               ZS_cch_byt=ZS_cch_byt-IS_ent_byt
+               IS_evc=IS_evc+1
+     return IS_evc
+
+
+#*******************************************************************************
+#Evict stale cache entries when used from the command line
+#*******************************************************************************
+if __name__=='__main__':
+
+     IS_arg=len(sys.argv)
+     if IS_arg != 4:
+          print('ERROR - 3 and only 3 arguments can be used')
+          raise SystemExit(22)
+
+     shb_cch_dir=sys.argv[1]
+     ZS_cch_mb=float(sys.argv[2])
+     ZS_cch_day=float(sys.argv[3])
+
+     print('Command line inputs')
+     print(' - '+shb_cch_dir)
+     print(' - '+str(ZS_cch_mb))
+     print(' - '+str(ZS_cch_day))
+
+     if not os.path.isdir(shb_cch_dir):
+          print('ERROR - Directory does not exist: '+shb_cch_dir)
+          raise SystemExit(22)
+
+     print('Evict stale cache entries')
+     IS_evc=shb_cch_evc(shb_cch_dir,ZS_cch_mb,ZS_cch_day)
+     print(' - The number of entries evicted is: '+str(IS_evc))
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_indx.py
+#*******************************************************************************
+
+#Purpose:
+#Index of a tree of monthly GLDAS netCDF files (GLDAS_<MODEL>10_M/<year>/*.nc4)
+#that is read as one virtual time series instead of a concatenated file made by
+#shbaam_conc.py. The index is a JSON file that records the dimensions, variables
+#and attributes of the first file, and for each file its path, size and time of
+#modification, its time values, and the storage layout of its variables (shape,
+#data type, byte order, chunks and filters). The index is refreshed in place:
+#only the files that are new or that changed since the previous index are
+#opened, so adding one month opens one file.
+#The virtual dataset has dask arrays with one chunk per file, a selection of
+#grid cells is read from each file as a hyperslab by the netCDF library.
+#The functions of this script are used by shbaam_lsma.py.
+#When used from the command line, this script builds or refreshes an index.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os
+import glob
+import json
+import threading
+import numpy
+import netCDF4
+import xarray
+import xarray.backends.common
+import xarray.core.indexing
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_gld_dir
+# 2 - shb_idx_jsn
+
+
+#*******************************************************************************
+#Lock for reading files
+#*******************************************************************************
+shb_idx_lck=threading.Lock()
+#dask may read several chunks at once, the netCDF library is not thread-safe
+
+
+#*******************************************************************************
+#Encode and decode attributes
+#*******************************************************************************
+def shb_idx_enc(shb_obj):
+     '''
+     Attributes of a netCDF4 variable or dataset, numeric values keep their data
+     type so that masking and scaling are the same as with the files.
+     '''
+     shb_att_dic={}
+     for YS_att in shb_obj.ncattrs():
+          shb_att=shb_obj.getncattr(YS_att)
+          if isinstance(shb_att,str):
+               shb_att_dic[YS_att]=shb_att
+          else:
+               shb_att=numpy.asarray(shb_att)
+               shb_att_dic[YS_att]={'dtype': shb_att.dtype.str,                \
+                                    'value': shb_att.tolist()}
+     return shb_att_dic
+
+def shb_idx_dec(shb_att_dic):
+     '''
+     Inverse of shb_idx_enc, numeric values are given as NumPy scalars or
+     arrays.
+     '''
+     shb_att_out={}
+     for YS_att in shb_att_dic:
+          shb_att=shb_att_dic[YS_att]
+          if isinstance(shb_att,str):
+               shb_att_out[YS_att]=shb_att
+          else:
+               shb_att_out[YS_att]=numpy.array(shb_att['value'],               \
+                                               dtype=shb_att['dtype'])[()]
+     return shb_att_out
+
+
+#*******************************************************************************
+#Describe one file
+#*******************************************************************************
+def shb_idx_fil(YS_gld_ncf):
+     '''
+     Time values and storage layout of the variables of one file, and the
+     description of its dimensions and variables.
+     '''
+     f = netCDF4.Dataset(YS_gld_ncf, 'r')
+     f.set_auto_maskandscale(False)
+
+     shb_fil_dic={'time': {'dtype': f.variables['time'].dtype.str,             \
+                           'value': f.variables['time'][:].tolist()},          \
+                  'time_units': f.variables['time'].units,                     \
+                  'layouts': {}}
+     shb_dsc_dic={'dimensions': {},'variables': {},                            \
+                  'attributes': shb_idx_enc(f)}
+
+     for YS_dim in f.dimensions:
+          if YS_dim!='time':
+               shb_dsc_dic['dimensions'][YS_dim]=len(f.dimensions[YS_dim])
+
+     for YS_var in f.variables:
+          var=f.variables[YS_var]
+          shb_dsc_dic['variables'][YS_var]={'dimensions': list(var.dimensions),\
+                                            'dtype': var.dtype.str,            \
+                                            'attributes': shb_idx_enc(var)}
+          shb_fil_dic['layouts'][YS_var]={'shape': list(var.shape),            \
+                                          'dtype': var.dtype.str,              \
+                                          'endian': var.endian(),              \
+                                          'chunking': var.chunking(),          \
+                                          'filters': var.filters()}
+     f.close()
+     return shb_fil_dic,shb_dsc_dic
+
+
+#*******************************************************************************
+#Build or refresh an index
+#*******************************************************************************
+def shb_idx_bld(shb_gld_dir,shb_idx_jsn):
+     '''
+     Index all '*/*.nc4' files of shb_gld_dir in the order of their names, the
+     entries of a previous index are kept for files whose size and time of
+     modification did not change. Returns the index and the number of files
+     that were opened.
+     '''
+     YV_gld_ncf=sorted(glob.glob(os.path.join(shb_gld_dir,'*','*.nc4')))
+     if len(YV_gld_ncf)==0:
+          print('ERROR - No files found in: '+shb_gld_dir)
+          raise SystemExit(22)
+
+     shb_old_dic={}
+     if os.path.isfile(shb_idx_jsn):
+          with open(shb_idx_jsn) as shb_fil:
+               shb_old_idx=json.load(shb_fil)
+          shb_old_dic={shb_ent['path']: shb_ent                                \
+                       for shb_ent in shb_old_idx['files']}
+     else:
+          shb_old_idx=None
+
+     shb_idx={'root': os.path.relpath(shb_gld_dir,                             \
+                           os.path.dirname(os.path.abspath(shb_idx_jsn))),     \
+              'files': []}
+     shb_dsc_dic=None
+     IS_opn=0
+     for YS_gld_ncf in YV_gld_ncf:
+          YS_rel=os.path.relpath(YS_gld_ncf,shb_gld_dir)
+          shb_sta=os.stat(YS_gld_ncf)
+          shb_ent=shb_old_dic.get(YS_rel)
+          if shb_ent is None or shb_ent['size']!=shb_sta.st_size               \
+                             or shb_ent['mtime']!=shb_sta.st_mtime:
+               shb_ent,shb_one_dic=shb_idx_fil(YS_gld_ncf)
+               shb_ent['path']=YS_rel
+               shb_ent['size']=shb_sta.st_size
+               shb_ent['mtime']=shb_sta.st_mtime
+               IS_opn=IS_opn+1
+               if shb_dsc_dic is None and len(shb_idx['files'])==0:
+                    shb_dsc_dic=shb_one_dic
+          shb_idx['files'].append(shb_ent)
+     #Only new or modified files are opened
+
+     if shb_dsc_dic is None:
+          shb_dsc_dic={YS_key: shb_old_idx[YS_key]                             \
+                       for YS_key in ['dimensions','variables','attributes']}
+     #The description comes from the first file
+     shb_idx.update(shb_dsc_dic)
+
+     for shb_ent in shb_idx['files']:
+          for YS_var in shb_idx['variables']:
+               shb_var=shb_idx['variables'][YS_var]
+               shb_lay=shb_ent['layouts'].get(YS_var)
+               if shb_lay is None or shb_lay['dtype']!=shb_var['dtype']        \
+                  or shb_lay['shape'][shb_var['dimensions'][:1]==['time']:]    \
+                  !=[shb_idx['dimensions'][YS_dim] for YS_dim in               \
+                     shb_var['dimensions'] if YS_dim!='time']:
+                    print('ERROR - The variable '+YS_var+' of '                \
+                          +shb_ent['path']+' differs from that of '            \
+                          +shb_idx['files'][0]['path'])
+                    raise SystemExit(22)
+
+     shb_idx_tmp=shb_idx_jsn+'.'+str(os.getpid())+'.tmp'
+     with open(shb_idx_tmp,'w') as shb_fil:
+          json.dump(shb_idx,shb_fil)
+     os.replace(shb_idx_tmp,shb_idx_jsn)
+     #As for the cache of shbaam_cche.py, readers never see a partial index
+
+     return shb_idx,IS_opn
+
+
+#*******************************************************************************
+#Virtual array of one variable
+#*******************************************************************************
+class shb_idx_arr(xarray.backends.common.BackendArray):
+     '''
+     A variable of all indexed files, concatenated along time if it has a time
+     dimension and taken from the first file otherwise. Values are read raw,
+     masking, scaling and time decoding are left to xarray as for the files
+     opened by xarray.open_dataset, and lazily so that a selection of grid
+     cells is only read from each file.
+     '''
+     def __init__(self,YV_gld_ncf,IV_fil_beg,YS_var,IV_shp,shb_dty):
+          self.YV_gld_ncf=YV_gld_ncf
+          self.IV_fil_beg=IV_fil_beg
+          self.YS_var=YS_var
+          self.shape=tuple(IV_shp)
+          self.dtype=numpy.dtype(shb_dty)
+
+     def shb_red(self,YS_gld_ncf,shb_idx):
+          with shb_idx_lck:
+               f = netCDF4.Dataset(YS_gld_ncf, 'r')
+               f.set_auto_maskandscale(False)
+               ZV_dat=numpy.asarray(f.variables[self.YS_var][shb_idx])
+               f.close()
+          return ZV_dat
+
+     def shb_raw(self,shb_idx):
+          if self.IV_fil_beg is None:
+               return self.shb_red(self.YV_gld_ncf[0],shb_idx)
+
+          IV_time=numpy.arange(self.shape[0])[shb_idx[0]]
+          BS_int=(IV_time.ndim==0)
+          IV_time=numpy.atleast_1d(IV_time)
+          ZV_blk=[]
+          for JS_fil in range(len(self.YV_gld_ncf)):
+               JS_fil_beg=self.IV_fil_beg[JS_fil]
+               JS_fil_end=self.IV_fil_beg[JS_fil+1]
+               BV_fil=(IV_time >= JS_fil_beg) & (IV_time < JS_fil_end)
+               if BV_fil.any():
+                    ZV_blk.append(self.shb_red(self.YV_gld_ncf[JS_fil],        \
+                                  (IV_time[BV_fil]-JS_fil_beg,)+shb_idx[1:]))
+          #Time steps are read from each file that has some, along with the
+          #same selection of the other dimensions
+          if len(ZV_blk)==0:
+               ZV_dat=numpy.zeros((0,)+self.shape[1:],dtype=self.dtype)        \
+                                                 [(slice(None),)+shb_idx[1:]]
+          else:
+               ZV_dat=numpy.concatenate(ZV_blk,axis=0)
+          if BS_int:
+               ZV_dat=ZV_dat[0]
+          return ZV_dat
+
+     def __getitem__(self,shb_key):
+          return xarray.core.indexing.explicit_indexing_adapter(shb_key,       \
+                         self.shape,xarray.core.indexing.IndexingSupport.OUTER,\
+                         self.shb_raw)
+          #Orthogonal indexing, as supported by netCDF4
+
+
+#*******************************************************************************
+#Open an index as a dataset
+#*******************************************************************************
+def shb_idx_opn(shb_idx_jsn):
+     '''
+     Lazy xarray dataset of the indexed files, decoded as xarray.open_dataset
+     decodes a concatenated file. Time values are converted to the units of the
+     first file.
+     '''
+     with open(shb_idx_jsn) as shb_fil:
+          shb_idx=json.load(shb_fil)
+
+     YS_gld_dir=os.path.join(os.path.dirname(os.path.abspath(shb_idx_jsn)),    \
+                             shb_idx['root'])
+     YV_gld_ncf=[os.path.join(YS_gld_dir,shb_ent['path'])                      \
+                 for shb_ent in shb_idx['files']]
+     IV_fil_tim=[len(shb_ent['time']['value']) for shb_ent in shb_idx['files']]
+     IV_fil_beg=numpy.concatenate(([0],numpy.cumsum(IV_fil_tim))).tolist()
+     IS_time=IV_fil_beg[-1]
+
+     shb_tim_var=shb_idx['variables']['time']
+     YS_tim_unt=shb_idx['files'][0]['time_units']
+     YS_tim_cal=shb_idx_dec(shb_tim_var['attributes']).get('calendar',         \
+                                                            'standard')
+     ZV_time=[]
+     for shb_ent in shb_idx['files']:
+          ZV_fil_tim=numpy.array(shb_ent['time']['value'],                     \
+                                 dtype=shb_ent['time']['dtype'])
+          if shb_ent['time_units']!=YS_tim_unt:
+               ZV_fil_tim=netCDF4.date2num(netCDF4.num2date(ZV_fil_tim,        \
+                                          shb_ent['time_units'],YS_tim_cal),   \
+                                          YS_tim_unt,YS_tim_cal)               \
+                                          .astype(ZV_fil_tim.dtype)
+          ZV_time.append(ZV_fil_tim)
+     ZV_time=numpy.concatenate(ZV_time)
+
+     shb_var_dic={}
+     for YS_var in shb_idx['variables']:
+          shb_var=shb_idx['variables'][YS_var]
+          YV_dim=shb_var['dimensions']
+          shb_att=shb_idx_dec(shb_var['attributes'])
+          if YS_var=='time':
+               shb_att['units']=YS_tim_unt
+               shb_var_dic[YS_var]=xarray.Variable(YV_dim,ZV_time,shb_att)
+               continue
+          if YV_dim[:1]==['time']:
+               IV_shp=[IS_time]+[shb_idx['dimensions'][YS_dim]                 \
+                                 for YS_dim in YV_dim[1:]]
+               shb_arr=shb_idx_arr(YV_gld_ncf,IV_fil_beg,YS_var,IV_shp,        \
+                                   shb_var['dtype'])
+          else:
+               IV_shp=[shb_idx['dimensions'][YS_dim] for YS_dim in YV_dim]
+               shb_arr=shb_idx_arr(YV_gld_ncf,None,YS_var,IV_shp,              \
+                                   shb_var['dtype'])
+          shb_var_dic[YS_var]=xarray.Variable(YV_dim,                          \
+                         xarray.core.indexing.LazilyOuterIndexedArray(shb_arr),\
+                         shb_att)
+          #LazilyOuterIndexedArray is the name of xarray 0.12, which later
+          #versions keep as an alias
+
+     YV_crd=[YS_var for YS_var in shb_var_dic                                  \
+             if shb_var_dic[YS_var].dims==(YS_var,)]
+     shb_dst=xarray.Dataset({YS_var: shb_var_dic[YS_var]                       \
+                             for YS_var in shb_var_dic                         \
+                             if YS_var not in YV_crd},                         \
+                            coords={YS_var: shb_var_dic[YS_var]                \
+                                    for YS_var in YV_crd},                     \
+                            attrs=shb_idx_dec(shb_idx['attributes']))
+     return xarray.decode_cf(shb_dst).chunk({'time': tuple(IV_fil_tim)})
+     #One dask chunk per file, the other dimensions are not chunked
+
+
+#*******************************************************************************
+#Build or refresh an index when used from the command line
+#*******************************************************************************
+if __name__=='__main__':
+
+     IS_arg=len(sys.argv)
+     if IS_arg != 3:
+          print('ERROR - 2 and only 2 arguments can be used')
+          raise SystemExit(22)
+
+     shb_gld_dir=sys.argv[1]
+     shb_idx_jsn=sys.argv[2]
+
+     print('Command line inputs')
+     print(' - '+shb_gld_dir)
+     print(' - '+shb_idx_jsn)
+
+     if not os.path.isdir(shb_gld_dir):
+          print('ERROR - Directory does not exist: '+shb_gld_dir)
+          raise SystemExit(22)
+
+     print('Build or refresh index')
+     shb_idx,IS_opn=shb_idx_bld(shb_gld_dir,shb_idx_jsn)
+     print(' - The number of files indexed is: '+str(len(shb_idx['files'])))
+     print(' - The number of files opened is: '+str(IS_opn))
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
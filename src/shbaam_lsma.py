@@ -19,6 +19,7 @@
 #Import Python modules
 #*******************************************************************************
 import sys
+import os
 from netCDF4 import Dataset, num2date, date2num
 import fiona
 import shapely.geometry
@@ -29,15 +30,56 @@ import numpy
 import csv
 import datetime
 import xarray as xr
+import multiprocessing
+import shbaam_cche
 
 #*******************************************************************************
 #Declaration of variables (given as command line arguments)
 #*******************************************************************************
-# 1 - concatenated GLDAS data in netcdf format
-# 2 - shapefile of format '.shp'
+# 1 - concatenated GLDAS data in netcdf format, or index of format '.json' of
+#     a tree of monthly GLDAS files built by shbaam_indx.py, or several of them
+#     on the same grid (e.g. one per model) separated by commas that share one
+#     domain selection
+# 2 - shapefile of format '.shp', or netCDF label raster of format '.nc' on the
+#     GLDAS grid where each distinct label is a region (see --lab_var)
 # 3 - output shapefile of GLDAS coordinates for region of interest
-# 4 - output csv file time series of region mean anomalies
-# 5 - output (3-dimensional) netcdf file of GLDAS anomalies
+# 4 - output csv file time series of region mean anomalies, one per
+#     concatenated file separated by commas
+# 5 - output (3-dimensional) netcdf file of GLDAS anomalies, one per
+#     concatenated file separated by commas
+#(6)- optional arguments given as --name=value:
+#     --cch     - folder for a persistent cache of the domain (selected cells 
+#                 and areas), keyed by the content of the polygon geometries
+#                 and of the grid coordinates (default is NONE: no cache)
+#     --cch_mb  - maximum size of the cache folder in megabytes (default 1024)
+#     --cch_day - maximum number of days since the last use of a cache entry
+#                 (default 90)
+#     --lab_var - name of the integer variable of dimensions (lat,lon) in the
+#                 label raster (default label). Grid cells with the fill value
+#                 belong to no region, the csv file then has one column per 
+#                 variable and region, named variable_label, and no point 
+#                 shapefile, rtree or cache is used
+#     --zlb     - zlib compression level of the nc4 file from 0 (default, no
+#                 compression) to 9
+#     --shf     - use the HDF5 shuffle filter with compression: 1 (default) or 0
+#     --chk     - chunk shape of the nc4 file given as time,lat,lon (e.g.
+#                 12,60,60), default is NONE for the netCDF library default
+#     --crp     - crop the nc4 file to the bounding box of the domain plus a
+#                 halo given as a number of grid cells, e.g. 0 or 2 (default is
+#                 NONE: the full grid is used). The zero-based indices of the
+#                 first latitude and longitude of the cropped grid are stored
+#                 in global attributes
+#     --lay     - layout of the nc4 file: grid (default) for (time,lat,lon)
+#                 anomalies on the GLDAS grid with NaN outside the domain, or
+#                 cell for the CF featureType 'timeSeries' with a cell
+#                 dimension that holds the domain cells only, their lat, lon,
+#                 indices in the grid and area being variables of cell, and
+#                 (time,cell) anomalies. --chk then gives the time size of
+#                 chunks that hold all cells (default is one chunk), and --crp
+#                 cannot be used
+#     --workers - number of worker processes that process the concatenated
+#                 files concurrently (default is the smaller of the number
+#                 of concatenated files and of processors)
 
 #*******************************************************************************
 #Get command line arguments
@@ -57,19 +99,20 @@ print(' - '+fin[4])
 #*******************************************************************************
 #Check crs of input shapefile
 #*******************************************************************************
-# read polygon shapefile
-
-polygon = fiona.open(fin[1], 'r')
-if 'PROJCS' in polygon.crs_wkt:
-    print('ERRROR the coordinate reference system of ' + fin[1] + ' is incompatible with shbaam')
-    print('\tSet the crs of ' + fin[1] + ' to a compatable crs')
-    print('\tThese include: EPSG:4326, EPSG:4269, or EPSG: 4267')
-    raise SystemExit(22)
-elif 'GEOGCS' not in polygon.crs_wkt:
-    print('ERROR the coordinate reference system of ' + fin[1] + ' is not defined')
-    print('\tSet the crs of ' + fin[1] + ' to a compatable crs')
-    print('\tThese include: EPSG:4326, EPSG:4269, or EPSG: 4267')
-    raise SystemExit(22)
+# read polygon shapefile, a label raster has the coordinates of the GLDAS grid
+
+if not fin[1].lower().endswith('.nc'):
+    polygon = fiona.open(fin[1], 'r')
+    if 'PROJCS' in polygon.crs_wkt:
+        print('ERRROR the coordinate reference system of ' + fin[1] + ' is incompatible with shbaam')
+        print('\tSet the crs of ' + fin[1] + ' to a compatable crs')
+        print('\tThese include: EPSG:4326, EPSG:4269, or EPSG: 4267')
+        raise SystemExit(22)
+    elif 'GEOGCS' not in polygon.crs_wkt:
+        print('ERROR the coordinate reference system of ' + fin[1] + ' is not defined')
+        print('\tSet the crs of ' + fin[1] + ' to a compatable crs')
+        print('\tThese include: EPSG:4326, EPSG:4269, or EPSG: 4267')
+        raise SystemExit(22)
 
 # the other way to do this check is to evaluate poly.crs
 # if (polygon.crs['init'] != 'epsg:4326): EPSG:4269 : (EPSG: 4267):
@@ -96,7 +139,7 @@ def createPointShp(input_shp, output_shp, num_lon, num_lat, lons, lats):
             for lat_index in range(num_lat):
                 latitude = lats[lat_index]
 
-                pf_property = { 'lon': longitude, 'lat': latitude,
+                pf_property = { 'lon': float(longitude), 'lat': float(latitude),
                                 'lon_index': lon_index, 'lat_index': lat_index,}
                 pf_geometry = shapely.geometry.mapping(
                             shapely.geometry.Point((longitude, latitude)))
@@ -107,6 +150,51 @@ def createPointShp(input_shp, output_shp, num_lon, num_lat, lons, lats):
 
     print('Success -- created a new shapefile')
 
+def parseOptions(args, options):
+    '''
+    Update the default options with the optional arguments given as --name=value
+    '''
+    for arg in args:
+        if not arg.startswith('--'):
+            continue
+        if '=' not in arg or arg[2:].split('=', 1)[0] not in options:
+            print('ERROR - Unknown optional argument: ' + arg)
+            raise SystemExit(22)
+        name, value = arg[2:].split('=', 1)
+        options[name] = value
+    return options
+
+def parseWriteOptions(options):
+    '''
+    Check the options of the nc4 file: zlib level, shuffle, chunk shape, halo
+    of the domain-only bounding box and layout
+    '''
+    complevel = int(options['zlb'])
+    if complevel < 0 or complevel > 9:
+        print('ERROR - The zlib compression level must be between 0 and 9')
+        raise SystemExit(22)
+    shuffle = (options['shf'] == '1')
+    chunksizes = None
+    if options['chk'] != 'NONE':
+        chunksizes = [int(i) for i in options['chk'].split(',')]
+        if len(chunksizes) != 3 or min(chunksizes) < 1:
+            print('ERROR - The chunk shape must be given as time,lat,lon')
+            raise SystemExit(22)
+    halo = None
+    if options['crp'] != 'NONE':
+        halo = int(options['crp'])
+        if halo < 0:
+            print('ERROR - The halo of the cropped grid must not be negative')
+            raise SystemExit(22)
+    layout = options['lay']
+    if layout not in ('grid', 'cell'):
+        print('ERROR - The layout of the nc4 file must be grid or cell')
+        raise SystemExit(22)
+    if layout == 'cell' and halo is not None:
+        print('ERROR - The nc4 file can only be cropped with the grid layout')
+        raise SystemExit(22)
+    return complevel, shuffle, chunksizes, halo, layout
+
 def createRtreeIndex(pf):
     idx = rtree.index.Index()
     for point in pf:
@@ -138,18 +226,88 @@ def findInterest(pol, pf, idx):
     print('The lattitude of the cells: '+ str([i[1] for i in interest_lat]) )
     return total, interest_lon, interest_lat
 
-def findAvg(var, total, interest_lon, interest_lat, time_steps):
-    #var: the nc4.variables that you want to get for average such as swe..
-    print('--Find long-term mean for each intersecting GLDAS grid cell--')
-    avg = [0.0] * total
-    for cell_index in range(total):
-        lon_index = interest_lon[cell_index][0]
-        lat_index = interest_lat[cell_index][0]
-        for time in range(time_steps):
-            avg[cell_index] = avg[cell_index] + var[time, lat_index, lon_index]
+def findLabels(label_file, label_var, num_lon, num_lat, lons, lats):
+    '''
+    Find the GLDAS grid cells of each label of a label raster, without any
+    geometry operation
+    '''
+    lf = Dataset(label_file, 'r')
+    if label_var not in lf.variables or lf[label_var].shape != (num_lat, num_lon) \
+       or lf[label_var].dtype.kind not in 'iu':
+        print('ERROR - No integer variable ' + label_var + ' on the GLDAS grid in ' + label_file)
+        raise SystemExit(22)
+    labels = lf[label_var][:, :]
+    lf.close()
+
+    lat_indices, lon_indices = numpy.nonzero(~numpy.ma.getmaskarray(labels))
+    label_values, cell_regions = numpy.unique(numpy.ma.getdata(labels)[lat_indices, lon_indices],
+                                              return_inverse=True)
+    if len(lat_indices) == 0:
+        print('ERROR - No labeled grid cells found in ' + label_file)
+        raise SystemExit(22)
+
+    total = len(lat_indices)
+    interest_lon = [(int(i), lons[i]) for i in lon_indices]
+    interest_lat = [(int(i), lats[i]) for i in lat_indices]
+    regions = [str(label) for label in label_values.tolist()]
+
+    print('The total cells found: ' + str(total))
+    print('The number of regions: ' + str(len(regions)))
+    return total, interest_lon, interest_lat, cell_regions.ravel(), regions
+
+def openModel(model_file):
+    '''
+    Open a concatenated file, or the index of a tree of monthly files built by
+    shbaam_indx.py, lazily as dask arrays
+    '''
+    if model_file.lower().endswith('.json'):
+        import shbaam_indx
+        return shbaam_indx.shb_idx_opn(model_file)
+    #shbaam_indx is only needed for an index
+    return xr.open_dataset(model_file, chunks={})
 
-    avg = [i / time_steps for i in avg]
-    print('--long-term mean:' + str(avg)+'--')
+def selectBox(ds, interest_lon, interest_lat):
+    '''
+    Select the bounding box of the domain cells in a lazily opened dataset,
+    the indices of the domain cells are shifted to the box
+    '''
+    lat_beg = min([i[0] for i in interest_lat])
+    lat_end = max([i[0] for i in interest_lat]) + 1
+    lon_beg = min([i[0] for i in interest_lon])
+    lon_end = max([i[0] for i in interest_lon]) + 1
+    box = ds.isel(lat=slice(lat_beg, lat_end), lon=slice(lon_beg, lon_end))
+    print('Bounding box of the domain (lat x lon): ' + str(lat_end - lat_beg) + ' x ' + str(lon_end - lon_beg))
+    box_lon = [(i[0] - lon_beg, i[1]) for i in interest_lon]
+    box_lat = [(i[0] - lat_beg, i[1]) for i in interest_lat]
+    return box, box_lon, box_lat
+
+def gatherCells(ds, var_list, interest_lon, interest_lat):
+    '''
+    Gather the domain cells of all variables into (variable x time x cell)
+    arrays, one per data type so that values keep their own precision
+    '''
+    lat_indices = numpy.array([i[0] for i in interest_lat], dtype=numpy.int64)
+    lon_indices = numpy.array([i[0] for i in interest_lon], dtype=numpy.int64)
+    groups = []
+    for dtype in list(dict.fromkeys([ds[var].dtype for var in var_list])):
+        names = [var for var in var_list if ds[var].dtype == dtype]
+        cells = numpy.stack([ds[var].values[:, lat_indices, lon_indices] for var in names])
+        groups.append((names, cells))
+    print('Gathered ' + str(len(var_list)) + ' variables for ' + str(len(lat_indices)) + ' cells')
+    return groups
+
+def findAvg(cells, time_steps):
+    '''
+    Long-term mean (variable x cell) of all variables, the time steps are
+    accumulated one by one from 0.0 as a loop over time would, in the same
+    precision
+    '''
+    print('--Find long-term mean for each intersecting GLDAS grid cell--')
+    acc_type = (0.0 + cells.dtype.type(0)).dtype
+    acc = numpy.concatenate((numpy.zeros((cells.shape[0], 1, cells.shape[2]), dtype=acc_type),
+                             cells.astype(acc_type)), axis=1)
+    avg = numpy.cumsum(acc, axis=1)[:, -1, :] / cells.shape[1]
+    print('--long-term mean: ' + str(int(numpy.sum(~numpy.isnan(avg)))) + ' valid of ' + str(avg.size) + '--')
     return avg
 
 def calculateSurfaceArea(total, num_lat, interest_lat, lon_step, lat_step):
@@ -166,42 +324,47 @@ def sum_SM_by_depth(dataset):
         tot_sm = dataset.SoilMoist.sum(dim='depth')
         tot_sm.attrs['units'] = 'kg/m2'
         dataset['SMTa'] = tot_sm
-        dataset = dataset.drop(['SoilMoist','depth_bnds'])
+        if hasattr(dataset, 'drop_vars'):
+            dataset = dataset.drop_vars(['SoilMoist','depth_bnds'])
+        else:
+            dataset = dataset.drop(['SoilMoist','depth_bnds'])
+        #drop_vars replaces drop from xarray 0.14, the pinned version has drop only
         print('Soil moisture summed by depth for anomaly time sereis')
     else:
         print('ERROR - No soil moisture data available. Please check input dataset.')
         raise SystemExit(22)
     return dataset
 
-def anomalyTimeseries(var, var_factor, avg, time_steps, total, interest_lon, interest_lat, areas):
+def anomalyTimeseries(names, cells, var_factors, avg, areas, region_cells):
+    '''
+    Storage anomaly timeseries (variable x time x region) of all variables.
+    Anomalies are converted and weighted in the precision of the data as with
+    scalar operations, NaN anomalies count as 0, and cells are accumulated one
+    by one in their order, so that results are identical to a loop over cells.
+    One summary line is printed for each of the variables named in names
+    '''
     print('Compute storage anomaly timeseries')
-    anomalies = []
-    total_area = sum(areas)
-    print(total_area)
-    for time in range(time_steps):
-        anomaly_in_time = 0
-        for cell_index in range(total):
-            lon_index = interest_lon[cell_index][0]
-            lat_index = interest_lat[cell_index][0]
-            area = areas[cell_index]
-            long_term_mean = avg[cell_index]
-            anomaly_in_area = (var[time, lat_index, lon_index] - long_term_mean) / var_factor * area
-            # print(anomaly_in_area)
-            if numpy.isnan(anomaly_in_area):
-                anomaly_in_time += 0
-            else:
-                anomaly_in_time += anomaly_in_area
+    anomalies = cells - avg[:, numpy.newaxis, :]
+    dtype = anomalies.dtype
+    anomalies = anomalies / numpy.array(var_factors).astype(dtype)[:, numpy.newaxis, numpy.newaxis]
+    anomalies = anomalies * numpy.array(areas).astype(dtype)
+    anomalies[numpy.isnan(anomalies)] = 0
+
+    timeseries = numpy.zeros(anomalies.shape[:2] + (len(region_cells),), dtype=dtype)
+    for region_index in range(len(region_cells)):
+        cells_in = region_cells[region_index]
+        total_area = sum([areas[i] for i in cells_in])
+        acc = numpy.concatenate((numpy.zeros(anomalies.shape[:2] + (1,), dtype=dtype),
+                                 anomalies[:, :, cells_in]), axis=2)
         # 100 changes the units of anomaly in time / total area from m to cm to be the same as grace
-        anomalies.append(100 * anomaly_in_time / total_area)
+        timeseries[:, :, region_index] = 100 * numpy.cumsum(acc, axis=2)[:, :, -1] / total_area
 
-    avgT = numpy.mean(anomalies)
-    maxT = numpy.max(anomalies)
-    minT = numpy.min(anomalies)
-    print('- Average of time series: '+str(avgT))
-    print('- Maximum of time series: '+str(maxT))
-    print('- Minimum of time series: '+str(minT))
+    for var_index in range(len(names)):
+        print('- ' + names[var_index] + ' time series average: ' + str(numpy.mean(timeseries[var_index])) +
+              ', maximum: ' + str(numpy.max(timeseries[var_index])) +
+              ', minimum: ' + str(numpy.min(timeseries[var_index])))
 
-    return anomalies
+    return timeseries
 
 
 def outputCSV(output_file, fieldnames, times, anomalies_dict):
@@ -218,12 +381,47 @@ def outputCSV(output_file, fieldnames, times, anomalies_dict):
     csvfile.close()
     print('Success -- creating csv file')
 
-def outputNC(output_file, ds, total, interest_lon, interest_lat, time_steps, var_list, avg_dict):
+def outputNC(output_file, ds, box, interest_lon, interest_lat, areas, time_steps, var_list, var_cells, avg_dict,
+             write_options):
+    '''
+    Write the anomalies of all variables with one hyperslab per block of time
+    steps, the anomalies of the domain cells are computed in memory. In the
+    grid layout the other cells are NaN, in the cell layout the file has the
+    domain cells only, along a cell dimension with their coordinates and
+    areas. ds gives the grid and box the variables. write_options holds the zlib level, shuffle, chunk shape
+    (time,lat,lon), halo of the domain-only bounding box (None for the full
+    grid) and layout
+    '''
     print('Writing new nc4 file')
+    complevel, shuffle, chunksizes, halo, layout = write_options
+    lat_indices = numpy.array([i[0] for i in interest_lat], dtype=numpy.int64)
+    lon_indices = numpy.array([i[0] for i in interest_lon], dtype=numpy.int64)
+    if halo is None:
+        lat_beg, lat_end = 0, len(ds.lat.data)
+        lon_beg, lon_end = 0, len(ds.lon.data)
+    else:
+        lat_beg = max(int(lat_indices.min()) - halo, 0)
+        lat_end = min(int(lat_indices.max()) + 1 + halo, len(ds.lat.data))
+        lon_beg = max(int(lon_indices.min()) - halo, 0)
+        lon_end = min(int(lon_indices.max()) + 1 + halo, len(ds.lon.data))
+        print('Bounding box of the domain (lat x lon): ' + str(lat_end - lat_beg) + ' x ' + str(lon_end - lon_beg))
+
+    if layout == 'cell' and chunksizes is None:
+        chunksizes = [time_steps, len(lat_indices)]
+    elif layout == 'cell':
+        chunksizes = [chunksizes[0], len(lat_indices)]
+    elif chunksizes is not None:
+        chunksizes = [chunksizes[0], min(chunksizes[1], lat_end - lat_beg), min(chunksizes[2], lon_end - lon_beg)]
+    #chunks do not exceed the size of a cropped grid, and hold all domain cells
+    #(the whole domain is one chunk by default)
+
     nc4_out = Dataset(output_file, 'w', format='NETCDF4')
     time = nc4_out.createDimension("time", None)
-    lat = nc4_out.createDimension("lat", len(ds.lat.data))
-    lon = nc4_out.createDimension("lon", len(ds.lon.data))
+    if layout == 'cell':
+        cell = nc4_out.createDimension("cell", len(lat_indices))
+    else:
+        lat = nc4_out.createDimension("lat", lat_end - lat_beg)
+        lon = nc4_out.createDimension("lon", lon_end - lon_beg)
 
     # copying dimentions
     time = nc4_out.createVariable("time", "i4", ("time",))
@@ -236,10 +434,30 @@ def outputNC(output_file, ds, total, interest_lon, interest_lat, time_steps, var
         days.append(dt.days)
     days = numpy.array(days)
     time[:] = days
-    lat = nc4_out.createVariable("lat", "f4", ("lat",))
-    lat[:] = ds.lat.data[:]
-    lon = nc4_out.createVariable("lon", "f4", ("lon",))
-    lon[:] = ds.lon.data[:]
+    if layout == 'cell':
+        cell = nc4_out.createVariable("cell", "i4", ("cell",))
+        cell[:] = numpy.arange(len(lat_indices))
+        cell.long_name = 'zero-based index of the domain cell'
+        cell.cf_role = 'timeseries_id'
+        lat = nc4_out.createVariable("lat", "f4", ("cell",))
+        lat[:] = [i[1] for i in interest_lat]
+        lon = nc4_out.createVariable("lon", "f4", ("cell",))
+        lon[:] = [i[1] for i in interest_lon]
+        lat_index = nc4_out.createVariable("lat_index", "i4", ("cell",))
+        lat_index[:] = lat_indices
+        lat_index.long_name = 'zero-based index of the latitude of the cell in the GLDAS grid'
+        lon_index = nc4_out.createVariable("lon_index", "i4", ("cell",))
+        lon_index[:] = lon_indices
+        lon_index.long_name = 'zero-based index of the longitude of the cell in the GLDAS grid'
+        area = nc4_out.createVariable("area", "f8", ("cell",))
+        area[:] = areas
+        area.long_name = 'area of the cell'
+        area.units = 'm2'
+    else:
+        lat = nc4_out.createVariable("lat", "f4", ("lat",))
+        lat[:] = ds.lat.data[lat_beg:lat_end]
+        lon = nc4_out.createVariable("lon", "f4", ("lon",))
+        lon[:] = ds.lon.data[lon_beg:lon_end]
     crs = nc4_out.createVariable("crs", "i4")
 
     if 'time' in ds.variables:
@@ -265,7 +483,7 @@ def outputNC(output_file, ds, total, interest_lon, interest_lat, time_steps, var
             lat.long_name = var.long_name
         if 'units' in var.attrs:
             lat.units = var.units
-        if 'axis' in var.attrs:
+        if 'axis' in var.attrs and layout != 'cell':
             lat.axis = var.axis
 
     if 'lon' in ds.variables:
@@ -276,13 +494,25 @@ def outputNC(output_file, ds, total, interest_lon, interest_lat, time_steps, var
             lon.long_name = var.long_name
         if 'units' in var.attrs:
             lon.units = var.units
-        if 'axis' in var.attrs:
+        if 'axis' in var.attrs and layout != 'cell':
             lon.axis = var.axis
+    #lat and lon of cells are auxiliary coordinates, which have no axis
 
     #copying variables
-    for (name, value) in ds.data_vars.items():
-        nc4_vars = nc4_out.createVariable(name, value.dtype, value.dims)
-        nc4_vars.setncatts(ds[name].attrs)
+    for (name, value) in box.data_vars.items():
+        if value.dims == ('time', 'lat', 'lon'):
+            if layout == 'cell':
+                dims = ('time', 'cell')
+            else:
+                dims = value.dims
+            nc4_vars = nc4_out.createVariable(name, value.dtype, dims,
+                                              zlib=(complevel > 0), complevel=max(complevel, 1),
+                                              shuffle=shuffle, chunksizes=chunksizes)
+        else:
+            nc4_vars = nc4_out.createVariable(name, value.dtype, value.dims)
+        nc4_vars.setncatts(box[name].attrs)
+        if value.dims == ('time', 'lat', 'lon') and layout == 'cell':
+            nc4_vars.coordinates = 'lat lon'
 
     dt = datetime.datetime.utcnow()
     dt = dt.replace(microsecond=0)
@@ -293,83 +523,202 @@ def outputNC(output_file, ds, total, interest_lon, interest_lat, time_steps, var
     nc4_out.references='https://github.com/c-h-david/shbaam/'
     nc4_out.comment=''
     nc4_out.featureType='timeSeries'
+    if halo is not None:
+        nc4_out.crop_lat_index_offset = numpy.int32(lat_beg)
+        nc4_out.crop_lon_index_offset = numpy.int32(lon_beg)
+        nc4_out.crop_halo = numpy.int32(halo)
+
+    if chunksizes is None:
+        time_block = 1
+    else:
+        time_block = chunksizes[0]
+    #each block of time steps is written at once, along the chunks if any
 
     for var in var_list:
-        nc4_out[var][:, :, :] = numpy.nan
-        for i in range(total):
-            lon_index, lat_index = interest_lon[i][0], interest_lat[i][0]
-            long_term_mean = avg_dict[var][i]
-            for time in range(time_steps):
-                nc4_out[var][time,lat_index,lon_index] = ds[var][time, lat_index, lon_index] - long_term_mean
+        anomalies = var_cells[var] - numpy.array(avg_dict[var])
+        for time_beg in range(0, time_steps, time_block):
+            time_end = min(time_beg + time_block, time_steps)
+            if layout == 'cell':
+                nc4_out[var][time_beg:time_end, :] = anomalies[time_beg:time_end, :]
+                continue
+            block = numpy.full((time_end - time_beg, lat_end - lat_beg, lon_end - lon_beg), numpy.nan,
+                               dtype=nc4_out[var].dtype)
+            block[:, lat_indices - lat_beg, lon_indices - lon_beg] = anomalies[time_beg:time_end, :]
+            nc4_out[var][time_beg:time_end, :, :] = block
 
     nc4_out.close()
     print("Success -- creating nc4 file\n")
 
+def processModel(model_file, output_csv, output_nc, interest_lon, interest_lat, areas, region_cells, regions,
+                 write_options):
+    '''
+    Compute the anomalies of one model over the domain cells and write its csv
+    and nc4 files, the domain being shared by all models on the same grid
+    '''
+    print(model_file)
+    ds = openModel(model_file)
+    time_steps = ds.time.shape[0]
+    times = ds.time.data
+    box, box_lon, box_lat = selectBox(ds, interest_lon, interest_lat)
+    box = sum_SM_by_depth(box)
+    #the data are dask arrays, nothing is read until gatherCells computes the
+    #box, and soil moisture is summed over the box only. ds gives outputNC the
+    #grid and box the variables and their metadata
+
+    all_vars = []
+    for varname in box.data_vars:
+        all_vars.append(varname)
+
+    unit_factors = {"mm": 1000, "kg/m2": 1000, "kg/m^2": 1000, "cm": 100, "dm": 10, "m": 1, "km": .001}
+
+    var_list = all_vars
+    avg_dict = dict()
+    anomalies_dict = dict()
+    var_cells = dict()
+
+    #compute the anomalies of all variables at once, for each data type
+    for names, cells in gatherCells(box, var_list, box_lon, box_lat):
+        print(names)
+        var_factors = [unit_factors[box[var].units] for var in names]
+        avg = findAvg(cells, time_steps)
+        timeseries = anomalyTimeseries(names, cells, var_factors, avg, areas, region_cells)
+        for var_index in range(len(names)):
+            avg_dict[names[var_index]] = list(avg[var_index, :])
+            var_cells[names[var_index]] = cells[var_index, :, :]
+            for region_index in range(len(region_cells)):
+                if regions is None:
+                    name = names[var_index]
+                else:
+                    name = names[var_index] + '_' + regions[region_index]
+                anomalies_dict[name] = list(timeseries[var_index, :, region_index])
+
+    fieldname = ['date']
+    for var in var_list:
+        if regions is None:
+            fieldname.append(var)
+        else:
+            fieldname += [var + '_' + region for region in regions]
+    outputCSV(output_csv, fieldname, times, anomalies_dict)
+    outputNC(output_nc, ds, box, interest_lon, interest_lat, areas, time_steps, var_list, var_cells, avg_dict,
+             write_options)
+    ds.close()
+    return model_file
+
 if __name__ == "__main__":
-    files = sys.argv[1:]
+    files = [i for i in sys.argv[1:] if not i.startswith('--')]
+    options = parseOptions(sys.argv[1:], {'cch': 'NONE', 'cch_mb': '1024', 'cch_day': '90',
+                                          'lab_var': 'label', 'zlb': '0', 'shf': '1', 'chk': 'NONE',
+                                          'crp': 'NONE', 'lay': 'grid', 'workers': 'NONE'})
+    write_options = parseWriteOptions(options)
     """
-    files[0]: concatenated netCDF4 file
+    files[0]: concatenated netCDF4 file, or several separated by commas
     files[1]: given shapefile ('../input/SERVIR_STK/Nepal.shp')
     files[2]: output shapefile with all grid cells from nc4
-    files[3]: output csv file
-    files[4]: output nc file
+    files[3]: output csv file, one per concatenated file
+    files[4]: output nc file, one per concatenated file
     """
+    model_files = files[0].split(',')
+    output_csvs = files[3].split(',')
+    output_ncs = files[4].split(',')
+    if len(output_csvs) != len(model_files) or len(output_ncs) != len(model_files):
+        print('ERROR - One output csv file and one output nc file must be given for each concatenated file')
+        raise SystemExit(22)
+    if options['workers'] == 'NONE':
+        workers = min(len(model_files), os.cpu_count() or 1)
+    else:
+        workers = int(options['workers'])
+    if workers < 1:
+        print('ERROR - The number of workers must be at least 1')
+        raise SystemExit(22)
 
-    #open netCDF4 file
-    print(files[0])
-    ds = xr.open_dataset(files[0])
+    #open netCDF4 file, the domain is selected once on its grid for all files
+    ds = openModel(model_files[0])
     num_lon = ds.lon.shape[0]
     num_lat = ds.lat.shape[0]
-    time_steps = ds.time.shape[0]
 
     lons = ds.lon.data
     lats = ds.lat.data
-    times = ds.time.data
+    ds.close()
+
+    for model_file in model_files[1:]:
+        with openModel(model_file) as other:
+            if not (numpy.array_equal(other.lon.data, lons) and numpy.array_equal(other.lat.data, lats)):
+                print('ERROR - The grid of ' + model_file + ' differs from that of ' + model_files[0])
+                raise SystemExit(22)
 
     lon_step = abs(lons[1] - lons[0])
     lat_step = abs(lats[1] - lats[0])
-    ds = sum_SM_by_depth(ds)
-
-    all_vars = []
-    for varname in ds.data_vars:
-        all_vars.append(varname)
-
-    unit_factors = {"mm": 1000, "kg/m2": 1000, "kg/m^2": 1000, "cm": 100, "dm": 10, "m": 1, "km": .001}
 
-    #read polygon shapefile
-    polygon = fiona.open(files[1], 'r')
+    #read polygon shapefile, or the regions of a label raster
+    label_raster = files[1].lower().endswith('.nc')
+    if not label_raster:
+        polygon = fiona.open(files[1], 'r')
     point_file = files[2]
-    createPointShp(polygon, point_file, num_lon, num_lat, lons, lats)
-
-    #open newly created point_file
-    pf = fiona.open(point_file, 'r')
-
-    #create spatial index for the bounds of each point
-    idx = createRtreeIndex(pf)
-    total_interest, interest_lon, interest_lat = findInterest(polygon, pf, idx)
-
-    #calculate surface area for each interest cell
-    areas = calculateSurfaceArea(total_interest, num_lat, interest_lat, lon_step, lat_step)
-    var_list = all_vars
-    avg_dict = dict()
-    anomalies_dict = dict()
-
-    #write anomalies to netcdf file, mask all other data points as nan
-    for var in var_list:
-        print(var)
-        vals = ds[var].data
-        var_factor = unit_factors[ds[var].units]
-        avg = findAvg(vals, total_interest, interest_lon, interest_lat, time_steps)
-        anomalies = anomalyTimeseries(vals, var_factor, avg, time_steps, total_interest, interest_lon, interest_lat, areas)
-        avg_dict[var] = avg
-        anomalies_dict[var] = anomalies
-
-    output_csv = files[3]
-    fieldname = ['date'] + var_list
-    outputCSV(output_csv, fieldname, times, anomalies_dict)
-    output_nc = files[4]
-    outputNC(output_nc, ds, total_interest, interest_lon, interest_lat, time_steps, var_list, avg_dict)
-    polygon.close()
-    pf.close()
+    cell_regions = None
+    regions = None
+
+    #look for the cell selection and areas in the cache
+    cache = None
+    if options['cch'] != 'NONE' and not label_raster:
+        cache_key = shbaam_cche.shb_cch_key('shbaam_lsma', polygon, 'NONE', lons, lats, [])
+        cache = shbaam_cche.shb_cch_get(options['cch'], cache_key)
+        print('Cache key: ' + cache_key)
+
+    if label_raster:
+        total_interest, interest_lon, interest_lat, cell_regions, regions = \
+            findLabels(files[1], options['lab_var'], num_lon, num_lat, lons, lats)
+        areas = calculateSurfaceArea(total_interest, num_lat, interest_lat, lon_step, lat_step)
+    elif cache is not None:
+        createPointShp(polygon, point_file, num_lon, num_lat, lons, lats)
+        print('Success -- found domain in cache, skipping rtree and intersections')
+        total_interest = len(cache['areas'])
+        interest_lon = list(zip(cache['lon_index'].tolist(), cache['lon'].tolist()))
+        interest_lat = list(zip(cache['lat_index'].tolist(), cache['lat'].tolist()))
+        areas = cache['areas'].tolist()
+    else:
+        createPointShp(polygon, point_file, num_lon, num_lat, lons, lats)
+
+        #open newly created point_file
+        pf = fiona.open(point_file, 'r')
+
+        #create spatial index for the bounds of each point
+        idx = createRtreeIndex(pf)
+        total_interest, interest_lon, interest_lat = findInterest(polygon, pf, idx)
+
+        #calculate surface area for each interest cell
+        areas = calculateSurfaceArea(total_interest, num_lat, interest_lat, lon_step, lat_step)
+        pf.close()
+
+        if options['cch'] != 'NONE':
+            shbaam_cche.shb_cch_put(options['cch'], cache_key,
+                                    {'lon_index': numpy.array([i[0] for i in interest_lon], dtype=numpy.int32),
+                                     'lon': numpy.array([i[1] for i in interest_lon]),
+                                     'lat_index': numpy.array([i[0] for i in interest_lat], dtype=numpy.int32),
+                                     'lat': numpy.array([i[1] for i in interest_lat]),
+                                     'areas': numpy.array(areas)})
+
+    if options['cch'] != 'NONE' and not label_raster:
+        evicted = shbaam_cche.shb_cch_evc(options['cch'], float(options['cch_mb']), float(options['cch_day']))
+        print('Cache entries evicted: ' + str(evicted))
+    #one timeseries over all cells, or one per label of a label raster
+    if regions is None:
+        region_cells = [numpy.arange(total_interest)]
+    else:
+        region_cells = [numpy.flatnonzero(cell_regions == i) for i in range(len(regions))]
+
+    #process the models one after the other, or concurrently in a pool of workers
+    jobs = [(model_files[i], output_csvs[i], output_ncs[i], interest_lon, interest_lat, areas, region_cells,
+             regions, write_options) for i in range(len(model_files))]
+    if workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            processModel(*job)
+    else:
+        pool = multiprocessing.get_context('fork').Pool(min(workers, len(jobs)))
+        for model_file in pool.starmap(processModel, jobs):
+            print('Success -- processed ' + model_file)
+        pool.close()
+        pool.join()
+    if not label_raster:
+        polygon.close()
 
     print('Script complete')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_mmap.py
+#*******************************************************************************
+
+#Purpose:
+#Read path for netCDF classic files (NETCDF3_CLASSIC and NETCDF3_64BIT_OFFSET)
+#that memory-maps the files and exposes their variables as NumPy views of the
+#data on disk, without the copies made when netCDF4 decodes each read. Repeat
+#runs on the same node then read from the page cache, and concurrent runs (or
+#worker processes) reading the same files share the same physical pages.
+#The datasets and variables given here follow the subset of the netCDF4 API
+#used by SHBAAM scripts: dimensions have a length, variables are indexed like
+#arrays and return masked arrays where fill values (_FillValue, or the netCDF
+#default fill value, and missing_value) are masked and where scale_factor and
+#add_offset are applied, and attributes are given by ncattrs() and getncattr()
+#or directly as Python attributes.
+#The functions of this script are used by shbaam_twsa.py.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import warnings
+import netCDF4
+import numpy
+import scipy.io
+
+
+#*******************************************************************************
+#Check if a file is a netCDF classic file
+#*******************************************************************************
+def shb_mmp_chk(YS_ncf):
+     '''
+     Return True for the netCDF classic formats that can be memory-mapped, i.e.
+     CDF-1 (NETCDF3_CLASSIC) and CDF-2 (NETCDF3_64BIT_OFFSET).
+     '''
+     with open(YS_ncf,'rb') as shb_fil:
+          YS_mgc=shb_fil.read(4)
+     return YS_mgc in (b'CDF\x01',b'CDF\x02')
+
+
+#*******************************************************************************
+#Decode the value of an attribute
+#*******************************************************************************
+def shb_mmp_att(shb_att):
+     '''
+     Text attributes are read as bytes and are decoded to strings as netCDF4
+     does, other attributes are left unchanged.
+     '''
+     if isinstance(shb_att,bytes):
+          return shb_att.decode('utf-8')
+     return shb_att
+
+
+#*******************************************************************************
+#Memory-mapped variable
+#*******************************************************************************
+class shb_mmp_var:
+     '''
+     A variable of a memory-mapped netCDF classic file, the array view of the
+     data on disk is given by ZV_dat.
+     '''
+     def __init__(self,shb_var):
+          self.ZV_dat=shb_var.data
+          self.dimensions=shb_var.dimensions
+          self.shape=self.ZV_dat.shape
+          self.dtype=self.ZV_dat.dtype
+          self._shb_att={YS_att: shb_mmp_att(shb_var._attributes[YS_att])      \
+                         for YS_att in shb_var._attributes}
+
+     def __len__(self):
+          return self.shape[0]
+
+     def ncattrs(self):
+          return list(self._shb_att)
+
+     def getncattr(self,YS_att):
+          if YS_att not in self._shb_att:
+               raise AttributeError(YS_att)
+          return self._shb_att[YS_att]
+
+     def __getattr__(self,YS_att):
+          if YS_att.startswith('_') and YS_att!='_FillValue':
+               raise AttributeError(YS_att)
+          return self.getncattr(YS_att)
+
+     def __getitem__(self,shb_idx):
+          ZV_dat=self.ZV_dat[shb_idx]
+          return self.shb_msk(ZV_dat)
+
+     def shb_msk(self,ZV_dat):
+          '''
+          Mask and scale values read from ZV_dat as netCDF4 does by default,
+          the values themselves remain a view when nothing needs scaling.
+          '''
+          if self.dtype.kind not in 'fiu':
+               return ZV_dat
+          BV_msk=numpy.zeros(numpy.shape(ZV_dat),dtype=bool)
+          if '_FillValue' in self._shb_att:
+               ZS_fil=self._shb_att['_FillValue']
+          elif self.dtype.itemsize > 1:
+               ZS_fil=netCDF4.default_fillvals[self.dtype.kind                 \
+                                               +str(self.dtype.itemsize)]
+          else:
+               ZS_fil=None
+          for ZS_val in [ZS_fil,self._shb_att.get('missing_value')]:
+               if ZS_val is None:
+                    continue
+               for ZS_one in numpy.atleast_1d(ZS_val):
+                    if numpy.isnan(ZS_one):
+                         BV_msk|=numpy.isnan(ZV_dat)
+                    else:
+                         BV_msk|=(ZV_dat==ZS_one)
+          ZV_dat=numpy.ma.array(ZV_dat,mask=BV_msk)
+          if 'scale_factor' in self._shb_att:
+               ZV_dat=ZV_dat*self._shb_att['scale_factor']
+          if 'add_offset' in self._shb_att:
+               ZV_dat=ZV_dat+self._shb_att['add_offset']
+          return ZV_dat
+
+
+#*******************************************************************************
+#Memory-mapped dataset
+#*******************************************************************************
+class shb_mmp_dst:
+     '''
+     A netCDF classic file opened read-only with scipy.io.netcdf_file and
+     mmap=True. The length of the unlimited dimension is the number of records.
+     '''
+     def __init__(self,YS_ncf):
+          self._shb_ncf=scipy.io.netcdf_file(YS_ncf,'r',mmap=True)
+          shb_ncf=self._shb_ncf
+          self.variables={YS_var: shb_mmp_var(shb_ncf.variables[YS_var])       \
+                          for YS_var in shb_ncf.variables}
+          self.dimensions={}
+          for YS_dim in shb_ncf.dimensions:
+               IS_dim=shb_ncf.dimensions[YS_dim]
+               if IS_dim is None:
+                    IS_dim=shb_ncf._recs
+               self.dimensions[YS_dim]=range(IS_dim)
+               #Like netCDF4 dimensions, ranges have a length
+          self._shb_att={YS_att: shb_mmp_att(shb_ncf._attributes[YS_att])      \
+                         for YS_att in shb_ncf._attributes}
+
+     def ncattrs(self):
+          return list(self._shb_att)
+
+     def getncattr(self,YS_att):
+          if YS_att not in self._shb_att:
+               raise AttributeError(YS_att)
+          return self._shb_att[YS_att]
+
+     def close(self):
+          '''
+          The mapping itself is only released once no view of the data is left.
+          '''
+          self.variables={}
+          with warnings.catch_warnings():
+               warnings.simplefilter('ignore',RuntimeWarning)
+               self._shb_ncf.close()
+
+
+#*******************************************************************************
+#Open a netCDF file for reading
+#*******************************************************************************
+def shb_ncf_opn(YS_ncf,BS_mmp):
+     '''
+     Memory-map the file if BS_mmp is True and if the file is a netCDF classic
+     file, otherwise open it with netCDF4.
+     '''
+     if BS_mmp and shb_mmp_chk(YS_ncf):
+          return shb_mmp_dst(YS_ncf)
+     return netCDF4.Dataset(YS_ncf,'r')
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
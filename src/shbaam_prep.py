@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_prep.py
+#*******************************************************************************
+
+#Purpose:
+#Prepare the anomalies of one GRACE release for all grid cells. Given GRACE
+#data, this script computes the long-term mean of every grid cell (optionally
+#over a baseline period) and the liquid water equivalent thickness anomaly (in
+#cm) of every grid cell and time step, and stores both in a netCDF4 file that
+#has the same dimensions and coordinates as the GRACE file. The anomalies are
+#stored in double precision and in chunks that span all time steps over tiles
+#of grid cells, so that the anomalies of a region are read from a few chunks.
+#The anomalies are raw: they are not multiplied by scale factors nor by areas.
+#Such a file can be given to shbaam_twsa.py with --prp=1 for the long-term mean
+#not to be computed again for each region.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import subprocess
+import netCDF4
+import numpy
+import datetime
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_grc_ncf
+# 2 - shb_anm_ncf
+#(3)- optional arguments given as --name=value (see below)
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 3:
+     print('ERROR - A minimum of 2 arguments must be used')
+     raise SystemExit(22)
+
+shb_grc_ncf=sys.argv[1]
+shb_anm_ncf=sys.argv[2]
+
+
+#*******************************************************************************
+#Get optional command line arguments
+#*******************************************************************************
+# --bsl - Baseline period given as YYYY-MM-DD,YYYY-MM-DD (both days included)
+#         over which the long-term mean is computed (default is NONE: the full
+#         record is used), as in shbaam_twsa.py.
+# --chk - Size of the tiles of grid cells of each chunk given as lat,lon
+#         (default is 32,32), chunks span all time steps.
+# --zlb - Level of zlib compression from 0 (default, no compression) to 9.
+
+shb_opt={'bsl': 'NONE', 'chk': '32,32', 'zlb': '0'}
+for YS_arg in sys.argv[3:]:
+     if not YS_arg.startswith('--') or '=' not in YS_arg:
+          print('ERROR - Optional arguments must be given as --name=value')
+          raise SystemExit(22)
+     YS_opt,YS_val=YS_arg[2:].split('=',1)
+     if YS_opt not in shb_opt:
+          print('ERROR - Unknown optional argument: '+YS_arg)
+          raise SystemExit(22)
+     shb_opt[YS_opt]=YS_val
+
+if shb_opt['bsl']=='NONE':
+     YV_bsl=None
+else:
+     YV_bsl=shb_opt['bsl'].split(',')
+     try:
+          shb_bsl_beg=datetime.datetime.strptime(YV_bsl[0],'%Y-%m-%d')
+          shb_bsl_end=datetime.datetime.strptime(YV_bsl[1],'%Y-%m-%d')
+     except (IndexError,ValueError):
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22)
+     if len(YV_bsl)!=2 or shb_bsl_end < shb_bsl_beg:
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22)
+
+IV_anm_chk=[int(YS_chk) for YS_chk in shb_opt['chk'].split(',')]
+if len(IV_anm_chk)!=2 or min(IV_anm_chk) < 1:
+     print('ERROR - The chunk shape must be given as lat,lon')
+     raise SystemExit(22)
+
+IS_anm_zlb=int(shb_opt['zlb'])
+if IS_anm_zlb < 0 or IS_anm_zlb > 9:
+     print('ERROR - The zlib compression level must be between 0 and 9')
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Print input information
+#*******************************************************************************
+print('Command line inputs')
+print(' - '+shb_grc_ncf)
+print(' - '+shb_anm_ncf)
+for YS_opt in shb_opt:
+     print(' - --'+YS_opt+'='+shb_opt[YS_opt])
+
+
+#*******************************************************************************
+#Check if files exist
+#*******************************************************************************
+try:
+     with open(shb_grc_ncf) as file:
+          pass
+except IOError as e:
+     print('ERROR - Unable to open '+shb_grc_ncf)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read GRACE netCDF file
+#*******************************************************************************
+print('Read GRACE netCDF file')
+
+f = netCDF4.Dataset(shb_grc_ncf, 'r')
+
+IS_grc_lon=len(f.dimensions['lon'])
+print(' - The number of longitudes is: '+str(IS_grc_lon))
+
+IS_grc_lat=len(f.dimensions['lat'])
+print(' - The number of latitudes is: '+str(IS_grc_lat))
+
+IS_grc_time=len(f.dimensions['time'])
+print(' - The number of time steps is: '+str(IS_grc_time))
+
+ZV_grc_time=f.variables['time']
+
+
+#*******************************************************************************
+#Determine baseline period
+#*******************************************************************************
+print('Determine baseline period')
+
+shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                  \
+                                         '%Y-%m-%dT%H:%M:%S')
+
+if YV_bsl is None:
+     BV_bsl_time=numpy.ones(IS_grc_time,dtype=bool)
+else:
+     ZS_bsl_beg=(shb_bsl_beg-shb_dat_str).days
+     ZS_bsl_end=(shb_bsl_end-shb_dat_str).days+1
+     ZV_grc_day=numpy.array(ZV_grc_time[:],dtype=numpy.float64)
+     BV_bsl_time=(ZV_grc_day >= ZS_bsl_beg) & (ZV_grc_day < ZS_bsl_end)
+     #Time values are in days since the reference date used for time strings
+
+IS_bsl_time=int(numpy.sum(BV_bsl_time))
+if IS_bsl_time==0:
+     print('ERROR - No time steps found within the baseline period')
+     raise SystemExit(22)
+
+print(' - The number of time steps in the baseline period is: '                \
+      +str(IS_bsl_time))
+
+
+#*******************************************************************************
+#Create shb_anm_ncf
+#*******************************************************************************
+print('Create shb_anm_ncf')
+
+h = netCDF4.Dataset(shb_anm_ncf, 'w', format="NETCDF4")
+
+h.createDimension("time", IS_grc_time)
+h.createDimension("lat", IS_grc_lat)
+h.createDimension("lon", IS_grc_lon)
+#The number of time steps is fixed for chunks to span all of them
+
+time = h.createVariable("time",f.variables['time'].dtype,("time",))
+lat = h.createVariable("lat",f.variables['lat'].dtype,("lat",))
+lon = h.createVariable("lon",f.variables['lon'].dtype,("lon",))
+lwe_thickness = h.createVariable("lwe_thickness","f8",("time","lat","lon",),   \
+                        zlib=(IS_anm_zlb > 0),complevel=max(IS_anm_zlb,1),     \
+                        chunksizes=(IS_grc_time,min(IV_anm_chk[0],IS_grc_lat), \
+                                    min(IV_anm_chk[1],IS_grc_lon)))
+lwe_thickness_baseline = h.createVariable("lwe_thickness_baseline","f8",      \
+                                          ("lat","lon",))
+if 'crs' in f.variables:
+     crs = h.createVariable("crs","i4")
+
+#-------------------------------------------------------------------------------
+#Metadata in netCDF attributes
+#-------------------------------------------------------------------------------
+print('- Populate attributes')
+
+dt=datetime.datetime.utcnow()
+dt=dt.replace(microsecond=0)
+#Current UTC time without the microseconds
+vsn=subprocess.Popen('bash ../version.sh',                                     \
+                     stdout=subprocess.PIPE,shell=True).communicate()
+vsn=vsn[0]
+vsn=vsn.rstrip()
+vsn=str(vsn)
+#Version of SHBAAM
+
+h.Conventions='CF-1.6'
+h.title='Anomalies of GRACE liquid water equivalent thickness'
+h.institution=''
+h.source='SHBAAM: '+vsn+', GRACE: '+os.path.basename(shb_grc_ncf)
+h.history='date created: '+dt.isoformat()+'+00:00'
+h.references='https://github.com/c-h-david/shbaam/'
+h.comment='lwe_thickness is the anomaly with respect to '                      \
+         +'lwe_thickness_baseline, the long-term mean over the baseline period'
+if YV_bsl is None:
+     h.baseline_start='NONE'
+     h.baseline_end='NONE'
+else:
+     h.baseline_start=YV_bsl[0]
+     h.baseline_end=YV_bsl[1]
+
+for YS_var in ['time','lat','lon','lwe_thickness','crs']:
+     if YS_var in f.variables and YS_var in h.variables:
+          var=f.variables[YS_var]
+          for YS_att in var.ncattrs():
+               if YS_att not in ['_FillValue','missing_value','scale_factor',  \
+                                 'add_offset','valid_min','valid_max',         \
+                                 'valid_range']:
+                    h.variables[YS_var].setncattr(YS_att,var.getncattr(YS_att))
+#Attributes of the GRACE file, except those about packing and fill values
+
+lwe_thickness_baseline.long_name='long-term mean of lwe_thickness over the '  \
+                                +'baseline period'
+if 'units' in lwe_thickness.ncattrs():
+     lwe_thickness_baseline.units=lwe_thickness.units
+if 'crs' in h.variables:
+     lwe_thickness_baseline.grid_mapping='crs'
+
+#-------------------------------------------------------------------------------
+#Populate static data
+#-------------------------------------------------------------------------------
+print('- Populate static data')
+
+time[:]=f.variables['time'][:]
+lat[:]=f.variables['lat'][:]
+lon[:]=f.variables['lon'][:]
+
+
+#*******************************************************************************
+#Compute anomalies for each band of latitudes
+#*******************************************************************************
+print('Compute anomalies for each band of latitudes')
+
+for JS_lat_beg in range(0,IS_grc_lat,lwe_thickness.chunking()[1]):
+     JS_lat_end=min(JS_lat_beg+lwe_thickness.chunking()[1],IS_grc_lat)
+     ZM_bnd_lwe=numpy.ma.filled(                                               \
+                f.variables['lwe_thickness'][:,JS_lat_beg:JS_lat_end,:]        \
+                                             .astype(numpy.float64),numpy.nan)
+     ZM_bnd_avg=numpy.zeros((JS_lat_end-JS_lat_beg,IS_grc_lon))
+     for JS_grc_time in range(IS_grc_time):
+          if BV_bsl_time[JS_grc_time]:
+               ZM_bnd_avg+=ZM_bnd_lwe[JS_grc_time,:,:]
+     ZM_bnd_avg=ZM_bnd_avg/IS_bsl_time
+     #The time steps are accumulated one by one as in shbaam_twsa.py, so that
+     #anomalies are identical to those computed there
+     lwe_thickness_baseline[JS_lat_beg:JS_lat_end,:]=                          \
+                                           numpy.ma.masked_invalid(ZM_bnd_avg)
+     lwe_thickness[:,JS_lat_beg:JS_lat_end,:]=                                 \
+                                numpy.ma.masked_invalid(ZM_bnd_lwe-ZM_bnd_avg)
+#One band of chunks at a time, each chunk is written once
+
+print(' - The number of bands is: '                                            \
+      +str(len(range(0,IS_grc_lat,lwe_thickness.chunking()[1]))))
+
+
+#*******************************************************************************
+#Close netCDF files
+#*******************************************************************************
+print('Close netCDF files')
+
+f.close()
+h.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#shbaam_sats.py
+#*******************************************************************************
+
+#Purpose:
+#Prepare summed-area tables of Terrestrial Water Storage Anomalies from GRACE.
+#Given GRACE data and associated scale factors, this script computes the
+#liquid water equivalent thickness anomaly (in cm) of every grid cell and time
+#step, and stores the two-dimensional cumulative sums over latitudes and
+#longitudes of the area times scale factor times anomaly, of the area of the
+#grid cells that have valid scale factors, and of the number of grid cells with
+#NoData in GRACE. The sum over any rectangle of grid cells is then given by four
+#values of each table, which is used by shbaam_bbox.py to average anomalies
+#over longitude/latitude boxes without going through a shapefile. The file is
+#created as NETCDF3_64BIT_OFFSET so that it can be memory-mapped.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Import Python modules
+#*******************************************************************************
+import sys
+import os.path
+import subprocess
+import netCDF4
+import numpy
+import datetime
+import math
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_grc_ncf
+# 2 - shb_fct_ncf
+# 3 - shb_sat_ncf
+#(4)- optional arguments given as --name=value (see below)
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 4:
+     print('ERROR - A minimum of 3 arguments must be used')
+     raise SystemExit(22)
+
+shb_grc_ncf=sys.argv[1]
+shb_fct_ncf=sys.argv[2]
+shb_sat_ncf=sys.argv[3]
+
+
+#*******************************************************************************
+#Get optional command line arguments
+#*******************************************************************************
+# --bsl - Baseline period given as YYYY-MM-DD,YYYY-MM-DD (both days included)
+#         over which the long-term mean is computed (default is NONE: the full
+#         record is used), as in shbaam_twsa.py.
+
+shb_opt={'bsl': 'NONE'}
+for YS_arg in sys.argv[4:]:
+     if not YS_arg.startswith('--') or '=' not in YS_arg:
+          print('ERROR - Optional arguments must be given as --name=value')
+          raise SystemExit(22)
+     YS_opt,YS_val=YS_arg[2:].split('=',1)
+     if YS_opt not in shb_opt:
+          print('ERROR - Unknown optional argument: '+YS_arg)
+          raise SystemExit(22)
+     shb_opt[YS_opt]=YS_val
+
+if shb_opt['bsl']=='NONE':
+     YV_bsl=None
+else:
+     YV_bsl=shb_opt['bsl'].split(',')
+     try:
+          shb_bsl_beg=datetime.datetime.strptime(YV_bsl[0],'%Y-%m-%d')
+          shb_bsl_end=datetime.datetime.strptime(YV_bsl[1],'%Y-%m-%d')
+     except (IndexError,ValueError):
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22)
+     if len(YV_bsl)!=2 or shb_bsl_end < shb_bsl_beg:
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22)
+
+
+#*******************************************************************************
+#Print input information
+#*******************************************************************************
+print('Command line inputs')
+print(' - '+shb_grc_ncf)
+print(' - '+shb_fct_ncf)
+print(' - '+shb_sat_ncf)
+for YS_opt in shb_opt:
+     print(' - --'+YS_opt+'='+shb_opt[YS_opt])
+
+
+#*******************************************************************************
+#Check if files exist
+#*******************************************************************************
+try:
+     with open(shb_grc_ncf) as file:
+          pass
+except IOError as e:
+     print('ERROR - Unable to open '+shb_grc_ncf)
+     raise SystemExit(22)
+
+try:
+     with open(shb_fct_ncf) as file:
+          pass
+except IOError as e:
+     print('ERROR - Unable to open '+shb_fct_ncf)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read GRACE netCDF file
+#*******************************************************************************
+print('Read GRACE netCDF file')
+
+f = netCDF4.Dataset(shb_grc_ncf, 'r')
+
+IS_grc_lon=len(f.dimensions['lon'])
+print(' - The number of longitudes is: '+str(IS_grc_lon))
+
+IS_grc_lat=len(f.dimensions['lat'])
+print(' - The number of latitudes is: '+str(IS_grc_lat))
+
+IS_grc_time=len(f.dimensions['time'])
+print(' - The number of time steps is: '+str(IS_grc_time))
+
+ZV_grc_lon=f.variables['lon']
+ZV_grc_lat=f.variables['lat']
+ZV_grc_time=f.variables['time']
+
+ZS_grc_lon_stp=abs(ZV_grc_lon[1]-ZV_grc_lon[0])
+print(' - The interval size for longitudes is: '+str(ZS_grc_lon_stp))
+
+ZS_grc_lat_stp=abs(ZV_grc_lat[1]-ZV_grc_lat[0])
+print(' - The interval size for latitudes is: '+str(ZS_grc_lat_stp))
+
+
+#*******************************************************************************
+#Read scale factors netCDF file
+#*******************************************************************************
+print('Read scale factors netCDF file')
+
+g = netCDF4.Dataset(shb_fct_ncf, 'r')
+
+if len(g.dimensions['lon'])!=IS_grc_lon                                        \
+or len(g.dimensions['lat'])!=IS_grc_lat                                        \
+or not (g.variables['lon'][:]==ZV_grc_lon[:]).all()                            \
+or not (g.variables['lat'][:]==ZV_grc_lat[:]).all():
+     print('ERROR - The grids of GRACE and scale factors differ')
+     raise SystemExit(22)
+
+ZM_grc_scl=g.variables['scale_factor'][:,:]
+ZM_grc_msk=numpy.ma.getmaskarray(ZM_grc_scl)
+print(' - The number of NoData points in scale factors is: '                   \
+      +str(int(numpy.sum(ZM_grc_msk))))
+
+
+#*******************************************************************************
+#Determine baseline period
+#*******************************************************************************
+print('Determine baseline period')
+
+shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                  \
+                                         '%Y-%m-%dT%H:%M:%S')
+
+if YV_bsl is None:
+     BV_bsl_time=numpy.ones(IS_grc_time,dtype=bool)
+else:
+     ZS_bsl_beg=(shb_bsl_beg-shb_dat_str).days
+     ZS_bsl_end=(shb_bsl_end-shb_dat_str).days+1
+     ZV_grc_day=numpy.array(ZV_grc_time[:],dtype=numpy.float64)
+     BV_bsl_time=(ZV_grc_day >= ZS_bsl_beg) & (ZV_grc_day < ZS_bsl_end)
+     #Time values are in days since the reference date used for time strings
+
+IS_bsl_time=int(numpy.sum(BV_bsl_time))
+if IS_bsl_time==0:
+     print('ERROR - No time steps found within the baseline period')
+     raise SystemExit(22)
+
+print(' - The number of time steps in the baseline period is: '                \
+      +str(IS_bsl_time))
+
+
+#*******************************************************************************
+#Compute surface area and weight of each grid cell
+#*******************************************************************************
+print('Compute surface area and weight of each grid cell')
+
+ZV_grc_sqm=6371000*math.radians(ZS_grc_lat_stp)                                \
+          *6371000*math.radians(ZS_grc_lon_stp)                                \
+          *numpy.cos(numpy.radians(ZV_grc_lat[:].astype(numpy.float64)))
+
+ZM_grc_sqm=numpy.where(ZM_grc_msk,0,ZV_grc_sqm[:,numpy.newaxis])
+ZM_grc_wgt=numpy.where(ZM_grc_msk,0,                                           \
+                       numpy.ma.getdata(ZM_grc_scl).astype(numpy.float64))     \
+          *ZV_grc_sqm[:,numpy.newaxis]
+#Area of the grid cells with valid scale factors, and area times scale factor
+#(0 for NoData) as in the weights of shbaam_twsa.py
+
+
+#*******************************************************************************
+#Find long-term mean for each GRACE grid cell
+#*******************************************************************************
+print('Find long-term mean for each GRACE grid cell')
+
+ZM_grc_avg=numpy.zeros((IS_grc_lat,IS_grc_lon))
+for JS_grc_time in range(IS_grc_time):
+     if BV_bsl_time[JS_grc_time]:
+          ZM_grc_avg+=numpy.ma.filled(                                         \
+                      f.variables['lwe_thickness'][JS_grc_time,:,:]            \
+                                             .astype(numpy.float64),numpy.nan)
+ZM_grc_avg=ZM_grc_avg/IS_bsl_time
+#The time steps are accumulated one by one as in shbaam_twsa.py
+
+
+#*******************************************************************************
+#Define the summed-area table of an array
+#*******************************************************************************
+def shb_sat_get(ZM_grc):
+     ZM_sat=numpy.zeros((ZM_grc.shape[0]+1,ZM_grc.shape[1]+1),                 \
+                        dtype=ZM_grc.dtype)
+     ZM_sat[1:,1:]=ZM_grc.cumsum(axis=0).cumsum(axis=1)
+     return ZM_sat
+#The value at (i,j) is the sum over the latitudes [0;i) and longitudes [0;j),
+#the sum over [i0;i1) and [j0;j1) is then S[i1,j1]-S[i0,j1]-S[i1,j0]+S[i0,j0]
+
+
+#*******************************************************************************
+#Write shb_sat_ncf
+#*******************************************************************************
+print('Write shb_sat_ncf')
+
+#-------------------------------------------------------------------------------
+#Create netCDF file
+#-------------------------------------------------------------------------------
+print('- Create netCDF file')
+
+h = netCDF4.Dataset(shb_sat_ncf, 'w', format="NETCDF3_64BIT_OFFSET")
+
+h.createDimension("time", None)
+h.createDimension("lat", IS_grc_lat)
+h.createDimension("lon", IS_grc_lon)
+h.createDimension("lat_sat", IS_grc_lat+1)
+h.createDimension("lon_sat", IS_grc_lon+1)
+
+time = h.createVariable("time","f8",("time",))
+lat = h.createVariable("lat","f4",("lat",))
+lon = h.createVariable("lon","f4",("lon",))
+area_sum = h.createVariable("area_sum","f8",("lat_sat","lon_sat",))
+lwe_thickness_sum = h.createVariable("lwe_thickness_sum","f8",                 \
+                                     ("time","lat_sat","lon_sat",))
+nodata_count = h.createVariable("nodata_count","i4",                           \
+                                ("time","lat_sat","lon_sat",))
+
+#-------------------------------------------------------------------------------
+#Metadata in netCDF attributes
+#-------------------------------------------------------------------------------
+print('- Populate attributes')
+
+dt=datetime.datetime.utcnow()
+dt=dt.replace(microsecond=0)
+#Current UTC time without the microseconds
+vsn=subprocess.Popen('bash ../version.sh',                                     \
+                     stdout=subprocess.PIPE,shell=True).communicate()
+vsn=vsn[0]
+vsn=vsn.rstrip()
+vsn=str(vsn)
+#Version of SHBAAM
+
+h.Conventions='CF-1.6'
+h.title='Summed-area tables of GRACE terrestrial water storage anomalies'
+h.institution=''
+h.source='SHBAAM: '+vsn+', GRACE: '+os.path.basename(shb_grc_ncf)              \
+        +', Scale factors: '+os.path.basename(shb_fct_ncf)
+h.history='date created: '+dt.isoformat()+'+00:00'
+h.references='https://github.com/c-h-david/shbaam/'
+h.comment='The sums over latitudes [i0;i1) and longitudes [j0;j1) of the '     \
+         +'GRACE grid are X[i1,j1]-X[i0,j1]-X[i1,j0]+X[i0,j0] for each of '    \
+         +'the tables X. The average anomaly over these grid cells is the '    \
+         +'sum of lwe_thickness_sum divided by the sum of area_sum, unless '   \
+         +'the sum of nodata_count is positive.'
+if YV_bsl is None:
+     h.baseline_start='NONE'
+     h.baseline_end='NONE'
+else:
+     h.baseline_start=YV_bsl[0]
+     h.baseline_end=YV_bsl[1]
+
+for YS_att in ['standard_name','long_name','units','axis','calendar']:
+     if YS_att in f.variables['time'].ncattrs():
+          time.setncattr(YS_att,f.variables['time'].getncattr(YS_att))
+for YS_att in ['standard_name','long_name','units','axis']:
+     if YS_att in f.variables['lat'].ncattrs():
+          lat.setncattr(YS_att,f.variables['lat'].getncattr(YS_att))
+     if YS_att in f.variables['lon'].ncattrs():
+          lon.setncattr(YS_att,f.variables['lon'].getncattr(YS_att))
+
+area_sum.long_name='summed-area table of the area of the grid cells with '     \
+                  +'valid scale factors'
+area_sum.units='m2'
+lwe_thickness_sum.long_name='summed-area table of area times scale factor '    \
+                           +'times anomaly of lwe_thickness'
+lwe_thickness_sum.units='cm m2'
+nodata_count.long_name='summed-area table of the number of grid cells with '   \
+                      +'NoData in lwe_thickness'
+nodata_count.units='1'
+
+#-------------------------------------------------------------------------------
+#Populate static data
+#-------------------------------------------------------------------------------
+print('- Populate static data')
+
+lat[:]=ZV_grc_lat[:]
+lon[:]=ZV_grc_lon[:]
+area_sum[:,:]=shb_sat_get(ZM_grc_sqm)
+
+#-------------------------------------------------------------------------------
+#Populate dynamic data
+#-------------------------------------------------------------------------------
+print('- Populate dynamic data')
+
+time[:]=ZV_grc_time[:]
+
+for JS_grc_time in range(IS_grc_time):
+     ZM_grc_wsa=numpy.ma.filled(f.variables['lwe_thickness'][JS_grc_time,:,:]  \
+                                .astype(numpy.float64),numpy.nan)-ZM_grc_avg
+     BM_grc_nan=numpy.isnan(ZM_grc_wsa)
+     lwe_thickness_sum[JS_grc_time,:,:]=shb_sat_get(                           \
+                               numpy.where(BM_grc_nan,0,ZM_grc_wgt*ZM_grc_wsa))
+     nodata_count[JS_grc_time,:,:]=shb_sat_get(BM_grc_nan.astype(numpy.int32))
+#One time step at a time, the tables are in double precision so that the
+#differences of large cumulative sums keep their accuracy
+
+
+#*******************************************************************************
+#Close netCDF files
+#*******************************************************************************
+print('Close netCDF files')
+
+f.close()
+g.close()
+h.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -7,12 +7,15 @@
 #Compute Terrestrial Water Storage Anomalies from GRACE for a given shapefile.
 #Given GRACE data and associated scale factors, along with a shapefile 
 #referenced on a Geographic Coordinate System (i.e. longitude, latitude), this 
-#script creates an intermediate shapefile with points representative of the grid
-#cells, computes liquid water equivalent thickness anomaly (in cm) for every
+#script finds the grid cells whose centers are within the shapefile (optionally 
+#creating an intermediate shapefile with points representative of the grid
+#cells), computes liquid water equivalent thickness anomaly (in cm) for every
 #time step of the GRACE data and produces a CSV time series that is spatially 
 #averaged over the shapefile, as well as a netCDF time series focusing on the 
 #shapefile. If the shapefile touches coastal grid cells that have NoData in the 
-#GRACE scale factors, these points are ignored in the averaging.
+#GRACE scale factors, these points are ignored in the averaging. The shapefile
+#can also be replaced by a netCDF raster of integer labels on the GRACE grid, 
+#where each label is a region.
 #Author:
 #Cedric H. David, 2017-2020
 
@@ -23,34 +26,44 @@
 import sys
 import os.path
 import subprocess
+import multiprocessing
+import multiprocessing.sharedctypes
 import netCDF4
 import numpy
 import datetime
 import fiona
+import fiona.crs
 import shapely.geometry
 import shapely.prepared
+import shapely.vectorized
 import rtree
+import scipy.sparse
 import math
 import csv
+import shbaam_cche
+import shbaam_mmap
 
 
 #*******************************************************************************
 #Declaration of variables (given as command line arguments)
 #*******************************************************************************
-# 1 - shb_grc_ncf
+# 1 - shb_grc_ncf (several GRACE solutions on the same grid can be given as a 
+#                  comma-separated list, see --sol)
 # 2 - shb_fct_ncf
-# 3 - shb_pol_shp
+# 3 - shb_pol_shp (or a netCDF label raster on the GRACE grid with a file name 
+#                  ending in .nc, see --lab_var)
 # 4 - shb_pnt_shp
 # 5 - shb_wsa_csv
 # 6 - shb_wsa_ncf
+#(7)- optional arguments given as --name=value (see below)
 
 
 #*******************************************************************************
 #Get command line arguments
 #*******************************************************************************
 IS_arg=len(sys.argv)
-if IS_arg != 7:
-     print('ERROR - 6 and only 6 arguments can be used')
+if IS_arg < 7:
+     print('ERROR - A minimum of 6 arguments must be used')
      raise SystemExit(22) 
 
 shb_grc_ncf=sys.argv[1]
@@ -60,6 +73,303 @@ shb_pnt_shp=sys.argv[4]
 shb_wsa_csv=sys.argv[5]
 shb_wsa_ncf=sys.argv[6]
 
+YV_grc_ncf=shb_grc_ncf.split(',')
+IS_sol_tot=len(YV_grc_ncf)
+
+
+#*******************************************************************************
+#Get optional command line arguments
+#*******************************************************************************
+# --sel - Method used to select grid cells within the polygons:
+#         'grid' (default) uses index arithmetic on the regular GRACE grid, 
+#         'rtree' uses a spatial index built from the point shapefile. With 
+#         'grid', the point shapefile is only an optional debug output that is 
+#         not created if shb_pnt_shp is NONE.
+# --key - Name of a polygon attribute used to group features into regions 
+#         (default is NONE: all features form one unique region). Each region 
+#         gets its own timeseries and shb_wsa_csv has one column per region.
+# --lab_var - Name of the integer variable of dimensions (lat,lon) when 
+#             shb_pol_shp is a netCDF label raster, default is label. Each 
+#             distinct label is then a region named after its value and the 
+#             grid cells of a region are read directly from the raster, without
+#             any geometry operation. Grid cells with the fill value belong to 
+#             no region.
+# --par - Hierarchy of regions, given either as a comma-separated list of 
+#         polygon attributes with the parent region of each feature at 
+#         successively coarser levels (e.g. basin,continent), or as a CSV file 
+#         with a header and one region,parent pair per line (default is NONE: 
+#         no hierarchy). Parent regions have no polygon features of their own 
+#         and are added after the other regions. Their timeseries and valid 
+#         areas are aggregated from the area-weighted sums and valid areas of 
+#         the regions they contain, without selecting or reading their grid 
+#         cells again.
+# --tsr - Optional netCDF file with the timeseries of all regions, following
+#         the CF featureType 'timeSeries' with a region dimension (default is 
+#         NONE: no such file is created).
+# --wgt - Optional netCDF file where the sparse (region x grid cell) weight 
+#         matrix used to compute all regional timeseries is exported as a list
+#         of links (default is NONE: no such file is created). The weights of
+#         parent regions given with --par are composed from those of the 
+#         regions they contain.
+# --cch - Optional folder for a persistent cache of the domain (selected grid 
+#         cells, areas and scale factor mask), keyed by the content of the 
+#         polygon geometries, of the grid coordinates and of shb_fct_ncf 
+#         (default is NONE: no cache is used).
+# --cch_mb  - Maximum size of the cache folder in megabytes (default is 1024).
+# --cch_day - Maximum number of days since the last use of a cache entry 
+#             (default is 90).
+# --fmt - Format of shb_wsa_ncf: NETCDF3_CLASSIC (default), 
+#         NETCDF3_64BIT_OFFSET, NETCDF4_CLASSIC or NETCDF4. The following 
+#         options only apply to the NETCDF4 formats.
+# --zlb - Level of zlib compression from 0 (default, no compression) to 9.
+# --shf - Use the HDF5 shuffle filter with compression: 1 (default) or 0.
+# --chk - Chunk shape given as time,lat,lon (e.g. 12,60,60), default is NONE 
+#         for the netCDF library default.
+# --mem - Memory budget in megabytes for the GRACE data of the domain (default 
+#         is NONE: all time steps are processed at once). With a budget, the 
+#         time axis is streamed in chunks, a first pass accumulates the 
+#         long-term mean and a second pass computes and writes the anomalies.
+# --crp - Crop shb_wsa_ncf to the bounding box of the domain plus a halo given
+#         as a number of grid cells, e.g. 0 or 2 (default is NONE: the full 
+#         GRACE grid is used). The zero-based indices of the first latitude and 
+#         longitude of the cropped grid within the GRACE grid are stored in 
+#         global attributes.
+# --beg - First day of the time window given as YYYY-MM-DD (default is NONE: 
+#         the first time step of shb_grc_ncf). Only the time steps within the 
+#         time window are read and written, and the long-term mean is computed
+#         over the time window unless a baseline period is given with --bsl.
+# --end - Last day of the time window given as YYYY-MM-DD (default is NONE: 
+#         the last time step of shb_grc_ncf).
+# --bsl - Baseline period given as YYYY-MM-DD,YYYY-MM-DD (both days included) 
+#         over which the long-term mean is computed (default is NONE: the full 
+#         record is used). The long-term mean of each grid cell is then stored 
+#         in shb_wsa_ncf.
+# --app - Append mode: 1 or 0 (default). With 1, shb_wsa_csv, shb_wsa_ncf and 
+#         shb_tsr_ncf (if any) must exist from a previous run with the same 
+#         domain and baseline period, only the time steps of shb_grc_ncf that 
+#         come after those of shb_wsa_ncf are read and the files are extended 
+#         in place using the long-term mean stored in shb_wsa_ncf.
+# --sol - Names of the GRACE solutions given in shb_grc_ncf as a comma-separated
+#         list, e.g. JPL,CSR,GFZ (default is NONE: the file names without 
+#         extension are used). With several solutions, the domain is only 
+#         determined once, shb_wsa_csv has one column per solution and region 
+#         followed by the ensemble mean and spread (standard deviation across 
+#         solutions) of each region, and the netCDF files hold the ensemble 
+#         mean (and spread for shb_tsr_ncf).
+# --msc - Optional netCDF file on the GRACE grid with the ID of the mascon that
+#         each grid cell belongs to (default is NONE: no mascons). Anomalies 
+#         are then computed once per mascon from one representative grid cell 
+#         and regional timeseries use weights summed over the grid cells of 
+#         each mascon, which is exact for mascon solutions where all grid 
+#         cells of a mascon share the same values. The GRACE files are read 
+#         over the rows and columns of the representative grid cells.
+# --msc_var - Name of the variable with mascon IDs, of dimensions (lat,lon), 
+#             default is mascon_id.
+# --workers - Number of worker processes (default is 1). The long-term mean is
+#             computed over bands of latitudes and the anomalies over time 
+#             chunks, both in parallel. Workers open their own netCDF handles 
+#             and share cell indices, weights, means and results through shared
+#             memory. Results are identical to those of one process. The 
+#             memory budget of --mem applies to each worker.
+# --mmp - Memory-map the GRACE and scale factor files that are netCDF classic 
+#         files: 1 or 0 (default). Variables are then read as views of the 
+#         data on disk instead of decoded copies, so that repeat runs read from
+#         the page cache and concurrent runs share the same physical pages. 
+#         Other files are read with netCDF4 as usual.
+# --prp - Prepared anomalies: 1 or 0 (default). With 1, shb_grc_ncf are files
+#         created by shbaam_prep.py that hold the anomalies of all grid cells 
+#         and their long-term mean, which is then not computed again. A 
+#         baseline period given with --bsl must be that of these files. 
+#         Without --bsl, the mean of the anomalies over the time window is 
+#         removed when the time window differs from their baseline period, 
+#         as without --prp.
+# --sta - Statistics of the grid cells of each region computed at each time 
+#         step along with their average, given as a comma-separated list of: 
+#         std (area-weighted standard deviation), min, max, pNN (area-weighted
+#         percentile, e.g. p10 or p50) and count (numbers of valid and NoData 
+#         grid cells), default is NONE. The values of the grid cells are their
+#         anomalies times their scale factors, of which the area-weighted 
+#         average is the timeseries of the region, grid cells with NoData in 
+#         the scale factors or in GRACE are excluded. Statistics are computed 
+#         for the ensemble mean and written after each region in shb_wsa_csv
+#         and as variables of shb_tsr_ncf.
+
+shb_opt={'sel': 'grid', 'key': 'NONE', 'lab_var': 'label', 'par': 'NONE',      \
+         'tsr': 'NONE', 'wgt': 'NONE',                                         \
+         'cch': 'NONE', 'cch_mb': '1024', 'cch_day': '90',                     \
+         'fmt': 'NETCDF3_CLASSIC', 'zlb': '0', 'shf': '1', 'chk': 'NONE',      \
+         'mem': 'NONE', 'crp': 'NONE', 'beg': 'NONE', 'end': 'NONE',           \
+         'bsl': 'NONE', 'app': '0',                                            \
+         'sol': 'NONE', 'msc': 'NONE', 'msc_var': 'mascon_id',                 \
+         'workers': '1', 'mmp': '0', 'prp': '0', 'sta': 'NONE'}
+for YS_arg in sys.argv[7:]:
+     if not YS_arg.startswith('--') or '=' not in YS_arg:
+          print('ERROR - Optional arguments must be given as --name=value')
+          raise SystemExit(22) 
+     YS_opt,YS_val=YS_arg[2:].split('=',1)
+     if YS_opt not in shb_opt:
+          print('ERROR - Unknown optional argument: '+YS_arg)
+          raise SystemExit(22) 
+     shb_opt[YS_opt]=YS_val
+
+shb_sel_mth=shb_opt['sel']
+if shb_sel_mth!='grid' and shb_sel_mth!='rtree':
+     print('ERROR - The selection method must be grid or rtree')
+     raise SystemExit(22) 
+
+if shb_sel_mth=='rtree' and shb_pnt_shp=='NONE':
+     print('ERROR - The rtree selection method requires a point shapefile')
+     raise SystemExit(22) 
+
+BS_pol_lab=shb_pol_shp.lower().endswith('.nc')
+YS_lab_var=shb_opt['lab_var']
+
+if BS_pol_lab and shb_sel_mth=='rtree':
+     print('ERROR - The rtree selection method requires a polygon shapefile')
+     raise SystemExit(22) 
+
+if BS_pol_lab and shb_opt['key']!='NONE':
+     print('ERROR - The regions of a label raster are given by its labels')
+     raise SystemExit(22) 
+
+shb_reg_key=shb_opt['key']
+shb_par_csv='NONE'
+YV_par_att=[]
+if shb_opt['par'].lower().endswith('.csv'):
+     shb_par_csv=shb_opt['par']
+elif shb_opt['par']!='NONE':
+     YV_par_att=shb_opt['par'].split(',')
+
+if BS_pol_lab and len(YV_par_att) > 0:
+     print('ERROR - The hierarchy of the regions of a label raster must be '   \
+           +'given as a CSV file')
+     raise SystemExit(22) 
+shb_tsr_ncf=shb_opt['tsr']
+shb_wgt_ncf=shb_opt['wgt']
+shb_cch_dir=shb_opt['cch']
+shb_msc_ncf=shb_opt['msc']
+YS_msc_var=shb_opt['msc_var']
+
+IS_prc=int(shb_opt['workers'])
+if IS_prc < 1:
+     print('ERROR - The number of workers must be at least 1')
+     raise SystemExit(22) 
+
+BS_grc_mmp=(shb_opt['mmp']=='1')
+BS_grc_prp=(shb_opt['prp']=='1')
+
+YV_sta_nam=[]
+ZV_sta_pct=[]
+if shb_opt['sta']!='NONE':
+     for YS_sta in shb_opt['sta'].split(','):
+          if YS_sta in ['std','min','max']:
+               YV_sta_nam.append(YS_sta)
+          elif YS_sta=='count':
+               YV_sta_nam=YV_sta_nam+['valid_count','nodata_count']
+          elif YS_sta.startswith('p'):
+               try:
+                    ZS_sta_pct=float(YS_sta[1:])
+               except ValueError:
+                    ZS_sta_pct=-1
+               if ZS_sta_pct < 0 or ZS_sta_pct > 100:
+                    print('ERROR - Percentiles must be between p0 and p100')
+                    raise SystemExit(22) 
+               YV_sta_nam.append(YS_sta)
+               ZV_sta_pct.append(ZS_sta_pct)
+          else:
+               print('ERROR - Unknown statistic: '+YS_sta)
+               raise SystemExit(22) 
+IS_sta_tot=len(YV_sta_nam)
+ZS_cch_mb=float(shb_opt['cch_mb'])
+ZS_cch_day=float(shb_opt['cch_day'])
+
+shb_wsa_fmt=shb_opt['fmt']
+if shb_wsa_fmt not in ['NETCDF3_CLASSIC','NETCDF3_64BIT_OFFSET',              \
+                       'NETCDF4_CLASSIC','NETCDF4']:
+     print('ERROR - Unknown netCDF format: '+shb_wsa_fmt)
+     raise SystemExit(22) 
+
+IS_wsa_zlb=int(shb_opt['zlb'])
+if IS_wsa_zlb < 0 or IS_wsa_zlb > 9:
+     print('ERROR - The zlib compression level must be between 0 and 9')
+     raise SystemExit(22) 
+
+BS_wsa_shf=(shb_opt['shf']=='1')
+
+if shb_opt['chk']=='NONE':
+     IV_wsa_chk=None
+else:
+     IV_wsa_chk=[int(YS_chk) for YS_chk in shb_opt['chk'].split(',')]
+     if len(IV_wsa_chk)!=3 or min(IV_wsa_chk) < 1:
+          print('ERROR - The chunk shape must be given as time,lat,lon')
+          raise SystemExit(22) 
+
+if shb_opt['mem']=='NONE':
+     ZS_mem_mb=None
+else:
+     ZS_mem_mb=float(shb_opt['mem'])
+     if ZS_mem_mb <= 0:
+          print('ERROR - The memory budget must be positive')
+          raise SystemExit(22) 
+
+if shb_opt['crp']=='NONE':
+     IS_crp_hal=None
+else:
+     IS_crp_hal=int(shb_opt['crp'])
+     if IS_crp_hal < 0:
+          print('ERROR - The halo of the cropped grid must not be negative')
+          raise SystemExit(22) 
+
+shb_win_beg=None
+shb_win_end=None
+try:
+     if shb_opt['beg']!='NONE':
+          shb_win_beg=datetime.datetime.strptime(shb_opt['beg'],'%Y-%m-%d')
+     if shb_opt['end']!='NONE':
+          shb_win_end=datetime.datetime.strptime(shb_opt['end'],'%Y-%m-%d')
+except ValueError:
+     print('ERROR - The time window must be given as YYYY-MM-DD')
+     raise SystemExit(22) 
+if shb_win_beg is not None and shb_win_end is not None                         \
+and shb_win_end < shb_win_beg:
+     print('ERROR - The end of the time window is before its start')
+     raise SystemExit(22) 
+
+if shb_opt['bsl']=='NONE':
+     YV_bsl=None
+else:
+     YV_bsl=shb_opt['bsl'].split(',')
+     try:
+          shb_bsl_beg=datetime.datetime.strptime(YV_bsl[0],'%Y-%m-%d')
+          shb_bsl_end=datetime.datetime.strptime(YV_bsl[1],'%Y-%m-%d')
+     except (IndexError,ValueError):
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22) 
+     if len(YV_bsl)!=2 or shb_bsl_end < shb_bsl_beg:
+          print('ERROR - The baseline period must be given as '                \
+                +'YYYY-MM-DD,YYYY-MM-DD')
+          raise SystemExit(22) 
+
+BS_wsa_app=(shb_opt['app']=='1')
+if BS_wsa_app and YV_bsl is None:
+     print('ERROR - The append mode requires a fixed baseline period')
+     raise SystemExit(22) 
+
+if BS_wsa_app and IS_sol_tot > 1:
+     print('ERROR - The append mode is limited to one unique GRACE solution')
+     raise SystemExit(22) 
+
+if shb_opt['sol']=='NONE':
+     YV_sol_nam=[os.path.splitext(os.path.basename(YS_grc_ncf))[0]             \
+                 for YS_grc_ncf in YV_grc_ncf]
+else:
+     YV_sol_nam=shb_opt['sol'].split(',')
+     if len(YV_sol_nam)!=IS_sol_tot:
+          print('ERROR - The number of solution names differs from the '       \
+                +'number of GRACE files')
+          raise SystemExit(22) 
+
 
 #*******************************************************************************
 #Print input information
@@ -71,17 +381,20 @@ print(' - '+shb_pol_shp)
 print(' - '+shb_pnt_shp)
 print(' - '+shb_wsa_csv)
 print(' - '+shb_wsa_ncf)
+for YS_opt in shb_opt:
+     print(' - --'+YS_opt+'='+shb_opt[YS_opt])
 
 
 #*******************************************************************************
 #Check if files exist 
 #*******************************************************************************
-try:
-     with open(shb_grc_ncf) as file:
-          pass
-except IOError as e:
-     print('ERROR - Unable to open '+shb_grc_ncf)
-     raise SystemExit(22) 
+for YS_grc_ncf in YV_grc_ncf:
+     try:
+          with open(YS_grc_ncf) as file:
+               pass
+     except IOError as e:
+          print('ERROR - Unable to open '+YS_grc_ncf)
+          raise SystemExit(22) 
 
 try:
      with open(shb_fct_ncf) as file:
@@ -97,6 +410,22 @@ except IOError as e:
      print('ERROR - Unable to open '+shb_pol_shp)
      raise SystemExit(22) 
 
+if shb_par_csv!='NONE':
+     try:
+          with open(shb_par_csv) as file:
+               pass
+     except IOError as e:
+          print('ERROR - Unable to open '+shb_par_csv)
+          raise SystemExit(22) 
+
+if shb_msc_ncf!='NONE':
+     try:
+          with open(shb_msc_ncf) as file:
+               pass
+     except IOError as e:
+          print('ERROR - Unable to open '+shb_msc_ncf)
+          raise SystemExit(22) 
+
 
 #*******************************************************************************
 #Read GRACE netCDF file
@@ -106,7 +435,33 @@ print('Read GRACE netCDF file')
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Open netCDF file
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-f = netCDF4.Dataset(shb_grc_ncf, 'r')
+shb_grc_lst=[shbaam_mmap.shb_ncf_opn(YS_grc_ncf,BS_grc_mmp)                    \
+             for YS_grc_ncf in YV_grc_ncf]
+f = shb_grc_lst[0]
+#Dimensions and metadata are taken from the first GRACE solution
+
+print(' - The number of GRACE solutions is: '+str(IS_sol_tot))
+
+if BS_grc_mmp:
+     IS_mmp=sum([isinstance(shb_sol,shbaam_mmap.shb_mmp_dst)                   \
+                 for shb_sol in shb_grc_lst])
+     print(' - The number of memory-mapped GRACE files is: '+str(IS_mmp))
+
+if BS_grc_prp:
+     for JS_sol in range(IS_sol_tot):
+          shb_sol=shb_grc_lst[JS_sol]
+          if 'lwe_thickness_baseline' not in shb_sol.variables:
+               print('ERROR - No prepared anomalies found in '                 \
+                     +YV_grc_ncf[JS_sol])
+               raise SystemExit(22) 
+          YV_prp_bsl=[shb_sol.getncattr('baseline_start'),                     \
+                      shb_sol.getncattr('baseline_end')]
+          if YV_bsl is not None and YV_prp_bsl!=YV_bsl:
+               print('ERROR - The baseline period differs from that of '       \
+                     +YV_grc_ncf[JS_sol])
+               raise SystemExit(22) 
+     print(' - The baseline period of prepared anomalies is: '                 \
+           +YV_prp_bsl[0]+' to '+YV_prp_bsl[1])
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get dimension sizes
@@ -133,6 +488,9 @@ ZV_grc_time=f.variables['time']
 ZS_grc_lon_stp=abs(ZV_grc_lon[1]-ZV_grc_lon[0])
 print(' - The interval size for longitudes is: '+str(ZS_grc_lon_stp))
 
+BS_grc_glb=(abs(IS_grc_lon*ZS_grc_lon_stp-360) < ZS_grc_lon_stp/2)
+#Whether the longitudes cover the entire globe and can wrap around
+
 ZS_grc_lat_stp=abs(ZV_grc_lat[1]-ZV_grc_lat[0])
 print(' - The interval size for latitudes is: '+str(ZS_grc_lat_stp))
 
@@ -164,7 +522,11 @@ print('Read scale factors netCDF file')
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Open netCDF file
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-g= netCDF4.Dataset(shb_fct_ncf, 'r')
+g= shbaam_mmap.shb_ncf_opn(shb_fct_ncf,BS_grc_mmp)
+
+if BS_grc_mmp:
+     print(' - The scale factors file is memory-mapped: '                      \
+           +str(isinstance(g,shbaam_mmap.shb_mmp_dst)))
 
 #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #Get dimension sizes
@@ -203,128 +565,557 @@ if not (ZV_fct_lat[:] == ZV_grc_lat[:]).all():
      print('ERROR - The values of latitudes differ')
      raise SystemExit(22) 
 
+for JS_sol in range(1,IS_sol_tot):
+     shb_sol=shb_grc_lst[JS_sol]
+     if len(shb_sol.dimensions['lon'])!=IS_grc_lon                             \
+     or len(shb_sol.dimensions['lat'])!=IS_grc_lat                             \
+     or len(shb_sol.dimensions['time'])!=IS_grc_time:
+          print('ERROR - The dimensions of GRACE solutions differ')
+          raise SystemExit(22) 
+     if not (shb_sol.variables['lon'][:] == ZV_grc_lon[:]).all()               \
+     or not (shb_sol.variables['lat'][:] == ZV_grc_lat[:]).all()               \
+     or not (shb_sol.variables['time'][:] == ZV_grc_time[:]).all():
+          print('ERROR - The coordinates of GRACE solutions differ')
+          raise SystemExit(22) 
+
 print(' - The files are consistent')
 
 
+#*******************************************************************************
+#Determine time strings
+#*******************************************************************************
+print('Determine time strings')
+shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                \
+                                         '%Y-%m-%dT%H:%M:%S')
+
+YV_grc_time=[]
+for JS_grc_time in range(IS_grc_time):
+     shb_dat_dlt=datetime.timedelta(days=float(ZV_grc_time[JS_grc_time]))
+     YS_grc_time=(shb_dat_str+shb_dat_dlt).strftime('%m/%d/%Y')
+     YV_grc_time.append(YS_grc_time)
+
+
+#*******************************************************************************
+#Determine time window
+#*******************************************************************************
+print('Determine time window')
+
+ZV_grc_day=numpy.array(ZV_grc_time[:],dtype=numpy.float64)
+#Time values are in days since the reference date used for time strings
+
+BV_win_time=numpy.ones(IS_grc_time,dtype=bool)
+if shb_win_beg is not None:
+     BV_win_time&=(ZV_grc_day >= (shb_win_beg-shb_dat_str).days)
+if shb_win_end is not None:
+     BV_win_time&=(ZV_grc_day < (shb_win_end-shb_dat_str).days+1)
+
+IV_win_time=numpy.nonzero(BV_win_time)[0]
+if len(IV_win_time)==0:
+     print('ERROR - No time steps found within the time window')
+     raise SystemExit(22) 
+
+JS_win_beg=int(IV_win_time[0])
+JS_win_end=int(IV_win_time[-1])+1
+#GRACE time steps are in increasing order, the time window is a range of them
+
+print(' - The index of the first time step in the time window is: '            \
+      +str(JS_win_beg))
+print(' - The number of time steps in the time window is: '                    \
+      +str(JS_win_end-JS_win_beg))
+
+
+#*******************************************************************************
+#Determine baseline period
+#*******************************************************************************
+print('Determine baseline period')
+
+if YV_bsl is None:
+     BV_bsl_time=BV_win_time.copy()
+else:
+     ZS_bsl_beg=(shb_bsl_beg-shb_dat_str).days
+     ZS_bsl_end=(shb_bsl_end-shb_dat_str).days+1
+     BV_bsl_time=(ZV_grc_day >= ZS_bsl_beg) & (ZV_grc_day < ZS_bsl_end)
+
+IS_bsl_time=int(numpy.sum(BV_bsl_time))
+if IS_bsl_time==0:
+     print('ERROR - No time steps found within the baseline period')
+     raise SystemExit(22) 
+
+JS_bsl_beg=int(numpy.nonzero(BV_bsl_time)[0][0])
+JS_bsl_end=int(numpy.nonzero(BV_bsl_time)[0][-1])+1
+
+print(' - The number of time steps in the baseline period is: '                \
+      +str(IS_bsl_time))
+
+BS_prp_avg=False
+if BS_grc_prp and YV_bsl is None:
+     for shb_sol in shb_grc_lst:
+          if shb_sol.getncattr('baseline_start')=='NONE':
+               BV_prp_time=numpy.ones(IS_grc_time,dtype=bool)
+          else:
+               ZS_prp_beg=(datetime.datetime.strptime(                         \
+                           shb_sol.getncattr('baseline_start'),'%Y-%m-%d')     \
+                           -shb_dat_str).days
+               ZS_prp_end=(datetime.datetime.strptime(                         \
+                           shb_sol.getncattr('baseline_end'),'%Y-%m-%d')       \
+                           -shb_dat_str).days+1
+               BV_prp_time=(ZV_grc_day >= ZS_prp_beg)                          \
+                          &(ZV_grc_day < ZS_prp_end)
+          if not numpy.array_equal(BV_prp_time,BV_bsl_time):
+               BS_prp_avg=True
+     if BS_prp_avg:
+          print(' - The mean of prepared anomalies over the time window is '   \
+                +'removed')
+#Without a baseline period, the long-term mean is that of the time window, 
+#which prepared anomalies have removed only if it is their baseline period
+
+
+#*******************************************************************************
+#Read label raster
+#*******************************************************************************
+if BS_pol_lab:
+     print('Read label raster')
+
+     l = netCDF4.Dataset(shb_pol_shp, 'r')
+     if YS_lab_var not in l.variables                                          \
+     or l.variables[YS_lab_var].shape!=(IS_grc_lat,IS_grc_lon)                 \
+     or l.variables[YS_lab_var].dtype.kind not in 'iu':
+          print('ERROR - No integer variable '+YS_lab_var+' on the GRACE '     \
+                +'grid in '+shb_pol_shp)
+          raise SystemExit(22) 
+     ZM_pol_lab=l.variables[YS_lab_var][:,:]
+     l.close()
+
+     IS_pol_lab=int(numpy.sum(~numpy.ma.getmaskarray(ZM_pol_lab)))
+     print(' - The number of labeled grid cells is: '+str(IS_pol_lab))
+
+
 #*******************************************************************************
 #Read polygon shapefile
 #*******************************************************************************
-print('Read polygon shapefile')
+if not BS_pol_lab:
+     print('Read polygon shapefile')
 
-shb_pol_lay=fiona.open(shb_pol_shp, 'r')
-IS_pol_tot=len(shb_pol_lay)
-print(' - The number of polygon features is: '+str(IS_pol_tot))
+     shb_pol_lay=fiona.open(shb_pol_shp, 'r')
+     IS_pol_tot=len(shb_pol_lay)
+     print(' - The number of polygon features is: '+str(IS_pol_tot))
+
+if shb_reg_key!='NONE' and shb_reg_key not in shb_pol_lay.schema['properties']:
+     print('ERROR - The polygon shapefile has no attribute: '+shb_reg_key)
+     raise SystemExit(22) 
+
+for YS_par_att in YV_par_att:
+     if YS_par_att not in shb_pol_lay.schema['properties']:
+          print('ERROR - The polygon shapefile has no attribute: '+YS_par_att)
+          raise SystemExit(22) 
+
+
+#*******************************************************************************
+#Check cache for the domain
+#*******************************************************************************
+BS_cch_hit=False
+
+if shb_cch_dir!='NONE' and not BS_pol_lab:
+     print('Check cache for the domain')
+
+     YS_cch_key=shbaam_cche.shb_cch_key('shbaam_twsa',shb_pol_lay,shb_reg_key, \
+                                        ZV_grc_lon[:],ZV_grc_lat[:],           \
+                                        [shb_fct_ncf])
+     print(' - The cache key is: '+YS_cch_key)
+
+     shb_cch_dic=shbaam_cche.shb_cch_get(shb_cch_dir,YS_cch_key)
+     if shb_cch_dic is not None:
+          BS_cch_hit=True
+          IV_dom_lon=shb_cch_dic['IV_dom_lon']
+          IV_dom_lat=shb_cch_dic['IV_dom_lat']
+          IV_lnk_reg=shb_cch_dic['IV_lnk_reg']
+          IV_lnk_dom=shb_cch_dic['IV_lnk_dom']
+          YV_reg_nam=[str(YS_reg_nam) for YS_reg_nam in                        \
+                                                      shb_cch_dic['YV_reg_nam']]
+          ZV_dom_sqm=shb_cch_dic['ZV_dom_sqm']
+          ZV_dom_msk=shb_cch_dic['ZV_dom_msk']
+          ZV_dom_scl=shb_cch_dic['ZV_dom_scl']
+          IS_dom_tot=len(IV_dom_lon)
+          IS_lnk_tot=len(IV_lnk_reg)
+          print(' - The domain was found in cache, geometry work is skipped')
+     else:
+          print(' - The domain was not found in cache')
+
+
+#*******************************************************************************
+#Shift GRACE longitude range from [0;360] to [-180;180]
+#*******************************************************************************
+print('Shift GRACE longitude range from [0;360] to [-180;180]')
+
+ZV_grc_lon_180=numpy.array(ZV_grc_lon[:])
+ZV_grc_lon_180[ZV_grc_lon_180 > 180]=ZV_grc_lon_180[ZV_grc_lon_180 > 180]-360
+ZV_grc_lon_180=ZV_grc_lon_180.astype(numpy.float64)
+ZV_grc_lat_180=numpy.array(ZV_grc_lat[:]).astype(numpy.float64)
+#The shift is made in the precision of the file, as for the point shapefile
 
 
 #*******************************************************************************
 #Create a point shapefile with all the GRACE grid cells
 #*******************************************************************************
-print('Create a point shapefile with all the GRACE grid cells')
-
-shb_pol_drv=shb_pol_lay.driver
-shb_pnt_drv=shb_pol_drv
-
-shb_pol_crs=shb_pol_lay.crs
-shb_pnt_crs=shb_pol_crs.copy()
-
-shb_pnt_sch={'geometry': 'Point',                                              \
-             'properties': {'JS_grc_lon': 'int:4',                             \
-                            'JS_grc_lat': 'int:4'}}
-
-with fiona.open(shb_pnt_shp,'w',driver=shb_pnt_drv,                            \
-                                crs=shb_pnt_crs,                               \
-                                schema=shb_pnt_sch) as shb_pnt_lay:
-     for JS_grc_lon in range(IS_grc_lon):
-          ZS_grc_lon=ZV_grc_lon[JS_grc_lon]
-          if (ZS_grc_lon > 180):
-               ZS_grc_lon=ZS_grc_lon-360
-               #Shift GRACE longitude range from [0;360] to [-180;180]
-          for JS_grc_lat in range(IS_grc_lat):
-               ZS_grc_lat=ZV_grc_lat[JS_grc_lat]
-               shb_pnt_prp={'JS_grc_lon': JS_grc_lon, 'JS_grc_lat': JS_grc_lat}
-               shb_pnt_geo=shapely.geometry.mapping(                           \
+if shb_pnt_shp!='NONE':
+     print('Create a point shapefile with all the GRACE grid cells')
+
+     if BS_pol_lab:
+          shb_pnt_drv='ESRI Shapefile'
+          shb_pnt_crs=fiona.crs.from_epsg(4326)
+     else:
+          shb_pol_drv=shb_pol_lay.driver
+          shb_pnt_drv=shb_pol_drv
+
+          shb_pol_crs=shb_pol_lay.crs
+          shb_pnt_crs=shb_pol_crs.copy()
+
+     shb_pnt_sch={'geometry': 'Point',                                         \
+                  'properties': {'JS_grc_lon': 'int:4',                        \
+                                 'JS_grc_lat': 'int:4'}}
+
+     with fiona.open(shb_pnt_shp,'w',driver=shb_pnt_drv,                       \
+                                     crs=shb_pnt_crs,                          \
+                                     schema=shb_pnt_sch) as shb_pnt_lay:
+          for JS_grc_lon in range(IS_grc_lon):
+               ZS_grc_lon=ZV_grc_lon_180[JS_grc_lon]
+               for JS_grc_lat in range(IS_grc_lat):
+                    ZS_grc_lat=ZV_grc_lat_180[JS_grc_lat]
+                    shb_pnt_prp={'JS_grc_lon': JS_grc_lon,                     \
+                                 'JS_grc_lat': JS_grc_lat}
+                    shb_pnt_geo=shapely.geometry.mapping(                      \
                                 shapely.geometry.Point((ZS_grc_lon,ZS_grc_lat)))
-               shb_pnt_lay.write({                                             \
-                                  'properties': shb_pnt_prp,                   \
-                                  'geometry': shb_pnt_geo,                     \
-                                  })
+                    shb_pnt_lay.write({                                        \
+                                       'properties': shb_pnt_prp,              \
+                                       'geometry': shb_pnt_geo,                \
+                                       })
 
-print(' - New shapefile created')
+     print(' - New shapefile created')
 
 
 #*******************************************************************************
 #Create spatial index for the bounds of each point feature
 #*******************************************************************************
-print('Create spatial index for the bounds of each point feature')
+if shb_sel_mth=='rtree' and not BS_cch_hit:
+     print('Create spatial index for the bounds of each point feature')
 
-shb_pnt_lay=fiona.open(shb_pnt_shp, 'r')
+     shb_pnt_lay=fiona.open(shb_pnt_shp, 'r')
 
-index=rtree.index.Index()
-for shb_pnt_fea in shb_pnt_lay:
-     shb_pnt_fid=int(shb_pnt_fea['id'])
-     #the first argument of index.insert has to be 'int', not 'long' or 'str'
-     shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
-     index.insert(shb_pnt_fid, shb_pnt_shy.bounds)
-     #creates an index between the feature ID and the bounds of that feature
+     index=rtree.index.Index()
+     for shb_pnt_fea in shb_pnt_lay:
+          shb_pnt_fid=int(shb_pnt_fea['id'])
+          #the first argument of index.insert has to be 'int', not 'long' or 
+          #'str'
+          shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
+          index.insert(shb_pnt_fid, shb_pnt_shy.bounds)
+          #creates an index between the feature ID and the bounds of that 
+          #feature
 
-print(' - Spatial index created')
+     print(' - Spatial index created')
 
 
 #*******************************************************************************
-#Find GRACE grid cells that intersect with polygon
+#Find GRACE grid cells of each label
 #*******************************************************************************
-print('Find GRACE grid cells that intersect with polygon')
+if BS_pol_lab:
+     print('Find GRACE grid cells of each label')
 
-IS_dom_tot=0
-IV_dom_lon=[]
-IV_dom_lat=[]
+     IV_dom_lat,IV_dom_lon=numpy.nonzero(~numpy.ma.getmaskarray(ZM_pol_lab))
+     IV_lab_unq,IV_dom_reg=numpy.unique(                                       \
+                           numpy.ma.getdata(ZM_pol_lab)[IV_dom_lat,IV_dom_lon],\
+                           return_inverse=True)
+     IV_dom_reg=IV_dom_reg.ravel()
+     YV_reg_nam=[str(JS_lab) for JS_lab in IV_lab_unq.tolist()]
+     IS_dom_tot=len(IV_dom_lat)
+     #Regions are sorted by label, each labeled grid cell is in one region
 
-for shb_pol_fea in shb_pol_lay:
-     shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
-     shb_pol_pre=shapely.prepared.prep(shb_pol_shy)
-     #a 'prepared' geometry allows for faster processing after
-     for shb_pnt_fid in [int(x) for x in                                       \
-                                  list(index.intersection(shb_pol_shy.bounds))]:
-          shb_pnt_fea=shb_pnt_lay[shb_pnt_fid]
-          shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
-          if shb_pol_pre.contains(shb_pnt_shy):
-               JS_dom_lon=shb_pnt_fea['properties']['JS_grc_lon']
-               JS_dom_lat=shb_pnt_fea['properties']['JS_grc_lat']
-               IV_dom_lon.append(JS_dom_lon)
-               IV_dom_lat.append(JS_dom_lat)
-               IS_dom_tot=IS_dom_tot+1
- 
-print(' - The number of grid cells found is: '+str(IS_dom_tot))
+     print(' - The number of grid cells found is: '+str(IS_dom_tot))
 
 
 #*******************************************************************************
-#Find long-term mean for each intersecting GRACE grid cell
+#Find GRACE grid cells that intersect with polygon
 #*******************************************************************************
-print('Find long-term mean for each intersecting GRACE grid cell')
+if not BS_cch_hit and not BS_pol_lab:
+     print('Find GRACE grid cells that intersect with polygon')
+
+     IS_dom_tot=0
+     IV_dom_lon=[]
+     IV_dom_lat=[]
+     IV_dom_reg=[]
+     #Region index of each domain grid cell, all features belong to one unique
+     #region unless a feature attribute is used as a key
+
+     YV_reg_nam=[]
+     IM_reg_nam={}
+
+     if shb_sel_mth=='grid':
+          ZS_grc_lon_0=float(ZV_grc_lon[0])
+          ZS_grc_lat_0=float(ZV_grc_lat[0])
+          ZS_grc_lat_dlt=float(ZV_grc_lat[1]-ZV_grc_lat[0])
+
+     for shb_pol_fea in shb_pol_lay:
+          shb_pol_shy=shapely.geometry.shape(shb_pol_fea['geometry'])
+
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          #Region of the feature
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          if shb_reg_key=='NONE':
+               YS_reg_nam='TWSa'
+          else:
+               YS_reg_nam=str(shb_pol_fea['properties'][shb_reg_key])
+          if YS_reg_nam not in IM_reg_nam:
+               IM_reg_nam[YS_reg_nam]=len(YV_reg_nam)
+               YV_reg_nam.append(YS_reg_nam)
+          JS_reg=IM_reg_nam[YS_reg_nam]
+
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          #Using the spatial index
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          if shb_sel_mth=='rtree':
+               shb_pol_pre=shapely.prepared.prep(shb_pol_shy)
+               #a 'prepared' geometry allows for faster processing after
+               for shb_pnt_fid in [int(x) for x in                             \
+                             list(index.intersection(shb_pol_shy.bounds))]:
+                    shb_pnt_fea=shb_pnt_lay[shb_pnt_fid]
+                    shb_pnt_shy=shapely.geometry.shape(shb_pnt_fea['geometry'])
+                    if shb_pol_pre.contains(shb_pnt_shy):
+                         JS_dom_lon=shb_pnt_fea['properties']['JS_grc_lon']
+                         JS_dom_lat=shb_pnt_fea['properties']['JS_grc_lat']
+                         IV_dom_lon.append(JS_dom_lon)
+                         IV_dom_lat.append(JS_dom_lat)
+                         IV_dom_reg.append(JS_reg)
+                         IS_dom_tot=IS_dom_tot+1
+
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          #Using index arithmetic on the regular grid
+          #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          if shb_sel_mth=='grid':
+               ZS_pol_lon_min,ZS_pol_lat_min,ZS_pol_lon_max,ZS_pol_lat_max=    \
+                                                              shb_pol_shy.bounds
+
+               JS_lon_min=math.floor(((ZS_pol_lon_min-ZS_grc_lon_0)%360)       \
+                                     /ZS_grc_lon_stp)-1
+               JS_lon_max=JS_lon_min                                           \
+                         +math.ceil((ZS_pol_lon_max-ZS_pol_lon_min)            \
+                                    /ZS_grc_lon_stp)+2
+               IV_pol_lon=numpy.arange(JS_lon_min,JS_lon_max+1)
+               if BS_grc_glb:
+                    IV_pol_lon=numpy.unique(IV_pol_lon%IS_grc_lon)
+               else:
+                    IV_pol_lon=IV_pol_lon[(IV_pol_lon>=0)                      \
+                                         &(IV_pol_lon<IS_grc_lon)]
+
+               ZV_pol_lat_idx=numpy.array([(ZS_pol_lat_min-ZS_grc_lat_0),      \
+                                           (ZS_pol_lat_max-ZS_grc_lat_0)])     \
+                             /ZS_grc_lat_dlt
+               JS_lat_min=max(math.floor(ZV_pol_lat_idx.min())-1,0)
+               JS_lat_max=min(math.ceil(ZV_pol_lat_idx.max())+1,IS_grc_lat-1)
+               IV_pol_lat=numpy.arange(JS_lat_min,JS_lat_max+1)
+               #Candidate grid cells are in the polygon bounds plus a one-cell 
+               #margin
+
+               IM_pol_lon,IM_pol_lat=numpy.meshgrid(IV_pol_lon,IV_pol_lat,     \
+                                                    indexing='ij')
+               IV_pol_lon=IM_pol_lon.ravel()
+               IV_pol_lat=IM_pol_lat.ravel()
+               BV_pol_in=shapely.vectorized.contains(shb_pol_shy,              \
+                                             ZV_grc_lon_180[IV_pol_lon],       \
+                                             ZV_grc_lat_180[IV_pol_lat])
+               #All candidate cell centers are tested in one vectorized pass
+
+               IS_pol_in=int(numpy.sum(BV_pol_in))
+               IV_dom_lon.extend(IV_pol_lon[BV_pol_in].tolist())
+               IV_dom_lat.extend(IV_pol_lat[BV_pol_in].tolist())
+               IV_dom_reg.extend([JS_reg]*IS_pol_in)
+               IS_dom_tot=IS_dom_tot+IS_pol_in
+
+     print(' - The number of grid cells found is: '+str(IS_dom_tot))
+
+
+#*******************************************************************************
+#Find unique grid cells of the domain and their links with regions
+#*******************************************************************************
+if not BS_cch_hit:
+     print('Find unique grid cells of the domain and their links with regions')
+
+     if IS_dom_tot==0 and BS_pol_lab:
+          print('ERROR - No labeled GRACE grid cells found in the label raster')
+          raise SystemExit(22) 
+     if IS_dom_tot==0:
+          print('ERROR - No GRACE grid cells found within the polygon '        \
+                +'shapefile')
+          raise SystemExit(22) 
 
-ZV_dom_avg=[0]*IS_dom_tot
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     for JS_grc_time in range(IS_grc_time):
-          ZV_dom_avg[JS_dom_tot]=ZV_dom_avg[JS_dom_tot]                        \
-                                +f.variables['lwe_thickness']                  \
-                                            [JS_grc_time,JS_grc_lat,JS_grc_lon]
-ZV_dom_avg=[x/IS_grc_time for x in ZV_dom_avg]
+     IS_lnk_tot=IS_dom_tot
+     IV_lnk_reg=numpy.array(IV_dom_reg,dtype=numpy.int32)
+     IV_lnk_cel=numpy.array(IV_dom_lat,dtype=numpy.int64)*IS_grc_lon           \
+               +numpy.array(IV_dom_lon,dtype=numpy.int64)
+     #Each link is a (region, grid cell) pair, a grid cell that is found within 
+     #several features of a region is linked several times to that region
+
+     IV_cel_unq,IV_lnk_dom=numpy.unique(IV_lnk_cel,return_inverse=True)
+     IV_lnk_dom=IV_lnk_dom.ravel()
+     IS_dom_tot=len(IV_cel_unq)
+     IV_dom_lat=(IV_cel_unq//IS_grc_lon).astype(numpy.int32)
+     IV_dom_lon=(IV_cel_unq%IS_grc_lon).astype(numpy.int32)
+
+     print(' - The number of unique grid cells is: '+str(IS_dom_tot))
 
 
 #*******************************************************************************
 #Compute surface area of each grid cell
 #*******************************************************************************
-print('Compute surface area of each grid cell')
+if not BS_cch_hit:
+     print('Compute surface area of each grid cell')
 
-ZV_dom_sqm=[0]*IS_dom_tot
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     ZS_grc_lat=ZV_grc_lat[JS_grc_lat]
-     ZV_dom_sqm[JS_dom_tot]=6371000*math.radians(ZS_grc_lat_stp)               \
-                           *6371000*math.radians(ZS_grc_lon_stp)               \
-                           *math.cos(math.radians(ZS_grc_lat))
+     ZV_dom_sqm=6371000*math.radians(ZS_grc_lat_stp)                           \
+               *6371000*math.radians(ZS_grc_lon_stp)                           \
+               *numpy.cos(numpy.radians(ZV_grc_lat[:].astype(numpy.float64)    \
+                                                  [IV_dom_lat]))
+
+
+#*******************************************************************************
+#Find NoData points in scale factors for each grid cell
+#*******************************************************************************
+if not BS_cch_hit:
+     print('Find NoData points in scale factors for each grid cell')
+
+     ZM_grc_scl=g.variables['scale_factor'][:,:]
+     ZV_dom_msk=numpy.ma.getmaskarray(ZM_grc_scl)[IV_dom_lat,IV_dom_lon]
+     ZV_dom_scl=numpy.where(ZV_dom_msk,0,                                      \
+                            numpy.ma.getdata(ZM_grc_scl)                       \
+                                                     [IV_dom_lat,IV_dom_lon])  \
+                            .astype(numpy.float64)
+
+
+#*******************************************************************************
+#Store domain in cache
+#*******************************************************************************
+if shb_cch_dir!='NONE' and not BS_pol_lab:
+     if not BS_cch_hit:
+          print('Store domain in cache')
+          shbaam_cche.shb_cch_put(shb_cch_dir,YS_cch_key,                      \
+                                  {'IV_dom_lon': IV_dom_lon,                   \
+                                   'IV_dom_lat': IV_dom_lat,                   \
+                                   'IV_lnk_reg': IV_lnk_reg,                   \
+                                   'IV_lnk_dom': IV_lnk_dom,                   \
+                                   'YV_reg_nam': numpy.array(YV_reg_nam),      \
+                                   'ZV_dom_sqm': ZV_dom_sqm,                   \
+                                   'ZV_dom_msk': ZV_dom_msk,                   \
+                                   'ZV_dom_scl': ZV_dom_scl})
+     IS_evc=shbaam_cche.shb_cch_evc(shb_cch_dir,ZS_cch_mb,ZS_cch_day)
+     print(' - The number of cache entries evicted is: '+str(IS_evc))
+
+
+#*******************************************************************************
+#Determine the hierarchy of regions
+#*******************************************************************************
+IS_lea_tot=len(YV_reg_nam)
+IS_par_tot=0
+IV_reg_par=numpy.full(IS_lea_tot,-1,dtype=numpy.int32)
+#The regions with polygon features are the leaves of the hierarchy, parent 
+#regions are added after them
+
+if shb_par_csv!='NONE' or len(YV_par_att) > 0:
+     print('Determine the hierarchy of regions')
+
+     YV_par_lnk=[]
+     if shb_par_csv!='NONE':
+          with open(shb_par_csv) as csvfile:
+               csvreader=csv.reader(csvfile, dialect='excel')
+               next(csvreader,None)
+               for YV_row in csvreader:
+                    if len(YV_row)==0:
+                         continue
+                    if len(YV_row)!=2:
+                         print('ERROR - Each line of '+shb_par_csv+' must '    \
+                               +'be a region,parent pair')
+                         raise SystemExit(22) 
+                    YV_par_lnk.append((YV_row[0],YV_row[1]))
+     else:
+          for shb_pol_fea in shb_pol_lay:
+               if shb_reg_key=='NONE':
+                    YV_fea_nam=['TWSa']
+               else:
+                    YV_fea_nam=[str(shb_pol_fea['properties'][shb_reg_key])]
+               YV_fea_nam=YV_fea_nam                                           \
+                         +[str(shb_pol_fea['properties'][YS_par_att])          \
+                           for YS_par_att in YV_par_att]
+               YV_par_lnk=YV_par_lnk+list(zip(YV_fea_nam[:-1],YV_fea_nam[1:]))
+     #Links between a region and its parent, from the table or from the 
+     #attributes of each feature
+
+     IM_reg_par={}
+     for YS_reg_nam,YS_par_nam in YV_par_lnk:
+          if YS_reg_nam==YS_par_nam:
+               print('ERROR - The region '+YS_reg_nam+' is its own parent')
+               raise SystemExit(22) 
+          if IM_reg_par.setdefault(YS_reg_nam,YS_par_nam)!=YS_par_nam:
+               print('ERROR - The region '+YS_reg_nam+' has several parents')
+               raise SystemExit(22) 
+
+     IM_reg_nam={YS_reg_nam: JS_reg for JS_reg,YS_reg_nam in                   \
+                                                         enumerate(YV_reg_nam)}
+     IV_hie_par=[]
+     IV_hie_lea=[]
+     for JS_lea in range(IS_lea_tot):
+          YS_reg_nam=YV_reg_nam[JS_lea]
+          YV_anc_nam=[YS_reg_nam]
+          while YS_reg_nam in IM_reg_par:
+               YS_par_nam=IM_reg_par[YS_reg_nam]
+               if YS_par_nam in YV_anc_nam:
+                    print('ERROR - The hierarchy of regions has a cycle: '     \
+                          +' > '.join(YV_anc_nam+[YS_par_nam]))
+                    raise SystemExit(22) 
+               YV_anc_nam.append(YS_par_nam)
+               if YS_par_nam not in IM_reg_nam:
+                    IM_reg_nam[YS_par_nam]=len(YV_reg_nam)
+                    YV_reg_nam.append(YS_par_nam)
+                    IV_reg_par=numpy.append(IV_reg_par,-1)
+               JS_par=IM_reg_nam[YS_par_nam]
+               if JS_par < IS_lea_tot:
+                    print('ERROR - The region '+YS_par_nam+' has polygon '     \
+                          +'features and is the parent of other regions')
+                    raise SystemExit(22) 
+               IV_reg_par[IM_reg_nam[YS_reg_nam]]=JS_par
+               IV_hie_par.append(JS_par)
+               IV_hie_lea.append(JS_lea)
+               YS_reg_nam=YS_par_nam
+     #All the ancestors of each leaf, in the order in which they are found, 
+     #regions of the table that are not above a leaf are ignored
+
+     IS_par_tot=len(YV_reg_nam)-IS_lea_tot
+     ZM_hie=scipy.sparse.csr_matrix((numpy.ones(len(IV_hie_par)),              \
+                                    (numpy.array(IV_hie_par)-IS_lea_tot,       \
+                                     IV_hie_lea)),                             \
+                                    shape=(IS_par_tot,IS_lea_tot))
+     #Each parent region is linked to all the leaves it contains, whatever the
+     #number of levels in between
+
+     IS_hie_lev=0
+     for JS_reg in range(IS_lea_tot):
+          IS_reg_lev=0
+          JS_par=IV_reg_par[JS_reg]
+          while JS_par!=-1:
+               IS_reg_lev=IS_reg_lev+1
+               JS_par=IV_reg_par[JS_par]
+          IS_hie_lev=max(IS_hie_lev,IS_reg_lev)
+
+     print(' - The number of parent regions is: '+str(IS_par_tot))
+     print(' - The number of levels above the regions is: '+str(IS_hie_lev))
+
+
+#*******************************************************************************
+#Determine regions
+#*******************************************************************************
+print('Determine regions')
+
+IS_reg_tot=len(YV_reg_nam)
+YV_reg_byt=[YS_reg_nam.encode('utf-8') for YS_reg_nam in YV_reg_nam]
+IS_reg_str=max([len(YS_reg_byt) for YS_reg_byt in YV_reg_byt])
+#Region names as bytes and their maximum length, for netCDF character arrays
+
+print(' - The number of regions is: '+str(IS_reg_tot))
 
 
 #*******************************************************************************
@@ -332,205 +1123,1169 @@ for JS_dom_tot in range(IS_dom_tot):
 #*******************************************************************************
 print('Find number of NoData points in scale factors for shapefile and area')
 
-ZM_grc_scl=g.variables['scale_factor'][:,:]
-IS_dom_msk=0
-ZS_sqm=0
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-          IS_dom_msk=IS_dom_msk+1
-     else:
-          ZS_sqm=ZS_sqm+ZV_dom_sqm[JS_dom_tot]
+IS_dom_msk=int(numpy.sum(ZV_dom_msk))
+ZV_reg_sqm=numpy.bincount(IV_lnk_reg,                                         \
+                          weights=(ZV_dom_sqm*(~ZV_dom_msk))[IV_lnk_dom],      \
+                          minlength=IS_reg_tot)
+if IS_par_tot > 0:
+     ZV_reg_sqm[IS_lea_tot:]=ZM_hie.dot(ZV_reg_sqm[:IS_lea_tot])
+#The valid area of a parent region is that of the regions it contains
+ZS_sqm=float(numpy.sum(ZV_reg_sqm[:IS_lea_tot]))
 
 print(' - The number of NoData points found is: '+str(IS_dom_msk))
 print(' - The area (m2) for the domain is: '+str(ZS_sqm))
 
+BV_reg_sqm=(ZV_reg_sqm > 0)
+if not BV_reg_sqm.all():
+     print(' - WARNING: regions without any valid grid cell have no '          \
+           +'timeseries: '                                                     \
+           +', '.join([YV_reg_nam[JS_reg] for JS_reg in                        \
+                                            numpy.flatnonzero(~BV_reg_sqm)]))
+
 
 #*******************************************************************************
-#Compute total terrestrial water storage anomaly timeseries
+#Group the grid cells of the domain by mascon
 #*******************************************************************************
-print('Compute total terrestrial water storage anomaly timeseries')
+if shb_msc_ncf=='NONE':
+     IV_wrk_dom=numpy.arange(IS_dom_tot)
+     IV_dom_wrk=numpy.arange(IS_dom_tot)
+else:
+     print('Group the grid cells of the domain by mascon')
+
+     n = netCDF4.Dataset(shb_msc_ncf, 'r')
+     if YS_msc_var not in n.variables                                          \
+     or n.variables[YS_msc_var].shape!=(IS_grc_lat,IS_grc_lon):
+          print('ERROR - No variable '+YS_msc_var+' on the GRACE grid in '     \
+                +shb_msc_ncf)
+          raise SystemExit(22) 
+     ZM_msc_ids=n.variables[YS_msc_var][:,:]
+     n.close()
+
+     if numpy.ma.getmaskarray(ZM_msc_ids)[IV_dom_lat,IV_dom_lon].any():
+          print('ERROR - Some grid cells of the domain have no mascon ID')
+          raise SystemExit(22) 
+
+     IV_dom_ids=numpy.ma.getdata(ZM_msc_ids)[IV_dom_lat,IV_dom_lon]
+     IV_msc_unq,IV_wrk_dom,IV_dom_wrk=numpy.unique(IV_dom_ids,                 \
+                                                   return_index=True,          \
+                                                   return_inverse=True)
+     IV_dom_wrk=IV_dom_wrk.ravel()
+     #The first grid cell of each mascon is its representative
+
+     print(' - The number of mascons is: '+str(len(IV_msc_unq)))
+
+     ZM_grc_lwe=numpy.ma.filled(f.variables['lwe_thickness'][0,:,:]            \
+                                .astype(numpy.float64),numpy.nan)
+     ZV_dom_lwe=ZM_grc_lwe[IV_dom_lat,IV_dom_lon]
+     ZV_msc_lwe=ZV_dom_lwe[IV_wrk_dom][IV_dom_wrk]
+     IS_msc_dif=int(numpy.sum(~((ZV_dom_lwe==ZV_msc_lwe)                       \
+                                |(numpy.isnan(ZV_dom_lwe)                      \
+                                 &numpy.isnan(ZV_msc_lwe)))))
+     if IS_msc_dif > 0:
+          print(' - WARNING: grid cells that differ from their mascon at the ' \
+                +'first time step: '+str(IS_msc_dif))
+
+IS_wrk_tot=len(IV_wrk_dom)
+#The computations over time are made for these cells: one per domain grid cell
+#or one per mascon
 
-ZV_wsa=[]
-for JS_grc_time in range(IS_grc_time):
-     ZS_wsa=0
-     for JS_dom_tot in range(IS_dom_tot):
-          JS_grc_lon=IV_dom_lon[JS_dom_tot]
-          JS_grc_lat=IV_dom_lat[JS_dom_tot]
-          ZS_dom_sqm=ZV_dom_sqm[JS_dom_tot]
-          ZS_dom_avg=ZV_dom_avg[JS_dom_tot]
-          if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-               ZS_dom_scl=0
+
+#*******************************************************************************
+#Determine the bounding hyperslab of the domain
+#*******************************************************************************
+print('Determine the bounding hyperslab of the domain')
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#Determine the bounds of the hyperslab
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+JS_slb_lat_beg=int(IV_dom_lat.min())
+JS_slb_lat_end=int(IV_dom_lat.max())+1
+
+IV_lon_unq=numpy.unique(IV_dom_lon)
+IV_lon_gap=numpy.diff(numpy.append(IV_lon_unq,IV_lon_unq[0]+IS_grc_lon))
+JS_lon_gap=int(numpy.argmax(IV_lon_gap))
+JS_slb_lon_beg=int(IV_lon_unq[(JS_lon_gap+1)%len(IV_lon_unq)])
+JS_slb_lon_end=int(IV_lon_unq[JS_lon_gap])+1
+#The longitude bounds are the complement of the largest gap between domain
+#longitudes, the hyperslab wraps around the grid if JS_slb_lon_beg is larger 
+#than or equal to JS_slb_lon_end
+
+IS_slb_lat=JS_slb_lat_end-JS_slb_lat_beg
+IS_slb_lon=(JS_slb_lon_end-JS_slb_lon_beg-1)%IS_grc_lon+1
+print(' - The hyperslab size is (lat x lon): '+str(IS_slb_lat)+' x '           \
+                                              +str(IS_slb_lon))
+
+IV_slb_lat=IV_dom_lat-JS_slb_lat_beg
+IV_slb_lon=(IV_dom_lon-JS_slb_lon_beg)%IS_grc_lon
+#Location of each domain grid cell within the hyperslab
+
+IV_get_lat=IV_slb_lat[IV_wrk_dom]
+IV_get_lon=IV_slb_lon[IV_wrk_dom]
+#Location of the grid cell used for computations within the hyperslab
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#Read the hyperslab and gather the domain grid cells
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def shb_slb_get(ZV_var,JS_time_beg,JS_time_end,IV_wrk=None):
+     if IV_wrk is None:
+          IV_wrk_lat=IV_get_lat
+          IV_wrk_lon=IV_get_lon
+     else:
+          IV_wrk_lat=IV_get_lat[IV_wrk]
+          IV_wrk_lon=IV_get_lon[IV_wrk]
+     if isinstance(ZV_var,shbaam_mmap.shb_mmp_var):
+          ZM_slb=ZV_var.shb_msk(ZV_var.ZV_dat[JS_time_beg:JS_time_end,         \
+                                  JS_slb_lat_beg+IV_wrk_lat,                   \
+                                  (JS_slb_lon_beg+IV_wrk_lon)%IS_grc_lon])
+          return numpy.ma.filled(ZM_slb.astype(numpy.float64),numpy.nan)
+          #Memory-mapped variables are views, only the values of the grid 
+          #cells used are gathered from the data on disk
+     JS_get_lat_beg=int(IV_wrk_lat.min())
+     JS_get_lat_end=int(IV_wrk_lat.max())+1
+     JS_get_lon_beg=int(IV_wrk_lon.min())
+     JS_get_lon_end=int(IV_wrk_lon.max())+1
+     JS_red_lon_beg=(JS_slb_lon_beg+JS_get_lon_beg)%IS_grc_lon
+     JS_red_lon_end=JS_red_lon_beg+JS_get_lon_end-JS_get_lon_beg
+     if JS_red_lon_end<=IS_grc_lon:
+          ZM_slb=ZV_var[JS_time_beg:JS_time_end,                               \
+                        JS_slb_lat_beg+JS_get_lat_beg:                         \
+                        JS_slb_lat_beg+JS_get_lat_end,                         \
+                        JS_red_lon_beg:JS_red_lon_end]
+     else:
+          ZM_slb=numpy.ma.concatenate(                                         \
+                 (ZV_var[JS_time_beg:JS_time_end,                              \
+                         JS_slb_lat_beg+JS_get_lat_beg:                        \
+                         JS_slb_lat_beg+JS_get_lat_end,                        \
+                         JS_red_lon_beg:],                                     \
+                  ZV_var[JS_time_beg:JS_time_end,                              \
+                         JS_slb_lat_beg+JS_get_lat_beg:                        \
+                         JS_slb_lat_beg+JS_get_lat_end,                        \
+                         :JS_red_lon_end-IS_grc_lon]),axis=2)
+     ZM_slb=numpy.ma.filled(ZM_slb.astype(numpy.float64),numpy.nan)
+     return ZM_slb[:,IV_wrk_lat-JS_get_lat_beg,IV_wrk_lon-JS_get_lon_beg]
+#Returns a (time x domain grid cell, or mascon) array read from at most two 
+#hyperslabs in bulk, the hyperslabs are limited to the rows and columns of the
+#grid cells used for computations (e.g. the representative grid cells of the 
+#mascons, or a subset IV_wrk of them) that are then gathered in memory
+
+
+#*******************************************************************************
+#Determine the output grid
+#*******************************************************************************
+print('Determine the output grid')
+
+if IS_crp_hal is None:
+     JS_crp_lat_beg=0
+     IS_crp_lat=IS_grc_lat
+     JS_crp_lon_beg=0
+     IS_crp_lon=IS_grc_lon
+else:
+     JS_crp_lat_beg=max(JS_slb_lat_beg-IS_crp_hal,0)
+     IS_crp_lat=min(JS_slb_lat_end+IS_crp_hal,IS_grc_lat)-JS_crp_lat_beg
+     if BS_grc_glb and IS_slb_lon+2*IS_crp_hal < IS_grc_lon:
+          JS_crp_lon_beg=(JS_slb_lon_beg-IS_crp_hal)%IS_grc_lon
+          IS_crp_lon=IS_slb_lon+2*IS_crp_hal
+     elif not BS_grc_glb and JS_slb_lon_beg<JS_slb_lon_end:
+          JS_crp_lon_beg=max(JS_slb_lon_beg-IS_crp_hal,0)
+          IS_crp_lon=min(JS_slb_lon_end+IS_crp_hal,IS_grc_lon)-JS_crp_lon_beg
+     else:
+          JS_crp_lon_beg=0
+          IS_crp_lon=IS_grc_lon
+     #The cropped grid may wrap around a global grid, in which case the 
+     #longitudes before the wrap are shifted by -360 to remain increasing
+
+IV_crp_lon=numpy.arange(JS_crp_lon_beg,JS_crp_lon_beg+IS_crp_lon)
+ZV_crp_lon=numpy.array(ZV_grc_lon[:])[IV_crp_lon%IS_grc_lon]
+if IV_crp_lon[-1]>=IS_grc_lon:
+     ZV_crp_lon[IV_crp_lon<IS_grc_lon]=ZV_crp_lon[IV_crp_lon<IS_grc_lon]-360
+ZV_crp_lat=numpy.array(ZV_grc_lat[:])[JS_crp_lat_beg:JS_crp_lat_beg+IS_crp_lat]
+
+print(' - The output grid size is (lat x lon): '+str(IS_crp_lat)+' x '         \
+                                               +str(IS_crp_lon))
+
+JS_put_lat_beg=JS_slb_lat_beg-JS_crp_lat_beg
+JS_put_lon_beg=(JS_slb_lon_beg-JS_crp_lon_beg)%IS_grc_lon
+#Location of the hyperslab within the output grid
+
+IV_put_lat=IV_dom_lat-JS_crp_lat_beg
+IV_put_lon=(IV_dom_lon-JS_crp_lon_beg)%IS_grc_lon
+#Location of each domain grid cell within the output grid
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#Write the domain grid cells in the output grid
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def shb_slb_put(ZV_var,JS_time_beg,ZM_dom):
+     IS_time=ZM_dom.shape[0]
+     JS_time_end=JS_time_beg+IS_time
+     ZM_slb=numpy.ma.masked_all((IS_time,IS_slb_lat,IS_slb_lon),               \
+                                dtype=numpy.float32)
+     ZM_slb[:,IV_slb_lat,IV_slb_lon]=numpy.ma.masked_invalid(ZM_dom)
+     JS_put_lat_end=JS_put_lat_beg+IS_slb_lat
+     if JS_put_lon_beg+IS_slb_lon<=IS_crp_lon:
+          ZV_var[JS_time_beg:JS_time_end,                                      \
+                 JS_put_lat_beg:JS_put_lat_end,                                \
+                 JS_put_lon_beg:JS_put_lon_beg+IS_slb_lon]=ZM_slb
+     else:
+          IS_slb_lon_beg=IS_crp_lon-JS_put_lon_beg
+          ZV_var[JS_time_beg:JS_time_end,                                      \
+                 JS_put_lat_beg:JS_put_lat_end,                                \
+                 JS_put_lon_beg:]=ZM_slb[:,:,:IS_slb_lon_beg]
+          ZV_var[JS_time_beg:JS_time_end,                                      \
+                 JS_put_lat_beg:JS_put_lat_end,                                \
+                 :IS_slb_lon-IS_slb_lon_beg]=ZM_slb[:,:,IS_slb_lon_beg:]
+#Writes a (time x domain grid cell) array in at most two hyperslabs, the other
+#grid cells of the hyperslabs are filled
+
+
+#*******************************************************************************
+#Read existing shb_wsa_ncf for appending
+#*******************************************************************************
+JS_app_beg=JS_win_beg
+
+if BS_wsa_app:
+     print('Read existing shb_wsa_ncf for appending')
+
+     YV_fil=[shb_wsa_csv,shb_wsa_ncf]
+     if shb_tsr_ncf!='NONE':
+          YV_fil.append(shb_tsr_ncf)
+     for YS_fil in YV_fil:
+          if not os.path.isfile(YS_fil):
+               print('ERROR - Unable to open '+YS_fil)
+               raise SystemExit(22) 
+
+     h = netCDF4.Dataset(shb_wsa_ncf, 'a')
+
+     if 'lwe_thickness_baseline' not in h.variables:
+          print('ERROR - No long-term mean found in '+shb_wsa_ncf)
+          raise SystemExit(22) 
+
+     if h.getncattr('baseline_start')!=YV_bsl[0]                               \
+     or h.getncattr('baseline_end')!=YV_bsl[1]:
+          print('ERROR - The baseline period differs from that of '            \
+                +shb_wsa_ncf)
+          raise SystemExit(22) 
+
+     if len(h.dimensions['lat'])!=IS_crp_lat                                   \
+     or len(h.dimensions['lon'])!=IS_crp_lon                                   \
+     or not (h.variables['lat'][:]==ZV_crp_lat).all()                          \
+     or not (h.variables['lon'][:]==ZV_crp_lon).all():
+          print('ERROR - The grid differs from that of '+shb_wsa_ncf)
+          raise SystemExit(22) 
+
+     JS_app_beg=JS_win_beg+len(h.dimensions['time'])
+     ZV_app_time=numpy.array(ZV_grc_time[JS_win_beg:JS_app_beg])               \
+                                         .astype(h.variables['time'].dtype)
+     #Time values as previously written in shb_wsa_ncf
+     if JS_app_beg > JS_win_end                                                \
+     or not (h.variables['time'][:]==ZV_app_time).all():
+          print('ERROR - The time steps of '+shb_wsa_ncf+' are not the '       \
+                +'first ones of the time window of '+shb_grc_ncf)
+          raise SystemExit(22) 
+
+     ZM_crp_avg=h.variables['lwe_thickness_baseline'][:,:]
+     ZV_dom_avg=numpy.ma.filled(ZM_crp_avg.astype(numpy.float64),numpy.nan)    \
+                                                       [IV_put_lat,IV_put_lon]
+     if not BS_grc_prp:
+          ZM_dom_avg=ZV_dom_avg[numpy.newaxis,IV_wrk_dom]
+     else:
+          ZM_dom_avg=numpy.zeros((IS_sol_tot,IS_wrk_tot))
+     #Prepared anomalies already have their long-term mean removed
+
+     print(' - The number of time steps already processed is: '                \
+           +str(JS_app_beg-JS_win_beg))
+     print(' - The number of new time steps is: '                              \
+           +str(JS_win_end-JS_app_beg))
+
+     if JS_app_beg==JS_win_end:
+          print(' - No new time steps, the files are up to date')
+          h.close()
+          raise SystemExit(0) 
+
+
+#*******************************************************************************
+#Build sparse weight matrix between regions and grid cells
+#*******************************************************************************
+print('Build sparse weight matrix between regions and grid cells')
+
+ZV_lnk_wgt=numpy.zeros(IS_lnk_tot)
+BV_lnk=BV_reg_sqm[IV_lnk_reg]
+ZV_lnk_wgt[BV_lnk]=(ZV_dom_scl*ZV_dom_sqm)[IV_lnk_dom[BV_lnk]]                 \
+                  /ZV_reg_sqm[IV_lnk_reg[BV_lnk]]
+#The weights include the scale factor (0 for NoData), the cell area and the
+#normalization by the valid area of the region
+
+ZM_wgt=scipy.sparse.csr_matrix((ZV_lnk_wgt,(IV_lnk_reg,IV_lnk_dom)),           \
+                               shape=(IS_reg_tot,IS_dom_tot))
+#Duplicate links are summed
+
+print(' - The number of non-zero weights is: '+str(ZM_wgt.count_nonzero()))
+
+if shb_msc_ncf=='NONE':
+     ZM_wgt_wrk=ZM_wgt
+else:
+     ZM_dom_msc=scipy.sparse.csr_matrix((numpy.ones(IS_dom_tot),               \
+                                        (numpy.arange(IS_dom_tot),IV_dom_wrk)),\
+                                        shape=(IS_dom_tot,IS_wrk_tot))
+     ZM_wgt_wrk=ZM_wgt.dot(ZM_dom_msc).tocsr()
+     #Weights of all the grid cells of a mascon are summed
+     print(' - The number of non-zero weights for mascons is: '                \
+           +str(ZM_wgt_wrk.count_nonzero()))
+
+
+#*******************************************************************************
+#Determine the grid cells of each region for statistics
+#*******************************************************************************
+if IS_sta_tot > 0:
+     print('Determine the grid cells of each region for statistics')
+
+     shb_sta_reg=[]
+     for JS_reg in range(IS_reg_tot):
+          if JS_reg < IS_lea_tot:
+               BV_reg_lnk=(IV_lnk_reg==JS_reg)
           else:
-               ZS_dom_scl=ZM_grc_scl[JS_grc_lat,JS_grc_lon]
-          ZS_dom_wsa=( f.variables['lwe_thickness']                            \
-                                  [JS_grc_time,JS_grc_lat,JS_grc_lon]          \
-                      -ZS_dom_avg                                    )/100     \
-                    *  ZS_dom_scl                                              \
-                    *  ZS_dom_sqm
-                    #The division by 100 is to go from cm to m in GRACE data.
-          ZS_wsa=ZS_wsa+ZS_dom_wsa
-     ZV_wsa.append(100*ZS_wsa/ZS_sqm)
+               BV_reg_lnk=numpy.isin(IV_lnk_reg,                               \
+                                     ZM_hie[JS_reg-IS_lea_tot,:].indices)
+          IV_reg_dom,IV_reg_lnk=numpy.unique(IV_lnk_dom[BV_reg_lnk],           \
+                                             return_counts=True)
+          ZV_reg_dom_sqm=ZV_dom_sqm[IV_reg_dom]*(~ZV_dom_msk[IV_reg_dom])      \
+                        *IV_reg_lnk
+          shb_sta_reg.append((IV_reg_dom,ZV_reg_dom_sqm))
+     #Unique grid cells of each region and their area (0 for NoData in scale
+     #factors), multiplied by their number of links as in the weights. The 
+     #grid cells of a parent region are those of the regions it contains, 
+     #their anomalies are already in memory
+
+     print(' - The statistics are: '+', '.join(YV_sta_nam))
 
 
 #*******************************************************************************
-#Determine time strings
+#Determine time chunks
 #*******************************************************************************
-print('Determine time strings')
-shb_dat_str=datetime.datetime.strptime('2002-01-01T00:00:00',                \
-                                         '%Y-%m-%dT%H:%M:%S')
+print('Determine time chunks')
 
-YV_grc_time=[]
-for JS_grc_time in range(IS_grc_time):
-     shb_dat_dlt=datetime.timedelta(days=float(ZV_grc_time[JS_grc_time]))
-     YS_grc_time=(shb_dat_str+shb_dat_dlt).strftime('%m/%d/%Y')
-     YV_grc_time.append(YS_grc_time)
+if ZS_mem_mb is None:
+     IS_time_chk=IS_grc_time
+else:
+     ZS_stp_byt=18*IS_slb_lat*IS_slb_lon+(16+8*IS_sol_tot)*IS_wrk_tot          \
+               +8*IS_dom_tot
+     #Approximate number of bytes used per time step: the hyperslab as read 
+     #(masked float32), filled (float64) and written (masked float32), the
+     #domain grid cells (or mascons) of each solution, after removing the 
+     #long-term mean and for the ensemble mean, and the domain grid cells 
+     #written (float64)
+     IS_time_chk=max(int(ZS_mem_mb*1048576//ZS_stp_byt),1)
+     IS_time_chk=min(IS_time_chk,IS_grc_time)
+
+if IS_prc > 1:
+     IS_time_chk=min(IS_time_chk,                                              \
+                     max(-(-(JS_win_end-JS_app_beg)//IS_prc),1))
+#With workers, the anomalies of the time window span at least as many chunks
+#as workers, which also bounds the scratch memory of each worker to one chunk
+
+BS_dom_lwe=(not BS_wsa_app) and (not BS_grc_prp)                               \
+           and (max(JS_bsl_beg,JS_app_beg) <= min(JS_bsl_end,JS_win_end))      \
+           and (max(JS_bsl_end,JS_win_end)-min(JS_bsl_beg,JS_app_beg)          \
+                <= IS_time_chk)
+#Whether the baseline period and the time window overlap and fit in one 
+#unique chunk that is then read once for both passes
+
+if BS_wsa_app or (BS_grc_prp and not BS_prp_avg):
+     IV_avg_chk=[]
+elif BS_dom_lwe:
+     IV_avg_chk=[(min(JS_bsl_beg,JS_app_beg),max(JS_bsl_end,JS_win_end))]
+else:
+     IV_avg_chk=[(JS_chk_beg,min(JS_chk_beg+IS_time_chk,JS_bsl_end))           \
+                 for JS_chk_beg in range(JS_bsl_beg,JS_bsl_end,IS_time_chk)]
+#Time chunks of the first pass (long-term mean)
+
+IV_wsa_chk=[(JS_chk_beg,min(JS_chk_beg+IS_time_chk,JS_win_end))                \
+            for JS_chk_beg in range(JS_app_beg,JS_win_end,IS_time_chk)]
+#Time chunks of the second pass (anomalies), only for the time steps of the 
+#time window that are new in append mode
+
+print(' - The number of time steps per chunk is: '+str(IS_time_chk))
+print(' - The number of chunks for the long-term mean is: '                    \
+      +str(len(IV_avg_chk)))
+print(' - The number of chunks for the anomalies is: '+str(len(IV_wsa_chk)))
 
 
 #*******************************************************************************
-#Write shb_wsa_csv
+#Define the computations over time chunks
 #*******************************************************************************
-print('Write shb_wsa_csv')
+shb_dom_lwe=[None]*IS_sol_tot
+#The data of each solution are kept for the second pass with one unique chunk
+#shared by both passes
 
-with open(shb_wsa_csv, 'w') as csvfile:
-     #csvwriter = csv.writer(csvfile, dialect='excel', quotechar="'",           \
-     #                       quoting=csv.QUOTE_NONNUMERIC)
-     csvwriter = csv.writer(csvfile, dialect='excel')
-     csvwriter.writerow(['date','TWSa'])
-     for JS_grc_time in range(IS_grc_time):
-          IV_line=[YV_grc_time[JS_grc_time],ZV_wsa[JS_grc_time]] 
-          csvwriter.writerow(IV_line) 
+def shb_chk_avg(shb_lst,IV_wrk=None):
+     if IV_wrk is None:
+          ZM_wrk_avg=numpy.zeros((IS_sol_tot,IS_wrk_tot))
+     else:
+          ZM_wrk_avg=numpy.zeros((IS_sol_tot,len(IV_wrk)))
+     for JS_chk_beg,JS_chk_end in IV_avg_chk:
+          for JS_sol in range(IS_sol_tot):
+               ZM_dom_lwe=shb_slb_get(                                         \
+                          shb_lst[JS_sol].variables['lwe_thickness'],          \
+                          JS_chk_beg,JS_chk_end,IV_wrk)
+               for JS_grc_time in range(JS_chk_beg,JS_chk_end):
+                    if BV_bsl_time[JS_grc_time]:
+                         ZM_wrk_avg[JS_sol,:]+=                                \
+                                        ZM_dom_lwe[JS_grc_time-JS_chk_beg,:]
+               if IV_wrk is None and BS_dom_lwe:
+                    shb_dom_lwe[JS_sol]=ZM_dom_lwe
+     return ZM_wrk_avg/IS_bsl_time
+#The time steps are accumulated one by one, in the same order as a sum over 
+#the time axis, so that results do not depend on the size of chunks nor on 
+#the subset of grid cells IV_wrk
+
+def shb_prc_avg(JS_bnd):
+     ZM_dom_avg[:,IV_bnd_wrk[JS_bnd]]=shb_chk_avg(shb_prc_lst,                 \
+                                                  IV_bnd_wrk[JS_bnd])
+#Worker process for a band of latitudes
+
+def shb_chk_wsa(shb_lst,JS_chk_beg,JS_chk_end):
+     ZM_dom_wsa=numpy.zeros((JS_chk_end-JS_chk_beg,IS_wrk_tot))
+     for JS_sol in range(IS_sol_tot):
+          if shb_dom_lwe[JS_sol] is None:
+               ZM_dom_lwe=shb_slb_get(                                         \
+                          shb_lst[JS_sol].variables['lwe_thickness'],          \
+                          JS_chk_beg,JS_chk_end)
+          else:
+               JS_lwe_beg=IV_avg_chk[0][0]
+               ZM_dom_lwe=shb_dom_lwe[JS_sol][JS_chk_beg-JS_lwe_beg:           \
+                                              JS_chk_end-JS_lwe_beg,:]
+          #With one unique chunk, the data from the first pass are reused
+          ZM_sol_dom_wsa=ZM_dom_lwe-ZM_dom_avg[JS_sol,:]
+          ZM_sol_wsa[JS_sol,JS_chk_beg-JS_app_beg:JS_chk_end-JS_app_beg,:]=    \
+                                         ZM_wgt_wrk.dot(ZM_sol_dom_wsa.T).T
+          #The conversions from cm to m and back to cm of the original 
+          #formula cancel out
+          ZM_dom_wsa=ZM_dom_wsa+ZM_sol_dom_wsa
+     return ZM_dom_wsa/IS_sol_tot
+#Returns the ensemble mean anomalies of a time chunk and stores the 
+#timeseries of all solutions
+
+def shb_sta_get(ZM_dom_wsa):
+     IS_time=ZM_dom_wsa.shape[0]
+     ZM_sta=numpy.full((IS_sta_tot,IS_time,IS_reg_tot),numpy.nan)
+     for JS_reg in range(IS_reg_tot):
+          IV_reg_dom,ZV_reg_dom_sqm=shb_sta_reg[JS_reg]
+          ZM_val=numpy.ascontiguousarray(ZM_dom_wsa[:,IV_reg_dom])             \
+                *ZV_dom_scl[IV_reg_dom]
+          #Rows are contiguous so that sums along rows do not depend on the
+          #number of time steps of the chunk
+          BM_vld=(~numpy.isnan(ZM_val)) & (ZV_reg_dom_sqm > 0)
+          ZM_sqm=numpy.where(BM_vld,ZV_reg_dom_sqm,0)
+          ZM_val=numpy.where(BM_vld,ZM_val,numpy.inf)
+          IV_vld=numpy.sum(BM_vld,axis=1)
+          BV_vld=(IV_vld > 0)
+          ZV_sqm=numpy.sum(ZM_sqm,axis=1)
+          ZV_sqm[~BV_vld]=1
+          ZV_avg=numpy.sum(ZM_sqm*numpy.where(BM_vld,ZM_val,0),axis=1)/ZV_sqm
+
+          IM_srt=numpy.argsort(ZM_val,axis=1,kind='stable')
+          ZM_val=numpy.take_along_axis(ZM_val,IM_srt,axis=1)
+          ZM_sqm=numpy.take_along_axis(ZM_sqm,IM_srt,axis=1)
+          ZM_pos=(numpy.cumsum(ZM_sqm,axis=1)-ZM_sqm/2)/ZV_sqm[:,numpy.newaxis]
+          ZM_pos[ZM_sqm==0]=numpy.inf
+          ZM_val=numpy.hstack((ZM_val,numpy.full((IS_time,1),numpy.inf)))
+          ZM_pos=numpy.hstack((ZM_pos,numpy.full((IS_time,1),numpy.inf)))
+          #Valid values sorted first, each at the middle of its cumulated area
+          #fraction, a column is added so that there are always two columns
+
+          JS_pct=0
+          for JS_sta in range(IS_sta_tot):
+               YS_sta=YV_sta_nam[JS_sta]
+               if YS_sta=='std':
+                    ZV_sta=numpy.sqrt(numpy.sum(ZM_sqm*                        \
+                           (numpy.where(numpy.isinf(ZM_val[:,:-1]),0,          \
+                           ZM_val[:,:-1])-ZV_avg[:,numpy.newaxis])**2,axis=1)  \
+                                     /ZV_sqm)
+               elif YS_sta=='min':
+                    ZV_sta=ZM_val[:,0]
+               elif YS_sta=='max':
+                    ZV_sta=ZM_val[numpy.arange(IS_time),                       \
+                                  numpy.maximum(IV_vld-1,0)]
+               elif YS_sta=='valid_count':
+                    ZV_sta=IV_vld
+               elif YS_sta=='nodata_count':
+                    ZV_sta=len(IV_reg_dom)-IV_vld
+               else:
+                    ZS_pct=ZV_sta_pct[JS_pct]/100
+                    JS_pct=JS_pct+1
+                    IV_hig=numpy.clip(numpy.sum(ZM_pos < ZS_pct,axis=1),1,     \
+                                      numpy.maximum(IV_vld-1,1))
+                    IV_low=IV_hig-1
+                    ZV_pos_low=numpy.take_along_axis(ZM_pos,                   \
+                                          IV_low[:,numpy.newaxis],axis=1)[:,0]
+                    ZV_pos_hig=numpy.take_along_axis(ZM_pos,                   \
+                                          IV_hig[:,numpy.newaxis],axis=1)[:,0]
+                    ZV_val_low=numpy.take_along_axis(ZM_val,                   \
+                                          IV_low[:,numpy.newaxis],axis=1)[:,0]
+                    ZV_val_hig=numpy.take_along_axis(ZM_val,                   \
+                                          IV_hig[:,numpy.newaxis],axis=1)[:,0]
+                    BV_one=(IV_vld==1)
+                    ZV_pos_hig[BV_one]=ZV_pos_low[BV_one]
+                    ZV_val_hig[BV_one]=ZV_val_low[BV_one]
+                    with numpy.errstate(invalid='ignore',divide='ignore'):
+                         ZV_frc=numpy.clip((ZS_pct-ZV_pos_low)                 \
+                                           /(ZV_pos_hig-ZV_pos_low),0,1)
+                         ZV_frc[BV_one]=0
+                         ZV_sta=ZV_val_low+ZV_frc*(ZV_val_hig-ZV_val_low)
+                    #Linear interpolation between the two values whose area 
+                    #fractions surround the percentile, clipped to the 
+                    #smallest and largest values
+               if YS_sta in ['valid_count','nodata_count']:
+                    ZM_sta[JS_sta,:,JS_reg]=ZV_sta
+               else:
+                    ZM_sta[JS_sta,:,JS_reg]=numpy.where(BV_vld,ZV_sta,numpy.nan)
+     return ZM_sta
+#Returns the statistics (statistic x time x region) of a (time x domain grid
+#cell) array of anomalies, all time steps of a region are processed at once
+
+def shb_prc_wsa(IV_slt):
+     JS_slt,JS_chk_beg,JS_chk_end=IV_slt
+     ZM_slt_wsa[JS_slt,:JS_chk_end-JS_chk_beg,:]=                              \
+                               shb_chk_wsa(shb_prc_lst,JS_chk_beg,JS_chk_end)
+#Worker process for a time chunk
 
 
 #*******************************************************************************
-#Write shb_wsa_ncf
+#Start a pool of worker processes
 #*******************************************************************************
-print('Write shb_wsa_ncf')
+if IS_prc > 1:
+     print('Start a pool of worker processes')
+
+     def shb_shm_arr(ZV_arr):
+          shb_shm=multiprocessing.sharedctypes.RawArray('b',                   \
+                                                        max(ZV_arr.nbytes,1))
+          ZV_shm=numpy.frombuffer(shb_shm,dtype=ZV_arr.dtype,                  \
+                                  count=ZV_arr.size).reshape(ZV_arr.shape)
+          ZV_shm[...]=ZV_arr
+          return ZV_shm
+     #Copies an array into a new block of shared memory, which forked workers
+     #inherit and which is released once no array uses it
+
+     IV_get_lat=shb_shm_arr(IV_get_lat)
+     IV_get_lon=shb_shm_arr(IV_get_lon)
+     ZM_wgt_wrk=scipy.sparse.csr_matrix((shb_shm_arr(ZM_wgt_wrk.data),         \
+                                         shb_shm_arr(ZM_wgt_wrk.indices),      \
+                                         shb_shm_arr(ZM_wgt_wrk.indptr)),      \
+                                        shape=ZM_wgt_wrk.shape,copy=False)
+     if BS_wsa_app:
+          ZM_dom_avg=shb_shm_arr(ZM_dom_avg)
+     else:
+          ZM_dom_avg=shb_shm_arr(numpy.zeros((IS_sol_tot,IS_wrk_tot)))
+     ZM_sol_wsa=shb_shm_arr(numpy.zeros((IS_sol_tot,JS_win_end-JS_app_beg,     \
+                                         IS_reg_tot)))
+     ZM_slt_wsa=shb_shm_arr(numpy.zeros((IS_prc,IS_time_chk,IS_wrk_tot)))
+     #Inputs and results shared with all workers, ZM_slt_wsa holds the 
+     #ensemble mean anomalies of the time chunks being processed in parallel
 
-#-------------------------------------------------------------------------------
-#Create netCDF file
-#-------------------------------------------------------------------------------
-print('- Create netCDF file')
+     IV_bnd_wrk=[IV_wrk for IV_wrk in                                          \
+                 numpy.array_split(numpy.argsort(IV_get_lat,kind='stable'),    \
+                                   IS_prc) if len(IV_wrk) > 0]
+     #Bands of latitudes with similar numbers of grid cells
 
-h = netCDF4.Dataset(shb_wsa_ncf, 'w', format="NETCDF3_CLASSIC")
+     def shb_prc_ini():
+          global shb_prc_lst
+          shb_prc_lst=[shbaam_mmap.shb_ncf_opn(YS_grc_ncf,BS_grc_mmp)          \
+                       for YS_grc_ncf in YV_grc_ncf]
+     #Each worker opens its own netCDF handles
 
-time = h.createDimension("time", None)
-lat = h.createDimension("lat", IS_grc_lat)
-lon = h.createDimension("lon", IS_grc_lon)
-nv = h.createDimension("nv", 2)
+     shb_prc_pol=multiprocessing.get_context('fork').Pool(IS_prc,              \
+                                                    initializer=shb_prc_ini)
+     #Workers are forked so that this script is not executed again in each 
+     #of them, all shared memory blocks must hence be created before
 
-time = h.createVariable("time","i4",("time",))
-time_bnds = h.createVariable("time_bnds","i4",("time","nv",))
-lat = h.createVariable("lat","f4",("lat",))
-lon = h.createVariable("lon","f4",("lon",))
-lwe_thickness = h.createVariable("lwe_thickness","f4",("time","lat","lon",),   \
-                                 fill_value=ZS_grc_fil)
-crs = h.createVariable("crs","i4")
+     print(' - The number of workers is: '+str(IS_prc))
 
-#-------------------------------------------------------------------------------
-#Metadata in netCDF global attributes
-#-------------------------------------------------------------------------------
-print('- Populate global attributes')
-
-dt=datetime.datetime.utcnow()
-dt=dt.replace(microsecond=0)
-#Current UTC time without the microseconds 
-vsn=subprocess.Popen('bash ../version.sh',                                     \
-                     stdout=subprocess.PIPE,shell=True).communicate()
-vsn=vsn[0]
-vsn=vsn.rstrip()
-vsn=str(vsn)
-#Version of SHBAAM
-
-h.Conventions='CF-1.6'
-h.title=''
-h.institution=''
-h.source='SHBAAM: '+vsn+', GRACE: '+os.path.basename(shb_grc_ncf)             \
-                      +', Scale factors: '+os.path.basename(shb_fct_ncf)
-h.history='date created: '+dt.isoformat()+'+00:00'
-h.references='https://github.com/c-h-david/shbaam/'
-h.comment=''
-h.featureType='timeSeries'
 
-#-------------------------------------------------------------------------------
-#Metadata in netCDF variable attributes
-#-------------------------------------------------------------------------------
-print('- Copy existing variable attributes')
-
-if 'time' in f.variables:
-     var=f.variables['time']
-     if 'standard_name' in  var.ncattrs(): time.standard_name=var.standard_name
-     if 'long_name' in var.ncattrs(): time.long_name=var.long_name
-     if 'units' in var.ncattrs(): time.units=var.units
-     if 'axis' in var.ncattrs(): time.axis=var.axis
-     if 'calendar' in var.ncattrs(): time.calendar=var.calendar
-     if 'bounds' in var.ncattrs(): time.bounds=var.bounds
-
-if 'lat' in f.variables:
-     var=f.variables['lat']
-     if 'standard_name' in  var.ncattrs(): lat.standard_name=var.standard_name
-     if 'long_name' in  var.ncattrs(): lat.long_name=var.long_name
-     if 'units' in  var.ncattrs(): lat.units=var.units
-     if 'axis' in  var.ncattrs(): lat.axis=var.axis
-
-if 'lon' in f.variables:
-     var=f.variables['lon']
-     if 'standard_name' in  var.ncattrs(): lon.standard_name=var.standard_name
-     if 'long_name' in  var.ncattrs(): lon.long_name=var.long_name
-     if 'units' in  var.ncattrs(): lon.units=var.units
-     if 'axis' in  var.ncattrs(): lon.axis=var.axis
-
-if 'lwe_thickness' in f.variables: 
-     var=f.variables['lwe_thickness']
-     if 'standard_name' in var.ncattrs(): lwe_thickness.standard_name=var.standard_name
-     if 'long_name' in var.ncattrs(): lwe_thickness.long_name=var.long_name
-     if 'units' in var.ncattrs(): lwe_thickness.units=var.units
-     if 'units' in var.ncattrs(): lwe_thickness.coordinates=var.coordinates
-     if 'grid_mapping' in var.ncattrs(): lwe_thickness.grid_mapping=var.grid_mapping
-     if 'cell_methods' in var.ncattrs(): lwe_thickness.cell_methods=var.cell_methods
-
-if 'crs' in f.variables: 
-     var=f.variables['crs']
-     if 'grid_mapping_name' in var.ncattrs(): crs.grid_mapping_name=var.grid_mapping_name
-     if 'semi_major_axis' in var.ncattrs(): crs.semi_major_axis=var.semi_major_axis
-     if 'inverse_flattening' in var.ncattrs(): crs.inverse_flattening=var.inverse_flattening
-
-print('- Modify CRS variable attributes')
-lwe_thickness.grid_mapping='crs'
-crs.grid_mapping_name='latitude_longitude'
-crs.semi_major_axis='6378137'
-crs.inverse_flattening='298.257223563' 
-#These are for the WGS84 spheroid
+#*******************************************************************************
+#Find long-term mean for each intersecting GRACE grid cell
+#*******************************************************************************
+print('Find long-term mean for each intersecting GRACE grid cell')
 
-#-------------------------------------------------------------------------------
-#Populate static data
-#-------------------------------------------------------------------------------
-print('- Populate static data')
+if BS_wsa_app:
+     print(' - The long-term mean stored in shb_wsa_ncf is used')
+elif BS_grc_prp:
+     print(' - The long-term mean stored in shb_grc_ncf is used')
+     if IS_prc==1:
+          ZM_dom_avg=numpy.zeros((IS_sol_tot,IS_wrk_tot))
+     ZM_prp_avg=numpy.array([numpy.ma.filled(                                  \
+                shb_sol.variables['lwe_thickness_baseline'][:,:]               \
+                .astype(numpy.float64),numpy.nan)[IV_dom_lat,IV_dom_lon]       \
+                             for shb_sol in shb_grc_lst])
+     if BS_prp_avg:
+          if IS_prc==1:
+               ZM_dom_avg=shb_chk_avg(shb_grc_lst)
+          else:
+               shb_prc_pol.map(shb_prc_avg,range(len(IV_bnd_wrk)))
+     ZV_dom_avg=numpy.mean(ZM_prp_avg[:,IV_wrk_dom]+ZM_dom_avg,axis=0)         \
+                                                                  [IV_dom_wrk]
+     #Prepared anomalies already have their long-term mean removed, only the 
+     #mean of prepared anomalies over the time window is removed if needed
+else:
+     if IS_prc==1:
+          ZM_dom_avg=shb_chk_avg(shb_grc_lst)
+     else:
+          shb_prc_pol.map(shb_prc_avg,range(len(IV_bnd_wrk)))
+     ZV_dom_avg=numpy.mean(ZM_dom_avg,axis=0)[IV_dom_wrk]
+     #Long-term mean of the ensemble mean for each domain grid cell
+
+
+#*******************************************************************************
+#Write shb_wsa_ncf
+#*******************************************************************************
+print('Write shb_wsa_ncf')
 
-lon[:]=ZV_grc_lon[:]
-lat[:]=ZV_grc_lat[:]
-#Coordinates
+if not BS_wsa_app:
+     #--------------------------------------------------------------------------
+     #Create netCDF file
+     #--------------------------------------------------------------------------
+     print('- Create netCDF file')
+
+     h = netCDF4.Dataset(shb_wsa_ncf, 'w', format=shb_wsa_fmt)
+
+     time = h.createDimension("time", None)
+     lat = h.createDimension("lat", IS_crp_lat)
+     lon = h.createDimension("lon", IS_crp_lon)
+     nv = h.createDimension("nv", 2)
+
+     time = h.createVariable("time","i4",("time",))
+     time_bnds = h.createVariable("time_bnds","i4",("time","nv",))
+     lat = h.createVariable("lat","f4",("lat",))
+     lon = h.createVariable("lon","f4",("lon",))
+     if shb_wsa_fmt.startswith('NETCDF4'):
+          lwe_thickness = h.createVariable("lwe_thickness","f4",               \
+                                           ("time","lat","lon",),              \
+                                           fill_value=ZS_grc_fil,              \
+                                           zlib=(IS_wsa_zlb > 0),              \
+                                           complevel=max(IS_wsa_zlb,1),        \
+                                           shuffle=BS_wsa_shf,                 \
+                                           chunksizes=IV_wsa_chk)
+     else:
+          lwe_thickness = h.createVariable("lwe_thickness","f4",               \
+                                           ("time","lat","lon",),              \
+                                           fill_value=ZS_grc_fil)
+     crs = h.createVariable("crs","i4")
+     if YV_bsl is not None:
+          lwe_thickness_baseline = h.createVariable("lwe_thickness_baseline",  \
+                                                    "f8",("lat","lon",),       \
+                                                    fill_value=ZS_grc_fil)
+
+     #--------------------------------------------------------------------------
+     #Metadata in netCDF global attributes
+     #--------------------------------------------------------------------------
+     print('- Populate global attributes')
+
+     dt=datetime.datetime.utcnow()
+     dt=dt.replace(microsecond=0)
+     #Current UTC time without the microseconds 
+     vsn=subprocess.Popen('bash ../version.sh',                                \
+                          stdout=subprocess.PIPE,shell=True).communicate()
+     vsn=vsn[0]
+     vsn=vsn.rstrip()
+     vsn=str(vsn)
+     #Version of SHBAAM
+
+     h.Conventions='CF-1.6'
+     h.title=''
+     h.institution=''
+     h.source='SHBAAM: '+vsn+', GRACE: '                                       \
+                           +' '.join([os.path.basename(YS_grc_ncf)             \
+                                      for YS_grc_ncf in YV_grc_ncf])           \
+                           +', Scale factors: '+os.path.basename(shb_fct_ncf)
+     h.history='date created: '+dt.isoformat()+'+00:00'
+     h.references='https://github.com/c-h-david/shbaam/'
+     h.comment=''
+     h.featureType='timeSeries'
+     if IS_sol_tot > 1:
+          h.comment='Ensemble mean of GRACE solutions: '+', '.join(YV_sol_nam)
+     if IS_crp_hal is not None:
+          h.crop_lat_index_offset=numpy.int32(JS_crp_lat_beg)
+          h.crop_lon_index_offset=numpy.int32(JS_crp_lon_beg)
+          h.crop_halo=numpy.int32(IS_crp_hal)
+     if YV_bsl is not None:
+          h.baseline_start=YV_bsl[0]
+          h.baseline_end=YV_bsl[1]
+
+     #--------------------------------------------------------------------------
+     #Metadata in netCDF variable attributes
+     #--------------------------------------------------------------------------
+     print('- Copy existing variable attributes')
+
+     if 'time' in f.variables:
+          var=f.variables['time']
+          if 'standard_name' in  var.ncattrs(): time.standard_name=var.standard_name
+          if 'long_name' in var.ncattrs(): time.long_name=var.long_name
+          if 'units' in var.ncattrs(): time.units=var.units
+          if 'axis' in var.ncattrs(): time.axis=var.axis
+          if 'calendar' in var.ncattrs(): time.calendar=var.calendar
+          if 'bounds' in var.ncattrs(): time.bounds=var.bounds
+
+     if 'lat' in f.variables:
+          var=f.variables['lat']
+          if 'standard_name' in  var.ncattrs(): lat.standard_name=var.standard_name
+          if 'long_name' in  var.ncattrs(): lat.long_name=var.long_name
+          if 'units' in  var.ncattrs(): lat.units=var.units
+          if 'axis' in  var.ncattrs(): lat.axis=var.axis
+
+     if 'lon' in f.variables:
+          var=f.variables['lon']
+          if 'standard_name' in  var.ncattrs(): lon.standard_name=var.standard_name
+          if 'long_name' in  var.ncattrs(): lon.long_name=var.long_name
+          if 'units' in  var.ncattrs(): lon.units=var.units
+          if 'axis' in  var.ncattrs(): lon.axis=var.axis
+
+     if 'lwe_thickness' in f.variables: 
+          var=f.variables['lwe_thickness']
+          if 'standard_name' in var.ncattrs(): lwe_thickness.standard_name=var.standard_name
+          if 'long_name' in var.ncattrs(): lwe_thickness.long_name=var.long_name
+          if 'units' in var.ncattrs(): lwe_thickness.units=var.units
+          if 'units' in var.ncattrs(): lwe_thickness.coordinates=var.coordinates
+          if 'grid_mapping' in var.ncattrs(): lwe_thickness.grid_mapping=var.grid_mapping
+          if 'cell_methods' in var.ncattrs(): lwe_thickness.cell_methods=var.cell_methods
+
+     if 'crs' in f.variables: 
+          var=f.variables['crs']
+          if 'grid_mapping_name' in var.ncattrs(): crs.grid_mapping_name=var.grid_mapping_name
+          if 'semi_major_axis' in var.ncattrs(): crs.semi_major_axis=var.semi_major_axis
+          if 'inverse_flattening' in var.ncattrs(): crs.inverse_flattening=var.inverse_flattening
+
+     print('- Modify CRS variable attributes')
+     lwe_thickness.grid_mapping='crs'
+     crs.grid_mapping_name='latitude_longitude'
+     crs.semi_major_axis='6378137'
+     crs.inverse_flattening='298.257223563' 
+     #These are for the WGS84 spheroid
+
+     #--------------------------------------------------------------------------
+     #Populate static data
+     #--------------------------------------------------------------------------
+     print('- Populate static data')
+
+     lon[:]=ZV_crp_lon
+     lat[:]=ZV_crp_lat
+     #Coordinates
+
+     if YV_bsl is not None:
+          lwe_thickness_baseline.long_name='long-term mean of lwe_thickness '  \
+                                          +'over the baseline period'
+          if 'units' in lwe_thickness.ncattrs():
+               lwe_thickness_baseline.units=lwe_thickness.units
+          lwe_thickness_baseline.grid_mapping='crs'
+          ZM_crp_avg=numpy.ma.masked_all((IS_crp_lat,IS_crp_lon))
+          ZM_crp_avg[IV_put_lat,IV_put_lon]=numpy.ma.masked_invalid(ZV_dom_avg)
+          lwe_thickness_baseline[:,:]=ZM_crp_avg
+     #Long-term mean, stored in double precision to be reused when appending
+
+else:
+     #--------------------------------------------------------------------------
+     #Update metadata in netCDF global attributes
+     #--------------------------------------------------------------------------
+     print('- Update global attributes')
+
+     lwe_thickness=h.variables['lwe_thickness']
+     time=h.variables['time']
+
+     dt=datetime.datetime.utcnow()
+     dt=dt.replace(microsecond=0)
+     #Current UTC time without the microseconds 
+     h.history=h.history+', date appended: '+dt.isoformat()+'+00:00'
 
 #-------------------------------------------------------------------------------
 #Populate dynamic data
 #-------------------------------------------------------------------------------
 print('- Populate dynamic data')
 
-for JS_dom_tot in range(IS_dom_tot):
-     JS_grc_lon=IV_dom_lon[JS_dom_tot]
-     JS_grc_lat=IV_dom_lat[JS_dom_tot]
-     ZS_dom_avg=ZV_dom_avg[JS_dom_tot]
-     if (ZM_grc_scl.mask[JS_grc_lat,JS_grc_lon]):
-          ZS_dom_scl=0
+time[JS_app_beg-JS_win_beg:]=f.variables['time'][JS_app_beg:JS_win_end]
+
+
+#*******************************************************************************
+#Compute terrestrial water storage anomalies and their timeseries
+#*******************************************************************************
+print('Compute terrestrial water storage anomalies and their timeseries')
+
+if IS_prc==1:
+     ZM_sol_wsa=numpy.zeros((IS_sol_tot,JS_win_end-JS_app_beg,IS_reg_tot))
+#Timeseries of each solution (solution x time x region), only for the time 
+#steps of the time window that are new in append mode
+
+ZM_sta_wsa=numpy.zeros((IS_sta_tot,JS_win_end-JS_app_beg,IS_reg_tot))
+#Statistics of the ensemble mean (statistic x time x region)
+
+if IS_prc==1:
+     for JS_chk_beg,JS_chk_end in IV_wsa_chk:
+          ZM_dom_wsa=shb_chk_wsa(shb_grc_lst,JS_chk_beg,JS_chk_end)
+          shb_slb_put(lwe_thickness,JS_chk_beg-JS_win_beg,                     \
+                      ZM_dom_wsa[:,IV_dom_wrk])
+          if IS_sta_tot > 0:
+               ZM_sta_wsa[:,JS_chk_beg-JS_app_beg:JS_chk_end-JS_app_beg,:]=    \
+                                          shb_sta_get(ZM_dom_wsa[:,IV_dom_wrk])
+else:
+     for JS_rnd in range(0,len(IV_wsa_chk),IS_prc):
+          IV_rnd_wsa=IV_wsa_chk[JS_rnd:JS_rnd+IS_prc]
+          shb_prc_pol.map(shb_prc_wsa,[(JS_slt,)+IV_rnd_wsa[JS_slt]            \
+                                       for JS_slt in range(len(IV_rnd_wsa))])
+          for JS_slt in range(len(IV_rnd_wsa)):
+               JS_chk_beg,JS_chk_end=IV_rnd_wsa[JS_slt]
+               ZM_dom_wsa=ZM_slt_wsa[JS_slt,:JS_chk_end-JS_chk_beg,:]          \
+                                                                [:,IV_dom_wrk]
+               shb_slb_put(lwe_thickness,JS_chk_beg-JS_win_beg,ZM_dom_wsa)
+               if IS_sta_tot > 0:
+                    ZM_sta_wsa[:,JS_chk_beg-JS_app_beg:                        \
+                                 JS_chk_end-JS_app_beg,:]=                     \
+                                          shb_sta_get(ZM_dom_wsa)
+     #Each round processes as many time chunks as workers, the anomalies are
+     #then written by this process in the order of time
+
+if IS_par_tot > 0:
+     for JS_sol in range(IS_sol_tot):
+          ZM_lea_sum=ZM_sol_wsa[JS_sol,:,:IS_lea_tot]*ZV_reg_sqm[:IS_lea_tot]
+          with numpy.errstate(invalid='ignore',divide='ignore'):
+               ZM_sol_wsa[JS_sol,:,IS_lea_tot:]=ZM_hie.dot(ZM_lea_sum.T).T     \
+                                               /ZV_reg_sqm[IS_lea_tot:]
+#The timeseries of parent regions are aggregated from the area-weighted sums
+#of the regions they contain, which are the same as sums over their grid cells
+
+ZM_wsa=numpy.mean(ZM_sol_wsa,axis=0)
+ZM_wsa_spr=numpy.std(ZM_sol_wsa,axis=0)
+#Ensemble mean and spread, the mean of one unique solution is that solution
+
+ZM_sol_wsa[:,:,~BV_reg_sqm]=numpy.nan
+ZM_wsa[:,~BV_reg_sqm]=numpy.nan
+ZM_wsa_spr[:,~BV_reg_sqm]=numpy.nan
+
+
+#*******************************************************************************
+#Stop the pool of worker processes
+#*******************************************************************************
+if IS_prc > 1:
+     print('Stop the pool of worker processes')
+
+     shb_prc_pol.close()
+     shb_prc_pol.join()
+
+     ZM_sol_wsa=numpy.array(ZM_sol_wsa)
+     ZM_dom_avg=numpy.array(ZM_dom_avg)
+     ZM_wgt_wrk=ZM_wgt_wrk.copy()
+     IV_get_lat=numpy.array(IV_get_lat)
+     IV_get_lon=numpy.array(IV_get_lon)
+     ZM_slt_wsa=None
+     #Arrays that are still used are copied so that shared memory is released
+
+
+#*******************************************************************************
+#Write shb_wsa_csv
+#*******************************************************************************
+print('Write shb_wsa_csv')
+
+if not BS_wsa_app:
+     YS_csv_mod='w'
+else:
+     YS_csv_mod='a'
+
+with open(shb_wsa_csv, YS_csv_mod) as csvfile:
+     #csvwriter = csv.writer(csvfile, dialect='excel', quotechar="'",          \
+     #                       quoting=csv.QUOTE_NONNUMERIC)
+     csvwriter = csv.writer(csvfile, dialect='excel')
+     if not BS_wsa_app:
+          if IS_sol_tot==1 and IS_sta_tot==0:
+               csvwriter.writerow(['date']+YV_reg_nam)
+          else:
+               YV_csv_hdr=['date']
+               for YS_reg_nam in YV_reg_nam:
+                    if IS_sol_tot==1:
+                         YV_csv_hdr=YV_csv_hdr+[YS_reg_nam]
+                    else:
+                         YV_csv_hdr=YV_csv_hdr                                 \
+                                   +[YS_reg_nam+'_'+YS_sol_nam                 \
+                                     for YS_sol_nam in YV_sol_nam]             \
+                                   +[YS_reg_nam+'_mean',YS_reg_nam+'_spread']
+                    YV_csv_hdr=YV_csv_hdr                                      \
+                              +[YS_reg_nam+'_'+YS_sta for YS_sta in YV_sta_nam]
+               csvwriter.writerow(YV_csv_hdr)
+     for JS_grc_time in range(JS_app_beg,JS_win_end):
+          JS_wsa_time=JS_grc_time-JS_app_beg
+          if IS_sol_tot==1 and IS_sta_tot==0:
+               IV_line=[YV_grc_time[JS_grc_time]]                              \
+                      +ZM_wsa[JS_wsa_time,:].tolist()
+          else:
+               IV_line=[YV_grc_time[JS_grc_time]]
+               for JS_reg in range(IS_reg_tot):
+                    if IS_sol_tot==1:
+                         IV_line=IV_line+[ZM_wsa[JS_wsa_time,JS_reg]]
+                    else:
+                         IV_line=IV_line                                       \
+                                +ZM_sol_wsa[:,JS_wsa_time,JS_reg].tolist()     \
+                                +[ZM_wsa[JS_wsa_time,JS_reg],                  \
+                                  ZM_wsa_spr[JS_wsa_time,JS_reg]]
+                    for JS_sta in range(IS_sta_tot):
+                         if YV_sta_nam[JS_sta].endswith('_count'):
+                              IV_line.append(                                  \
+                                     int(ZM_sta_wsa[JS_sta,JS_wsa_time,JS_reg]))
+                         else:
+                              IV_line.append(                                  \
+                                         ZM_sta_wsa[JS_sta,JS_wsa_time,JS_reg])
+          csvwriter.writerow(IV_line) 
+
+
+#*******************************************************************************
+#Write shb_tsr_ncf
+#*******************************************************************************
+def shb_sta_put(k,YS_sta,JS_time_beg,ZM_sta):
+     if YS_sta.endswith('_count'):
+          YS_var=YS_sta
+     else:
+          YS_var='lwe_thickness_'+YS_sta
+     if YS_var not in k.variables:
+          print('ERROR - No variable '+YS_var+' in '+shb_tsr_ncf)
+          raise SystemExit(22) 
+     if YS_sta.endswith('_count'):
+          k.variables[YS_var][JS_time_beg:,:]=ZM_sta.astype(numpy.int32)
      else:
-          ZS_dom_scl=ZM_grc_scl[JS_grc_lat,JS_grc_lon]
-     for JS_grc_time in range(IS_grc_time):
-          lwe_thickness[JS_grc_time,JS_grc_lat,JS_grc_lon]=                    \
-            f.variables['lwe_thickness'][JS_grc_time,JS_grc_lat,JS_grc_lon]    \
-            -ZS_dom_avg
+          k.variables[YS_var][JS_time_beg:,:]=numpy.ma.masked_invalid(ZM_sta)
+#Writes the timeseries of one statistic from a given time step
+
+if shb_tsr_ncf!='NONE' and not BS_wsa_app:
+     print('Write shb_tsr_ncf')
+
+     #--------------------------------------------------------------------------
+     #Create netCDF file
+     #--------------------------------------------------------------------------
+     print('- Create netCDF file')
+
+     k = netCDF4.Dataset(shb_tsr_ncf, 'w', format="NETCDF3_CLASSIC")
+
+     k.createDimension("time", None)
+     k.createDimension("region", IS_reg_tot)
+     k.createDimension("name_strlen", IS_reg_str)
+
+     tsr_time = k.createVariable("time","i4",("time",))
+     tsr_region = k.createVariable("region","S1",("region","name_strlen",))
+     tsr_area = k.createVariable("area","f8",("region",))
+     if IS_par_tot > 0:
+          tsr_parent = k.createVariable("parent","i4",("region",))
+     tsr_lwe_thickness = k.createVariable("lwe_thickness","f4",                \
+                                          ("time","region",),                  \
+                                          fill_value=ZS_grc_fil)
+     if IS_sol_tot > 1:
+          tsr_lwe_thickness_spread = k.createVariable(                         \
+                                          "lwe_thickness_spread","f4",         \
+                                          ("time","region",),                  \
+                                          fill_value=ZS_grc_fil)
+     for YS_sta in YV_sta_nam:
+          if YS_sta.endswith('_count'):
+               k.createVariable(YS_sta,"i4",("time","region",))
+          else:
+               k.createVariable("lwe_thickness_"+YS_sta,"f4",                  \
+                                ("time","region",),fill_value=ZS_grc_fil)
+
+     #--------------------------------------------------------------------------
+     #Metadata in netCDF global attributes
+     #--------------------------------------------------------------------------
+     print('- Populate global attributes')
+
+     k.Conventions='CF-1.6'
+     k.title=''
+     k.institution=''
+     k.source=h.source
+     k.history='date created: '+dt.isoformat()+'+00:00'
+     k.references='https://github.com/c-h-david/shbaam/'
+     k.comment=''
+     k.featureType='timeSeries'
+     if IS_sol_tot > 1:
+          k.comment='Ensemble mean and spread (standard deviation) of GRACE '  \
+                   +'solutions: '+', '.join(YV_sol_nam)
+
+     #--------------------------------------------------------------------------
+     #Metadata in netCDF variable attributes
+     #--------------------------------------------------------------------------
+     print('- Populate variable attributes')
+
+     for YS_att in ['standard_name','long_name','units','axis','calendar']:
+          if YS_att in f.variables['time'].ncattrs():
+               tsr_time.setncattr(YS_att,f.variables['time'].getncattr(YS_att))
+
+     tsr_region.cf_role='timeseries_id'
+     if shb_reg_key=='NONE':
+          tsr_region.long_name='region'
+     else:
+          tsr_region.long_name='region, given by attribute '+shb_reg_key
+
+     tsr_area.long_name='area of the valid grid cells in region'
+     tsr_area.units='m2'
+
+     if IS_par_tot > 0:
+          tsr_parent.long_name='zero-based index of the parent region, -1 '    \
+                              +'for none'
+
+     tsr_lwe_thickness.long_name='terrestrial water storage anomaly '          \
+                                +'averaged over region'
+     tsr_lwe_thickness.units='cm'
+
+     if IS_sol_tot > 1:
+          tsr_lwe_thickness_spread.long_name='spread of terrestrial water '    \
+                                            +'storage anomaly averaged over '  \
+                                            +'region across GRACE solutions'
+          tsr_lwe_thickness_spread.units='cm'
+
+     for YS_sta in YV_sta_nam:
+          if YS_sta=='valid_count':
+               k.variables[YS_sta].long_name='number of grid cells in region ' \
+                                            +'with valid anomalies'
+          elif YS_sta=='nodata_count':
+               k.variables[YS_sta].long_name='number of grid cells in region ' \
+                                            +'with NoData in scale factors '   \
+                                            +'or in anomalies'
+          else:
+               if YS_sta=='std':
+                    YS_sta_lng='area-weighted standard deviation'
+               elif YS_sta=='min':
+                    YS_sta_lng='minimum'
+               elif YS_sta=='max':
+                    YS_sta_lng='maximum'
+               else:
+                    YS_sta_lng='area-weighted percentile '+YS_sta[1:]
+               k.variables["lwe_thickness_"+YS_sta].long_name=YS_sta_lng       \
+                              +' of terrestrial water storage anomaly over '   \
+                              +'the grid cells of region'
+               k.variables["lwe_thickness_"+YS_sta].units='cm'
+
+     #--------------------------------------------------------------------------
+     #Populate data
+     #--------------------------------------------------------------------------
+     print('- Populate data')
+
+     tsr_region[:]=numpy.array(YV_reg_byt,'S'+str(IS_reg_str)).view('S1')      \
+                              .reshape(IS_reg_tot,IS_reg_str)
+     tsr_area[:]=ZV_reg_sqm
+     if IS_par_tot > 0:
+          tsr_parent[:]=IV_reg_par
+     tsr_time[:]=f.variables['time'][JS_win_beg:JS_win_end]
+     tsr_lwe_thickness[:,:]=numpy.ma.masked_invalid(ZM_wsa)
+     if IS_sol_tot > 1:
+          tsr_lwe_thickness_spread[:,:]=numpy.ma.masked_invalid(ZM_wsa_spr)
+     for JS_sta in range(IS_sta_tot):
+          shb_sta_put(k,YV_sta_nam[JS_sta],0,ZM_sta_wsa[JS_sta,:,:])
+
+     k.close()
+
+
+#*******************************************************************************
+#Append to shb_tsr_ncf
+#*******************************************************************************
+if shb_tsr_ncf!='NONE' and BS_wsa_app:
+     print('Append to shb_tsr_ncf')
 
-time[:]=f.variables['time'][:]
+     k = netCDF4.Dataset(shb_tsr_ncf, 'a')
+
+     if len(k.dimensions['time'])!=JS_app_beg-JS_win_beg                       \
+     or len(k.dimensions['region'])!=IS_reg_tot:
+          print('ERROR - The time steps or regions of '+shb_tsr_ncf            \
+                +' differ from those of '+shb_wsa_ncf)
+          raise SystemExit(22) 
+
+     k.history=k.history+', date appended: '+dt.isoformat()+'+00:00'
+     k.variables['time'][JS_app_beg-JS_win_beg:]=                              \
+                                      f.variables['time'][JS_app_beg:JS_win_end]
+     k.variables['lwe_thickness'][JS_app_beg-JS_win_beg:,:]=                   \
+                                                numpy.ma.masked_invalid(ZM_wsa)
+     for JS_sta in range(IS_sta_tot):
+          shb_sta_put(k,YV_sta_nam[JS_sta],JS_app_beg-JS_win_beg,              \
+                      ZM_sta_wsa[JS_sta,:,:])
+
+     k.close()
+
+
+#*******************************************************************************
+#Write shb_wgt_ncf
+#*******************************************************************************
+if shb_wgt_ncf!='NONE':
+     print('Write shb_wgt_ncf')
+
+     if IS_par_tot > 0:
+          ZV_par_inv=numpy.zeros(IS_par_tot)
+          ZV_par_inv[BV_reg_sqm[IS_lea_tot:]]=                                 \
+                         1/ZV_reg_sqm[IS_lea_tot:][BV_reg_sqm[IS_lea_tot:]]
+          ZM_wgt_par=scipy.sparse.diags(ZV_par_inv)                            \
+                     .dot(ZM_hie)                                              \
+                     .dot(scipy.sparse.diags(ZV_reg_sqm[:IS_lea_tot]))         \
+                     .dot(ZM_wgt[:IS_lea_tot,:])
+          ZM_wgt_coo=scipy.sparse.vstack((ZM_wgt[:IS_lea_tot,:],ZM_wgt_par))   \
+                                  .tocoo()
+     else:
+          ZM_wgt_coo=ZM_wgt.tocoo()
+     IS_wgt_tot=ZM_wgt_coo.nnz
+     #The weights of a parent region are those of the regions it contains, 
+     #times their valid area divided by that of the parent region, as for the
+     #aggregation of their timeseries
+
+     #--------------------------------------------------------------------------
+     #Create netCDF file
+     #--------------------------------------------------------------------------
+     print('- Create netCDF file')
+
+     m = netCDF4.Dataset(shb_wgt_ncf, 'w', format="NETCDF3_CLASSIC")
+
+     m.createDimension("region", IS_reg_tot)
+     m.createDimension("name_strlen", IS_reg_str)
+     m.createDimension("link", IS_wgt_tot)
+
+     wgt_region = m.createVariable("region","S1",("region","name_strlen",))
+     wgt_area = m.createVariable("area","f8",("region",))
+     wgt_region_index = m.createVariable("region_index","i4",("link",))
+     wgt_lat_index = m.createVariable("lat_index","i4",("link",))
+     wgt_lon_index = m.createVariable("lon_index","i4",("link",))
+     wgt_lat = m.createVariable("lat","f4",("link",))
+     wgt_lon = m.createVariable("lon","f4",("link",))
+     wgt_weight = m.createVariable("weight","f8",("link",))
+
+     #--------------------------------------------------------------------------
+     #Metadata in netCDF attributes
+     #--------------------------------------------------------------------------
+     print('- Populate attributes')
+
+     m.title='Sparse weight matrix between regions and GRACE grid cells'
+     m.institution=''
+     m.source=h.source
+     m.history='date created: '+dt.isoformat()+'+00:00'
+     m.references='https://github.com/c-h-david/shbaam/'
+     m.comment='The anomaly averaged over a region is the sum over the '       \
+              +'links of that region of weight*(lwe_thickness-long-term '      \
+              +'mean) at '                                                     \
+              +'(lat_index,lon_index). Weights include scale factors, cell '   \
+              +'areas and the division by the valid area of the region.'
+
+     wgt_region.long_name='region'
+     wgt_area.long_name='area of the valid grid cells in region'
+     wgt_area.units='m2'
+     wgt_region_index.long_name='zero-based index of region'
+     wgt_lat_index.long_name='zero-based index of latitude in GRACE grid'
+     wgt_lon_index.long_name='zero-based index of longitude in GRACE grid'
+     wgt_lat.long_name='latitude'
+     wgt_lat.units='degrees_north'
+     wgt_lon.long_name='longitude'
+     wgt_lon.units='degrees_east'
+     wgt_weight.long_name='weight of grid cell in region'
+     wgt_weight.units='1'
+
+     #--------------------------------------------------------------------------
+     #Populate data
+     #--------------------------------------------------------------------------
+     print('- Populate data')
+
+     wgt_region[:]=numpy.array(YV_reg_byt,'S'+str(IS_reg_str)).view('S1')      \
+                              .reshape(IS_reg_tot,IS_reg_str)
+     wgt_area[:]=ZV_reg_sqm
+     wgt_region_index[:]=ZM_wgt_coo.row
+     wgt_lat_index[:]=IV_dom_lat[ZM_wgt_coo.col]
+     wgt_lon_index[:]=IV_dom_lon[ZM_wgt_coo.col]
+     wgt_lat[:]=ZV_grc_lat[:][IV_dom_lat[ZM_wgt_coo.col]]
+     wgt_lon[:]=ZV_grc_lon[:][IV_dom_lon[ZM_wgt_coo.col]]
+     wgt_weight[:]=ZM_wgt_coo.data
+
+     m.close()
 
 
 #*******************************************************************************
@@ -538,7 +2293,8 @@ time[:]=f.variables['time'][:]
 #*******************************************************************************
 print('Close netCDF files')
 
-f.close()
+for shb_sol in shb_grc_lst:
+     shb_sol.close()
 g.close()
 h.close()
 
@@ -548,9 +2304,9 @@ h.close()
 #*******************************************************************************
 print('Check some computations')
 
-print('- Average of time series: '+str(numpy.average(ZV_wsa)))
-print('- Maximum of time series: '+str(numpy.max(ZV_wsa)))
-print('- Minimum of time series: '+str(numpy.min(ZV_wsa)))
+print('- Average of time series: '+str(numpy.nanmean(ZM_wsa)))
+print('- Maximum of time series: '+str(numpy.nanmax(ZM_wsa)))
+print('- Minimum of time series: '+str(numpy.nanmin(ZM_wsa)))
 
 
 #*******************************************************************************
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#tst_box_shp.py
+#*******************************************************************************
+
+#Purpose:
+#Create a polygon shapefile of one longitude/latitude box given as for
+#shbaam_bbox.py. The polygon has one attribute named box that holds the box as
+#given, so that shbaam_twsa.py with --key=box names its timeseries after the
+#box as shbaam_bbox.py does.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import fiona
+import fiona.crs
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_box (given as lon_min,lat_min,lon_max,lat_max with longitudes in
+#              [-180;180], a box that crosses the antimeridian is not allowed)
+# 2 - shb_box_shp
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg != 3 :
+     print('ERROR - 2 and only 2 arguments can be used')
+     raise SystemExit(22)
+
+shb_box=sys.argv[1]
+shb_box_shp=sys.argv[2]
+
+try:
+     ZS_lon_min,ZS_lat_min,ZS_lon_max,ZS_lat_max=[float(YS_val) for YS_val     \
+                                                  in shb_box.split(',')]
+except ValueError:
+     print('ERROR - The box must be given as lon_min,lat_min,lon_max,lat_max')
+     raise SystemExit(22)
+
+if ZS_lon_min >= ZS_lon_max or ZS_lat_min >= ZS_lat_max:
+     print('ERROR - The minimum must be less than the maximum: '+shb_box)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Command line inputs')
+print('- '+shb_box)
+print('- '+shb_box_shp)
+
+
+#*******************************************************************************
+#Create shapefile
+#*******************************************************************************
+print('Create shapefile')
+
+shb_box_sch={'geometry': 'Polygon', 'properties': {'box': 'str'}}
+ZV_box_crd=[(ZS_lon_min,ZS_lat_min),(ZS_lon_max,ZS_lat_min),                   \
+            (ZS_lon_max,ZS_lat_max),(ZS_lon_min,ZS_lat_max),                   \
+            (ZS_lon_min,ZS_lat_min)]
+
+with fiona.open(shb_box_shp, 'w', driver='ESRI Shapefile',                     \
+                crs=fiona.crs.from_epsg(4326),                                 \
+                schema=shb_box_sch) as shb_box_lay:
+     shb_box_lay.write({'geometry': {'type': 'Polygon',                        \
+                                     'coordinates': [ZV_box_crd]},             \
+                        'properties': {'box': shb_box}})
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
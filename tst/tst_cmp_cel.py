@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#tst_cmp_cel.py
+#*******************************************************************************
+
+#Purpose:
+#Compare a netCDF file with the layout of domain cells of shbaam_lsma.py
+#(--lay=cell) with a netCDF file with the layout of the grid. The coordinates
+#of each cell and the (time,cell) values of all variables are compared with
+#those of the grid at the lat_index and lon_index of the cell.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import netCDF4
+import math
+import numpy
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - rrr_cel_file
+# 2 - rrr_grd_file
+#(3)- relative tolerance
+#(4)- absolute tolerance
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg < 3 or IS_arg > 5:
+     print('ERROR - A minimum of 2 and a maximum of 4 arguments can be used')
+     raise SystemExit(22)
+
+rrr_cel_file=sys.argv[1]
+rrr_grd_file=sys.argv[2]
+if IS_arg > 3:
+     ZS_rtol=float(sys.argv[3])
+else:
+     ZS_rtol=float(0)
+if IS_arg > 4:
+     ZS_atol=float(sys.argv[4])
+else:
+     ZS_atol=float(0)
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Comparing netCDF files of domain cells and of the grid')
+print('netCDF file of domain cells   :'+rrr_cel_file)
+print('netCDF file of the grid       :'+rrr_grd_file)
+print('Relative tolerance            :'+str(ZS_rtol))
+print('Absolute tolerance            :'+str(ZS_atol))
+print('-------------------------------')
+
+
+#*******************************************************************************
+#Test if input files exist
+#*******************************************************************************
+try:
+     with open(rrr_cel_file) as file:
+          pass
+except IOError as e:
+     print('Unable to open '+rrr_cel_file)
+     raise SystemExit(22)
+
+try:
+     with open(rrr_grd_file) as file:
+          pass
+except IOError as e:
+     print('Unable to open '+rrr_grd_file)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read and compare netCDF files
+#*******************************************************************************
+
+#-------------------------------------------------------------------------------
+#Open files and get dimensions
+#-------------------------------------------------------------------------------
+f1 = netCDF4.Dataset(rrr_cel_file, "r")
+f2 = netCDF4.Dataset(rrr_grd_file, "r")
+
+for YS_dim in ['time','cell']:
+     if YS_dim not in f1.dimensions:
+          print('ERROR - '+YS_dim+' is not a dimension in: '+rrr_cel_file)
+          raise SystemExit(99)
+
+for YS_dim in ['time','lat','lon']:
+     if YS_dim not in f2.dimensions:
+          print('ERROR - '+YS_dim+' is not a dimension in: '+rrr_grd_file)
+          raise SystemExit(99)
+
+IS_cel=len(f1.dimensions['cell'])
+print('Number of domain cells        :'+str(IS_cel))
+
+if len(f1.dimensions['time'])==len(f2.dimensions['time']):
+     IS_time=len(f1.dimensions['time'])
+     print('Common number of time steps   :'+str(IS_time))
+else:
+     print('ERROR - The number of time steps differs: '                        \
+           +str(len(f1.dimensions['time']))+' <> '                             \
+           +str(len(f2.dimensions['time'])))
+     raise SystemExit(99)
+
+YV_var=[YS_var for YS_var in f1.variables                                      \
+        if f1.variables[YS_var].dimensions==('time','cell')]
+for YS_var in YV_var:
+     if YS_var not in f2.variables:
+          print('ERROR - '+YS_var+' is not a variable in: '+rrr_grd_file)
+          raise SystemExit(99)
+print('Common variable names         :'+','.join(YV_var))
+
+print('-------------------------------')
+
+#-------------------------------------------------------------------------------
+#Compare coordinate values of the cells with those of the grid
+#-------------------------------------------------------------------------------
+IV_lat_idx=f1.variables['lat_index'][:]
+IV_lon_idx=f1.variables['lon_index'][:]
+
+if numpy.array_equal(f1.variables['time'][:],f2.variables['time'][:]):
+     print('The times are the same')
+else:
+     print('ERROR: The times differ')
+     raise SystemExit(99)
+
+if numpy.array_equal(f1.variables['lon'][:],                                   \
+                     f2.variables['lon'][:][IV_lon_idx]):
+     print('The longitudes are the same')
+else:
+     print('ERROR: The longitudes differ')
+     raise SystemExit(99)
+
+if numpy.array_equal(f1.variables['lat'][:],                                   \
+                     f2.variables['lat'][:][IV_lat_idx]):
+     print('The latitudes are the same')
+else:
+     print('ERROR: The latitudes differ')
+     raise SystemExit(99)
+
+print('-------------------------------')
+
+#-------------------------------------------------------------------------------
+#Compute differences
+#-------------------------------------------------------------------------------
+ZS_rdif_max=0
+ZS_adif_max=0
+
+for YS_var in YV_var:
+     ZM_Var_1=f1.variables[YS_var][:]
+     ZM_Var_2=f2.variables[YS_var][:][:,IV_lat_idx,IV_lon_idx]
+     #The grid is read once and the cells are gathered in memory
+
+     ZM_mask1=numpy.logical_not(numpy.ma.getmaskarray(ZM_Var_1))               \
+             &numpy.logical_not(numpy.isnan(numpy.ma.getdata(ZM_Var_1)))
+     ZM_mask2=numpy.logical_not(numpy.ma.getmaskarray(ZM_Var_2))               \
+             &numpy.logical_not(numpy.isnan(numpy.ma.getdata(ZM_Var_2)))
+     #Cells outside of the data (NaN) count as NoData as well
+     if numpy.array_equal(ZM_mask1,ZM_mask2):
+          ZM_mask=ZM_mask1
+     else:
+          print('ERROR - The locations of NoData differ for '+YS_var)
+          raise SystemExit(99)
+
+     ZM_Var_1=numpy.where(ZM_mask,numpy.ma.getdata(ZM_Var_1),0)
+     ZM_Var_2=numpy.where(ZM_mask,numpy.ma.getdata(ZM_Var_2),0)
+     ZM_dVar_abs=numpy.absolute(ZM_Var_1-ZM_Var_2)
+     ZS_adif_max=max(numpy.max(ZM_dVar_abs),ZS_adif_max)
+
+     for JS_time in range(IS_time):
+          ZS_rdif=numpy.sum(ZM_dVar_abs[JS_time,:]**2)
+          if ZS_rdif > 0:
+               ZS_rdif=math.sqrt(ZS_rdif/numpy.sum(ZM_Var_1[JS_time,:]**2))
+               ZS_rdif_max=max(ZS_rdif,ZS_rdif_max)
+
+
+#*******************************************************************************
+#Print difference values and comparing values to tolerance
+#*******************************************************************************
+print('Max relative difference       :'+'{0:.2e}'.format(ZS_rdif_max))
+print('Max absolute difference       :'+'{0:.2e}'.format(ZS_adif_max))
+print('-------------------------------')
+
+if ZS_rdif_max > ZS_rtol:
+     print('Unacceptable rel. difference!!!')
+     print('-------------------------------')
+     raise SystemExit(99)
+
+if ZS_adif_max > ZS_atol:
+     print('Unacceptable abs. difference!!!')
+     print('-------------------------------')
+     raise SystemExit(99)
+
+print('netCDF files similar!!!')
+print('-------------------------------')
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
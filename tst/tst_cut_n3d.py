@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#tst_cut_n3d.py
+#*******************************************************************************
+
+#Purpose:
+#Copy the time steps of a netCDF file that are within a time window given as
+#for shbaam_twsa.py (--beg and --end) into a new netCDF file, so that the
+#outputs of a time window can be compared with those of the full record using
+#tst_cmp_n3d.py. Variables without a time dimension are copied as they are.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import datetime
+import netCDF4
+import numpy
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - rrr_ncf_file1
+# 2 - rrr_ncf_file2
+# 3 - rrr_beg_dat (given as YYYY-MM-DD)
+# 4 - rrr_end_dat (given as YYYY-MM-DD)
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg != 5 :
+     print('ERROR - 4 and only 4 arguments can be used')
+     raise SystemExit(22)
+
+rrr_ncf_file1=sys.argv[1]
+rrr_ncf_file2=sys.argv[2]
+rrr_beg_dat=sys.argv[3]
+rrr_end_dat=sys.argv[4]
+
+try:
+     rrr_dat_beg=datetime.datetime.strptime(rrr_beg_dat,'%Y-%m-%d')
+     rrr_dat_end=datetime.datetime.strptime(rrr_end_dat,'%Y-%m-%d')
+except ValueError:
+     print('ERROR - The days must be given as YYYY-MM-DD')
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Cutting a time window of a netCDF file')
+print('- '+rrr_ncf_file1)
+print('- '+rrr_ncf_file2)
+print('- '+rrr_beg_dat)
+print('- '+rrr_end_dat)
+
+
+#*******************************************************************************
+#Test if input file exists
+#*******************************************************************************
+try:
+     with open(rrr_ncf_file1) as file:
+          pass
+except IOError as e:
+     print('Unable to open '+rrr_ncf_file1)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Find time steps within the time window
+#*******************************************************************************
+print('Find time steps within the time window')
+
+f1 = netCDF4.Dataset(rrr_ncf_file1, 'r')
+
+ZV_time=f1.variables['time'][:]
+ZS_beg=netCDF4.date2num(rrr_dat_beg,f1.variables['time'].units)
+ZS_end=netCDF4.date2num(rrr_dat_end+datetime.timedelta(days=1),              \
+                        f1.variables['time'].units)
+#The last day of the time window is included
+IV_win=numpy.flatnonzero((ZV_time >= ZS_beg) & (ZV_time < ZS_end))
+print(' - The number of time steps in the time window is: '+str(len(IV_win)))
+
+
+#*******************************************************************************
+#Copy time steps within the time window
+#*******************************************************************************
+print('Copy time steps within the time window')
+
+f2 = netCDF4.Dataset(rrr_ncf_file2, 'w', format=f1.data_model)
+
+for YS_dim, shb_dim in f1.dimensions.items():
+     if YS_dim=='time':
+          f2.createDimension(YS_dim, None if shb_dim.isunlimited()             \
+                                     else len(IV_win))
+     else:
+          f2.createDimension(YS_dim, None if shb_dim.isunlimited()             \
+                                     else len(shb_dim))
+
+f2.setncatts({YS_att: f1.getncattr(YS_att) for YS_att in f1.ncattrs()})
+
+for YS_var, shb_var in f1.variables.items():
+     YV_att=shb_var.ncattrs()
+     if '_FillValue' in YV_att:
+          f2_var=f2.createVariable(YS_var, shb_var.datatype,                   \
+                                   shb_var.dimensions,                         \
+                                   fill_value=shb_var.getncattr('_FillValue'))
+     else:
+          f2_var=f2.createVariable(YS_var, shb_var.datatype,                   \
+                                   shb_var.dimensions)
+     f2_var.setncatts({YS_att: shb_var.getncattr(YS_att) for YS_att in YV_att  \
+                       if YS_att!='_FillValue'})
+     if shb_var.dimensions[:1]==('time',):
+          f2_var[:]=shb_var[IV_win]
+     else:
+          f2_var[:]=shb_var[:]
+
+f1.close()
+f2.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
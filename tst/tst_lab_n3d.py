@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#tst_lab_n3d.py
+#*******************************************************************************
+
+#Purpose:
+#Create a netCDF label raster for shbaam_twsa.py from a netCDF file of
+#anomalies created by shbaam_twsa.py. The grid cells where anomalies are
+#written at any time step are labeled with 1 and the other grid cells have the
+#fill value, so that the label raster gives the same domain as the polygons of
+#the netCDF file of anomalies without any geometry operation.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import netCDF4
+import numpy
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_wsa_ncf
+# 2 - shb_lab_ncf
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg != 3 :
+     print('ERROR - 2 and only 2 arguments can be used')
+     raise SystemExit(22)
+
+shb_wsa_ncf=sys.argv[1]
+shb_lab_ncf=sys.argv[2]
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Command line inputs')
+print('- '+shb_wsa_ncf)
+print('- '+shb_lab_ncf)
+
+
+#*******************************************************************************
+#Test if input file exists
+#*******************************************************************************
+try:
+     with open(shb_wsa_ncf) as file:
+          pass
+except IOError as e:
+     print('Unable to open '+shb_wsa_ncf)
+     raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read netCDF file of anomalies
+#*******************************************************************************
+print('Read netCDF file of anomalies')
+
+f = netCDF4.Dataset(shb_wsa_ncf, 'r')
+ZV_lat=f.variables['lat'][:]
+ZV_lon=f.variables['lon'][:]
+BM_dom=numpy.logical_not(numpy.all(numpy.ma.getmaskarray(                      \
+                         f.variables['lwe_thickness'][:]),axis=0))
+f.close()
+
+print(' - The number of labeled grid cells is: '+str(numpy.sum(BM_dom)))
+
+
+#*******************************************************************************
+#Create label raster
+#*******************************************************************************
+print('Create label raster')
+
+g = netCDF4.Dataset(shb_lab_ncf, 'w', format='NETCDF3_CLASSIC')
+
+lat = g.createDimension('lat', len(ZV_lat))
+lon = g.createDimension('lon', len(ZV_lon))
+
+lat = g.createVariable('lat', 'f4', ('lat',))
+lon = g.createVariable('lon', 'f4', ('lon',))
+label = g.createVariable('label', 'i4', ('lat','lon',), fill_value=-9999)
+
+lat[:]=ZV_lat
+lon[:]=ZV_lon
+label[:]=numpy.ma.masked_array(numpy.ones(BM_dom.shape,dtype=numpy.int32),    \
+                               mask=numpy.logical_not(BM_dom))
+
+g.close()
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************
@@ -1067,6 +1067,1004 @@ echo "********************"
 fi
 
 
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, no point shapefile
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, no point shapefile"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, FourDoabs, rtree selection
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, FourDoabs, rtree selection"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/FourDoabs.shp                                         \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_FourDoabs_GRCa_tst.csv                    \
+     ../output/SERVIR_STK/map_FourDoabs_GRCa_tst.nc                            \
+     --sel=rtree                                                               \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing shapefiles"
+./tst_cmp_shp.py                                                               \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt.shp                                \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_FourDoabs_GRCa.csv                        \
+     ../output/SERVIR_STK/timeseries_FourDoabs_GRCa_tst.csv                    \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_FourDoabs_GRCa.nc                                \
+     ../output/SERVIR_STK/map_FourDoabs_GRCa_tst.nc                            \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, NorthWestBD, compressed netCDF4
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, NorthWestBD, compressed netCDF4"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/NorthWestBD.shp                                       \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     --fmt=NETCDF4                                                             \
+     --zlb=4                                                                   \
+     --chk=12,60,60                                                            \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa.csv                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa.nc                              \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, NorthWestBD, streamed time chunks
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, NorthWestBD, streamed time chunks"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/NorthWestBD.shp                                       \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     --mem=1                                                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa.csv                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa.nc                              \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, NorthWestBD, memory-mapped inputs
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, NorthWestBD, memory-mapped inputs"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/NorthWestBD.shp                                       \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     --mmp=1                                                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa.csv                      \
+     ../output/SERVIR_STK/timeseries_NorthWestBD_GRCa_tst.csv                  \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa.nc                              \
+     ../output/SERVIR_STK/map_NorthWestBD_GRCa_tst.nc                          \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, persistent cache
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+rm -rf ../output/SERVIR_STK/cache_tst
+
+echo "- Terrestrial water storage anomalies, Nepal, cache creation"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --cch=../output/SERVIR_STK/cache_tst                                      \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal, cache use"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --cch=../output/SERVIR_STK/cache_tst                                      \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Checking cache use"
+grep -q "The domain was found in cache" $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed cache use: $run_file" >&2 ; exit 99 ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -rf ../output/SERVIR_STK/cache_tst
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal box, summed-area tables
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Box shapefile, Nepal box"
+./tst_box_shp.py                                                               \
+     80,26,88.5,30.5                                                           \
+     ../output/SERVIR_STK/box_Nepal_tst.shp                                    \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal box"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../output/SERVIR_STK/box_Nepal_tst.shp                                    \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_box_Nepal_GRCa_tst.csv                    \
+     ../output/SERVIR_STK/map_box_Nepal_GRCa_tst.nc                            \
+     --key=box                                                                 \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Summed-area tables"
+../src/shbaam_sats.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../output/SERVIR_STK/GRCTellus.JPL.sat_tst.nc                             \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Box query, Nepal box"
+../src/shbaam_bbox.py                                                          \
+     ../output/SERVIR_STK/GRCTellus.JPL.sat_tst.nc                             \
+     ../output/SERVIR_STK/timeseries_box_Nepal_GRCa_sat_tst.csv                \
+     80,26,88.5,30.5                                                           \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_box_Nepal_GRCa_tst.csv                    \
+     ../output/SERVIR_STK/timeseries_box_Nepal_GRCa_sat_tst.csv                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, prepared anomalies
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Prepared anomalies"
+../src/shbaam_prep.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../output/SERVIR_STK/GRCTellus.JPL.prp_tst.nc                             \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal, prepared anomalies"
+../src/shbaam_twsa.py                                                          \
+     ../output/SERVIR_STK/GRCTellus.JPL.prp_tst.nc                             \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     NONE                                                                      \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --prp=1                                                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Land surface model anomalies, CLM and NOAH, Nepal, several models
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Land surface model anomalies, CLM and NOAH, Nepal, several models"
+../src/shbaam_lsma.py                                                          \
+     ../output/SERVIR_STK/GLDAS_CLM10_M.A200204_201701.nc,../output/SERVIR_STK/GLDAS_NOAH10_M.A200204_201701.nc \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv,../output/SERVIR_STK/timeseries_Nepal_NOAHa_tst.csv \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc,../output/SERVIR_STK/map_Nepal_NOAHa_tst.nc \
+     --workers=2                                                               \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing shapefiles"
+./tst_cmp_shp.py                                                               \
+     ../output/SERVIR_STK/GLDAS.pnt.shp                                        \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries, CLM"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps, CLM"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_CLMa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries, NOAH"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_NOAHa.csv                           \
+     ../output/SERVIR_STK/timeseries_Nepal_NOAHa_tst.csv                       \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps, NOAH"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_NOAHa.nc                                   \
+     ../output/SERVIR_STK/map_Nepal_NOAHa_tst.nc                               \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Land surface model anomalies, CLM, Nepal, index of monthly files
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Land surface model anomalies, CLM, Nepal, concatenated file"
+../src/shbaam_lsma.py                                                          \
+     ../output/SERVIR_STK/GLDAS_CLM10_M.A200204_200403.nc                      \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GLDAS.pnt_cnc_tst.shp                                \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_cnc_tst.csv                    \
+     ../output/SERVIR_STK/map_Nepal_CLMa_cnc_tst.nc                            \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Index of GLDAS files, CLM"
+../src/shbaam_indx.py                                                          \
+     ../input/GLDAS/GLDAS_CLM10_M/                                             \
+     ../output/SERVIR_STK/GLDAS_CLM10_M.A200204_200403_tst.json                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Land surface model anomalies, CLM, Nepal, index of monthly files"
+../src/shbaam_lsma.py                                                          \
+     ../output/SERVIR_STK/GLDAS_CLM10_M.A200204_200403_tst.json                \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc                                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing shapefiles"
+./tst_cmp_shp.py                                                               \
+     ../output/SERVIR_STK/GLDAS.pnt_cnc_tst.shp                                \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_cnc_tst.csv                    \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_CLMa_cnc_tst.nc                            \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Land surface model anomalies, CLM, Nepal, layout of domain cells
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Land surface model anomalies, CLM, Nepal, layout of domain cells"
+../src/shbaam_lsma.py                                                          \
+     ../output/SERVIR_STK/GLDAS_CLM10_M.A200204_201701.nc                      \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc                                \
+     --lay=cell                                                                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing shapefiles"
+./tst_cmp_shp.py                                                               \
+     ../output/SERVIR_STK/GLDAS.pnt.shp                                        \
+     ../output/SERVIR_STK/GLDAS.pnt_tst.shp                                    \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_CLMa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_cel.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_CLMa_tst.nc                                \
+     ../output/SERVIR_STK/map_Nepal_CLMa.nc                                    \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, baseline period and append mode
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, baseline period"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_bsl_tst.csv                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_bsl_tst.nc                            \
+     --bsl=2004-01-01,2009-12-31                                               \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal, baseline period, truncated"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --bsl=2004-01-01,2009-12-31                                               \
+     --end=2009-12-31                                                          \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal, baseline period, appended"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --bsl=2004-01-01,2009-12-31                                               \
+     --app=1                                                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_bsl_tst.csv                    \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa_bsl_tst.nc                            \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, several solutions
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, several solutions"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc,../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_sol_tst.csv                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --sol=JPL,JPL2                                                            \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+#The same solution is given twice so that each solution and the ensemble mean
+#are those of the unique solution, with a spread of zero
+
+cut -d ',' -f 1,3 ../output/SERVIR_STK/timeseries_Nepal_GRCa_sol_tst.csv       \
+     | sed -e '1s/TWSa_JPL2/TWSa/'                                             \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv
+cut -d ',' -f 1,4 ../output/SERVIR_STK/timeseries_Nepal_GRCa_sol_tst.csv       \
+     | sed -e '1s/TWSa_mean/TWSa/'                                             \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_avg_tst.csv
+cut -d ',' -f 1,5 ../output/SERVIR_STK/timeseries_Nepal_GRCa_sol_tst.csv       \
+     | sed -e '1s/TWSa_spread/TWSa/'                                           \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_spr_tst.csv
+cut -d ',' -f 1 ../output/SERVIR_STK/timeseries_Nepal_GRCa_sol_tst.csv         \
+     | sed -e '1s/$/,TWSa/' -e '2,$s/$/,0.0/'                                  \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_nul_tst.csv
+#The columns of the second solution, of the ensemble mean and of the spread
+#are extracted with the header of a unique solution
+
+echo "- Comparing timeseries, second solution"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries, ensemble mean"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_avg_tst.csv                    \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries, ensemble spread"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_nul_tst.csv                    \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_spr_tst.csv                    \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps, ensemble mean"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, several workers
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, several workers"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --workers=2                                                               \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, time window
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, time window"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --beg=2003-01-01                                                          \
+     --end=2003-12-31                                                          \
+     --bsl=2002-04-01,2017-01-31                                               \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+#The baseline period covers the full record so that the long-term mean is that
+#of the full record
+
+echo "- Cutting the time window of the full record"
+sed -n -e '1p' -e '/\/2003,/p'                                                 \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_win_tst.csv
+./tst_cut_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_win_tst.nc                            \
+     2003-01-01                                                                \
+     2003-12-31                                                                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_win_tst.csv                    \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa_win_tst.nc                            \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, statistics of grid cells
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Terrestrial water storage anomalies, Nepal, statistics of grid cells"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../input/SERVIR_STK/Nepal.shp                                             \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_sta_tst.csv                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     --sta=std,min,max,count                                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Statistics of grid cells, computed from the map"
+./tst_sta_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_sta_tst.csv                    \
+     1e-6                                                                      \
+     1e-5                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+#The map holds anomalies in single precision, hence the absolute tolerance
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
+#*******************************************************************************
+#Terrestrial water storage anomalies, Nepal, label raster
+#*******************************************************************************
+unt=$((unt+1))
+if [ "$unt" -ge "$fst" ] && [ "$unt" -le "$lst" ] ; then
+echo "Running unit test $unt/x"
+run_file=tmp_run_$unt.txt
+cmp_file=tmp_cmp_$unt.txt
+
+echo "- Label raster of the domain of Nepal"
+./tst_lab_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/label_Nepal_tst.nc                                   \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+echo "- Terrestrial water storage anomalies, Nepal, label raster"
+../src/shbaam_twsa.py                                                          \
+     ../input/GRACE/GRCTellus.JPL.200204_201701.GLO.RL05M_1.MSCNv02CRIv02.nc   \
+     ../input/GRACE/CLM4.SCALE_FACTOR.JPL.MSCNv01CRIv01.nc                     \
+     ../output/SERVIR_STK/label_Nepal_tst.nc                                   \
+     ../output/SERVIR_STK/GRCTellus.JPL.pnt_tst.shp                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_lab_tst.csv                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     > $run_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed run: $run_file" >&2 ; exit $x ; fi
+
+sed -e '1s/.*/date,TWSa/'                                                      \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_lab_tst.csv                    \
+     > ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv
+#The region of the label raster is named after its label
+
+echo "- Comparing timeseries"
+./tst_cmp_csv.py                                                               \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa.csv                            \
+     ../output/SERVIR_STK/timeseries_Nepal_GRCa_tst.csv                        \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+echo "- Comparing maps"
+./tst_cmp_n3d.py                                                               \
+     ../output/SERVIR_STK/map_Nepal_GRCa.nc                                    \
+     ../output/SERVIR_STK/map_Nepal_GRCa_tst.nc                                \
+     1e-6                                                                      \
+     1e-6                                                                      \
+     > $cmp_file
+x=$? && if [ $x -gt 0 ] ; then echo "Failed comparison: $cmp_file" >&2 ; exit $x ; fi
+
+rm -f $run_file
+rm -f $cmp_file
+echo "Success"
+echo "********************"
+fi
+
+
 #*******************************************************************************
 #Clean up
 #*******************************************************************************
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#*******************************************************************************
+#tst_sta_n3d.py
+#*******************************************************************************
+
+#Purpose:
+#Compute the statistics of shbaam_twsa.py (--sta=std,min,max,count) of the
+#grid cells of a netCDF file of anomalies created by shbaam_twsa.py for one
+#unique region, independently from shbaam_twsa.py. The values of the grid
+#cells are their anomalies times their scale factors, grid cells with NoData in
+#the scale factors or in the anomalies are excluded, and the weights are the
+#cosines of the latitudes. The dates are those of a CSV file of the same
+#time steps. A CSV file is created with the average, area-weighted standard
+#deviation, minimum, maximum and numbers of valid and NoData grid cells at each
+#time step.
+#Author:
+#Cedric H. David, 2020
+
+
+#*******************************************************************************
+#Prerequisites
+#*******************************************************************************
+import sys
+import csv
+import netCDF4
+import numpy
+
+
+#*******************************************************************************
+#Declaration of variables (given as command line arguments)
+#*******************************************************************************
+# 1 - shb_wsa_ncf
+# 2 - shb_fct_ncf
+# 3 - shb_wsa_csv
+# 4 - shb_sta_csv
+
+
+#*******************************************************************************
+#Get command line arguments
+#*******************************************************************************
+IS_arg=len(sys.argv)
+if IS_arg != 5 :
+     print('ERROR - 4 and only 4 arguments can be used')
+     raise SystemExit(22)
+
+shb_wsa_ncf=sys.argv[1]
+shb_fct_ncf=sys.argv[2]
+shb_wsa_csv=sys.argv[3]
+shb_sta_csv=sys.argv[4]
+
+
+#*******************************************************************************
+#Print current variables
+#*******************************************************************************
+print('Computing statistics of grid cells')
+print('- '+shb_wsa_ncf)
+print('- '+shb_fct_ncf)
+print('- '+shb_wsa_csv)
+print('- '+shb_sta_csv)
+
+
+#*******************************************************************************
+#Test if input files exist
+#*******************************************************************************
+for YS_fil in [shb_wsa_ncf,shb_fct_ncf,shb_wsa_csv]:
+     try:
+          with open(YS_fil) as file:
+               pass
+     except IOError as e:
+          print('Unable to open '+YS_fil)
+          raise SystemExit(22)
+
+
+#*******************************************************************************
+#Read files
+#*******************************************************************************
+print('Read files')
+
+f = netCDF4.Dataset(shb_wsa_ncf, 'r')
+ZM_wsa=f.variables['lwe_thickness'][:]
+ZV_lat=f.variables['lat'][:]
+f.close()
+
+g = netCDF4.Dataset(shb_fct_ncf, 'r')
+ZM_fct=g.variables['scale_factor'][:]
+g.close()
+
+with open(shb_wsa_csv) as csv_file:
+     reader=csv.reader(csv_file,dialect='excel')
+     YV_dat=[row[0] for row in reader][1:]
+
+IS_time=ZM_wsa.shape[0]
+if len(YV_dat)!=IS_time:
+     print('ERROR - The number of time steps differs: '                        \
+           +str(len(YV_dat))+' <> '+str(IS_time))
+     raise SystemExit(99)
+
+
+#*******************************************************************************
+#Compute statistics
+#*******************************************************************************
+print('Compute statistics')
+
+BM_dom=numpy.logical_not(numpy.ma.getmaskarray(ZM_wsa[0,:,:]))
+#The grid cells of the domain are those where anomalies are written
+IS_dom=numpy.sum(BM_dom)
+print(' - The number of grid cells in the domain is: '+str(IS_dom))
+
+ZM_wgt=numpy.cos(numpy.radians(ZV_lat.astype(numpy.float64)))[:,numpy.newaxis]\
+      *numpy.ones(BM_dom.shape)
+
+with open(shb_sta_csv, 'w') as csv_file:
+     writer=csv.writer(csv_file,dialect='excel')
+     writer.writerow(['date','TWSa','TWSa_std','TWSa_min','TWSa_max',          \
+                      'TWSa_valid_count','TWSa_nodata_count'])
+     for JS_time in range(IS_time):
+          ZM_val=numpy.ma.filled(ZM_wsa[JS_time,:,:].astype(numpy.float64)     \
+                                 *ZM_fct.astype(numpy.float64),numpy.nan)
+          BM_vld=BM_dom & numpy.logical_not(numpy.isnan(ZM_val))
+          ZV_val=ZM_val[BM_vld]
+          ZV_wgt=ZM_wgt[BM_vld]
+          ZS_avg=numpy.sum(ZV_wgt*ZV_val)/numpy.sum(ZV_wgt)
+          ZS_std=numpy.sqrt(numpy.sum(ZV_wgt*(ZV_val-ZS_avg)**2)               \
+                            /numpy.sum(ZV_wgt))
+          writer.writerow([YV_dat[JS_time],ZS_avg,ZS_std,numpy.min(ZV_val),    \
+                           numpy.max(ZV_val),len(ZV_val),IS_dom-len(ZV_val)])
+
+
+#*******************************************************************************
+#End
+#*******************************************************************************